@@ -68,10 +68,12 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 from streamlit_option_menu import option_menu
-from utils.database_unified import init_db
-from components.forms import coordinator_form, verifier_form, warehouse_form, csv_upload, incident_form, search_incident_form, incident_record_form, manage_incident_actions_form, edit_coordinator_form, edit_verifier_form, edit_warehouse_form, edit_incident_form
+from utils.bootstrap import ensure_initialized
+from utils.rerun import begin_rerun
+from utils.instrumentation import set_page
+from components.forms import coordinator_form, verifier_form, warehouse_form, csv_upload, incident_form, search_incident_form, text_search_form, incident_record_form, manage_incident_actions_form, edit_coordinator_form, edit_verifier_form, edit_warehouse_form, edit_incident_form
 from components.analytics import analytics_incidents, analytics_verifiers, analytics_warehouses
-from components.delete import delete_test_data_form, backup_database_form, export_excel_form, restore_database_form
+from components.delete import delete_test_data_form, backup_database_form, export_excel_form, restore_database_form, diagnostics_form
 from components.dashboard import dashboard_main, handle_dashboard_navigation
 import hashlib
 import logging
@@ -80,20 +82,13 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Inicializar la base de datos
-logger.info("Initializing database from app.py...")
-init_db()
-logger.info("Database initialization completed.")
+# Nuevo rerun: las instantáneas de datos se obtienen como máximo una vez por ejecución
+begin_rerun()
 
-# Inicializar datos por defecto en entornos de deploy
-try:
-    from config import is_deployed_environment
-    if is_deployed_environment():
-        from init_default_data import run_default_initialization
-        logger.info("Deploy environment detected, checking for default data...")
-        run_default_initialization()
-except ImportError:
-    logger.info("Default data initialization not available")
+# Inicializar la base de datos y los datos por defecto una sola vez por proceso
+health = ensure_initialized()
+if not health.database_ready:
+    st.error("No se pudo inicializar la base de datos. Revisa la configuración y recarga la página.")
 
 # Login
 if 'logged_in' not in st.session_state:
@@ -194,6 +189,8 @@ else:
     if main_selected != "Incidencias" and 'in_manage_actions' in st.session_state:
         del st.session_state['in_manage_actions']
     
+    set_page(main_selected)
+    
     if main_selected == "Dashboard":
         dashboard_main()
     
@@ -215,6 +212,7 @@ else:
                 menu_icon="plus",
                 default_index=sub_default_idx,
             )
+        set_page(f"{main_selected} / {sub_selected}")
 
         if sub_selected == "Alta Coordinador":
             coordinator_form()
@@ -238,6 +236,7 @@ else:
                 menu_icon="pencil",
                 default_index=0,
             )
+        set_page(f"{main_selected} / {sub_selected}")
 
         if sub_selected == "Editar Coordinador":
             edit_coordinator_form()
@@ -253,7 +252,7 @@ else:
             # Determinar índice por defecto para submenú
             sub_default_idx = 0
             if 'sub_menu_override' in st.session_state:
-                sub_options = ["Registro de Incidencia", "Gestión de Acciones", "Buscar por Código"]
+                sub_options = ["Registro de Incidencia", "Gestión de Acciones", "Buscar por Código", "Búsqueda de Texto"]
                 override_sub = st.session_state['sub_menu_override']
                 if override_sub in sub_options:
                     sub_default_idx = sub_options.index(override_sub)
@@ -261,11 +260,12 @@ else:
             
             sub_selected = option_menu(
                 menu_title="Incidencias",
-                options=["Registro de Incidencia", "Gestión de Acciones", "Buscar por Código"],
-                icons=["clipboard-plus", "pencil-square", "search"],
+                options=["Registro de Incidencia", "Gestión de Acciones", "Buscar por Código", "Búsqueda de Texto"],
+                icons=["clipboard-plus", "pencil-square", "search", "file-earmark-text"],
                 menu_icon="exclamation",
                 default_index=sub_default_idx,
             )
+        set_page(f"{main_selected} / {sub_selected}")
 
         # Limpiar contexto de gestión de acciones si se navega a otra subsección
         if sub_selected != "Gestión de Acciones" and 'in_manage_actions' in st.session_state:
@@ -277,6 +277,8 @@ else:
             manage_incident_actions_form()
         elif sub_selected == "Buscar por Código":
             search_incident_form()
+        elif sub_selected == "Búsqueda de Texto":
+            text_search_form()
 
     elif main_selected == "Consultas y Analítica":
         with st.sidebar:
@@ -287,6 +289,7 @@ else:
                 menu_icon="graph-up",
                 default_index=0,
             )
+        set_page(f"{main_selected} / {sub_selected}")
 
         if sub_selected == "Analítica de Incidencias":
             analytics_incidents()
@@ -296,11 +299,18 @@ else:
             analytics_warehouses()
 
     elif main_selected == "Administración":
+        admin_options = ["Copia de Seguridad", "Restaurar Copia", "Exportar a Excel", "Borrar Datos de Prueba"]
+        admin_icons = ["shield-check", "arrow-clockwise", "file-earmark-excel", "trash"]
+        # El panel de diagnóstico solo lo ven los administradores
+        if role == "admin":
+            admin_options.append("Diagnóstico")
+            admin_icons.append("activity")
+        
         with st.sidebar:
             # Determinar índice por defecto para submenú
             sub_default_idx = 0
             if 'sub_menu_override' in st.session_state:
-                sub_options = ["Copia de Seguridad", "Restaurar Copia", "Exportar a Excel", "Borrar Datos de Prueba"]
+                sub_options = admin_options
                 override_sub = st.session_state['sub_menu_override']
                 if override_sub in sub_options:
                     sub_default_idx = sub_options.index(override_sub)
@@ -308,11 +318,12 @@ else:
             
             sub_selected = option_menu(
                 menu_title="Administración",
-                options=["Copia de Seguridad", "Restaurar Copia", "Exportar a Excel", "Borrar Datos de Prueba"],
-                icons=["shield-check", "arrow-clockwise", "file-earmark-excel", "trash"],
+                options=admin_options,
+                icons=admin_icons,
                 menu_icon="gear",
                 default_index=sub_default_idx,
             )
+        set_page(f"{main_selected} / {sub_selected}")
 
         if sub_selected == "Copia de Seguridad":
             backup_database_form()
@@ -321,4 +332,6 @@ else:
         elif sub_selected == "Exportar a Excel":
             export_excel_form()
         elif sub_selected == "Borrar Datos de Prueba":
-            delete_test_data_form()
\ No newline at end of file
+            delete_test_data_form()
+        elif sub_selected == "Diagnóstico":
+            diagnostics_form()
\ No newline at end of file
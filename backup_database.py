@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Script para crear una copia de seguridad de Supabase (pensado para ejecutarse cada noche)
+
+Cada copia es incremental respecto a la anterior (solo registros y acciones nuevos o
+modificados), salvo la primera y una de cada BACKUP_FULL_EVERY, que son completas.
+
+Uso:
+    python backup_database.py           # copia incremental (o completa si toca)
+    python backup_database.py --full    # copia completa
+"""
+
+import os
+import time
+import logging
+import argparse
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Crea una copia de seguridad de Supabase en NDJSON comprimido')
+    parser.add_argument('--full', action='store_true', help='Copiar todas las filas aunque exista una copia anterior')
+    args = parser.parse_args()
+
+    from utils.database_supabase import create_backup
+    from utils.ndjson_backup import verify_backup
+
+    started = time.perf_counter()
+    try:
+        archive_path = create_backup(full=args.full)
+    except Exception as e:
+        logger.error(f"Error creating backup: {e}")
+        print(f"❌ Error al crear la copia de seguridad: {e}")
+        raise SystemExit(1)
+
+    errors = verify_backup(archive_path[:-len('.tar')])
+    if errors:
+        print("❌ La copia no coincide con su manifiesto:\n" + "\n".join(f"  - {error}" for error in errors))
+        raise SystemExit(1)
+    print(f"✅ Copia de seguridad creada en {time.perf_counter() - started:.1f} s: {archive_path} ({os.path.getsize(archive_path) / 1024:.0f} KB)")
+
+if __name__ == '__main__':
+    main()
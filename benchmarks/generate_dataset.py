@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generador de un conjunto de datos sintético del CRM para pruebas de rendimiento
+
+Crea una base de datos SQLite con el esquema de db/schema.sql y la llena con coordinadores,
+verificadores, bodegas, tipos de incidencia, registros e historial de acciones. La misma base
+de datos sirve para el backend SQLite y para el cliente Supabase simulado (SUPABASE_FAKE_DB).
+
+Uso:
+    python benchmarks/generate_dataset.py --records 100000 --zone-skew 1.2 --output benchmarks/data/crm_100k.db
+"""
+
+import os
+import sys
+import random
+import sqlite3
+import logging
+import argparse
+import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utils.database import SCHEMA_VERSION
+
+SCHEMA_PATH = os.path.join(ROOT_DIR, 'db', 'schema.sql')
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ZONES = ['PENEDES', 'ALT CAMP', 'CONCA', 'ALMENDRALEJO', 'REQUENA', 'CARIÑENA']
+STATUSES = ['Pendiente', 'En Proceso', 'Solucionado', 'Asignado a Técnicos', 'RRHH']
+RESPONSIBLES = ['Bodega', 'Verificador', 'RRHH', 'Coordinacion', 'Servicios Informáticos']
+RESPONSIBLE_WEIGHTS = [35, 40, 5, 15, 5]
+
+NAMES = ['Ana', 'Jordi', 'Marta', 'Josep', 'Laura', 'Carlos', 'Núria', 'Pere', 'Elena', 'Miguel',
+         'Montse', 'Xavier', 'Lucía', 'Antonio', 'Carmen', 'Francesc', 'Isabel', 'David', 'Rosa', 'Javier']
+SURNAMES = ['García', 'Martínez', 'Puig', 'Ferrer', 'López', 'Vidal', 'Soler', 'Sánchez', 'Roca', 'Serra',
+            'Fernández', 'Casas', 'Pérez', 'Font', 'Romero', 'Vila', 'Moreno', 'Torres', 'Mas', 'Ruiz']
+WAREHOUSE_PREFIXES = ['Celler', 'Bodegas', 'Caves', 'Viñedos', 'Masia', 'Heretat', 'Cooperativa', 'Finca']
+WAREHOUSE_NAMES = ['Can Ràfols', 'Sant Jaume', 'La Vinya', 'El Mas', 'Montsant', 'Vallformosa', 'Olivella',
+                   'Les Garrigues', 'Santa Maria', 'Torrelles', 'El Molí', 'La Serra', 'Mont-ral', 'Sant Pere']
+INCIDENT_TYPES = [
+    'Precinto roto', 'Etiquetado incorrecto', 'Muestra no tomada', 'Documentación incompleta',
+    'Retraso en la verificación', 'Acceso denegado a la bodega', 'Lote no identificado',
+    'Error en el registro de entrada', 'Temperatura fuera de rango', 'Contraetiqueta ausente',
+    'Discrepancia de volumen', 'Botella rota en inspección', 'Falta de firma', 'Equipo de medición averiado',
+    'Cita no confirmada', 'Duplicado de expediente', 'Incidencia con transporte', 'Error de aplicación',
+    'Muestra extraviada', 'Ausencia del verificador'
+]
+ACTION_TEXTS = ['Llamada a la bodega', 'Correo enviado al responsable', 'Visita de seguimiento',
+                'Revisión de la documentación', 'Escalado a coordinación', 'Reasignación del caso',
+                'Confirmación con el verificador', 'Cierre tras comprobación']
+
+# Filas por lote al insertar
+BATCH_SIZE = 5000
+
+def zone_weights(skew):
+    """Peso de cada zona: distribución de Zipf con exponente `skew` (0 = uniforme)"""
+    return [1 / (rank ** skew) for rank in range(1, len(ZONES) + 1)]
+
+def person(rng):
+    return rng.choice(NAMES), f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)}"
+
+def create_database(path):
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    # El esquema recién creado ya incluye todas las migraciones
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return conn
+
+def generate(path, records, zone_skew=1.0, actions_per_record=1.5, days=730, seed=42):
+    """Genera el conjunto de datos y devuelve el número de filas por tabla"""
+    rng = random.Random(seed)
+    conn = create_database(path)
+    weights = zone_weights(zone_skew)
+
+    # Tamaños de las tablas de referencia proporcionales al número de registros
+    n_coordinators = max(5, min(60, records // 2000))
+    n_verifiers = max(len(ZONES), records // 800)
+    n_warehouses = max(len(ZONES), records // 150)
+
+    coordinators = [person(rng) for _ in range(n_coordinators)]
+    conn.executemany('INSERT INTO coordinators (name, surnames) VALUES (?, ?)', coordinators)
+
+    verifier_zones = rng.choices(ZONES, weights, k=n_verifiers)
+    conn.executemany('INSERT INTO verifiers (name, surnames, phone, zone) VALUES (?, ?, ?, ?)', [
+        (*person(rng), f"6{rng.randint(10000000, 99999999)}", zone) for zone in verifier_zones
+    ])
+
+    warehouse_zones = rng.choices(ZONES, weights, k=n_warehouses)
+    conn.executemany('INSERT INTO warehouses (name, codigo_consejo, zone) VALUES (?, ?, ?)', [
+        (f"{rng.choice(WAREHOUSE_PREFIXES)} {rng.choice(WAREHOUSE_NAMES)} {i}", f"B{10000000 + i:08d}A", zone)
+        for i, zone in enumerate(warehouse_zones, 1)
+    ])
+
+    conn.executemany('INSERT INTO incidents (code, description) VALUES (?, ?)', [
+        (f"{i:03d}", description) for i, description in enumerate(INCIDENT_TYPES, 1)
+    ])
+    conn.execute("UPDATE sequences SET value = ? WHERE name = 'incident_code'", (len(INCIDENT_TYPES),))
+
+    warehouses_by_zone = {zone: [] for zone in ZONES}
+    for warehouse_id, zone in enumerate(warehouse_zones, 1):
+        warehouses_by_zone[zone].append(warehouse_id)
+    verifiers_by_zone = {zone: [] for zone in ZONES}
+    for verifier_id, zone in enumerate(verifier_zones, 1):
+        verifiers_by_zone[zone].append(verifier_id)
+    populated_zones = [zone for zone in ZONES if warehouses_by_zone[zone]]
+    populated_weights = [weights[ZONES.index(zone)] for zone in populated_zones]
+
+    # Unos pocos tipos de incidencia concentran la mayoría de los registros
+    type_weights = [1 / rank for rank in range(1, len(INCIDENT_TYPES) + 1)]
+    today = datetime.date.today()
+
+    record_batch, action_batch = [], []
+    for record_id in range(1, records + 1):
+        zone = rng.choices(populated_zones, populated_weights)[0]
+        warehouse_id = rng.choice(warehouses_by_zone[zone])
+        # La mayoría de las veces el verificador es de la misma zona que la bodega
+        if verifiers_by_zone[zone] and rng.random() < 0.9:
+            verifier_id = rng.choice(verifiers_by_zone[zone])
+        else:
+            verifier_id = rng.randint(1, n_verifiers)
+        age = int(rng.random() ** 2 * days)
+        record_date = today - datetime.timedelta(days=age)
+        # Cuanto más antiguo, más probable que esté solucionado
+        if rng.random() < min(0.95, age / 60):
+            status = 'Solucionado'
+        else:
+            status = rng.choice(STATUSES)
+        record_batch.append((
+            record_date.isoformat(),
+            rng.randint(1, n_coordinators),
+            warehouse_id,
+            verifier_id,
+            rng.choices(range(1, len(INCIDENT_TYPES) + 1), type_weights)[0],
+            rng.randint(1, n_coordinators),
+            f"Incidencia detectada en {zone.title()} durante la verificación",
+            status,
+            rng.choices(RESPONSIBLES, RESPONSIBLE_WEIGHTS)[0]
+        ))
+
+        actions = min(8, int(rng.expovariate(1 / actions_per_record))) if actions_per_record else 0
+        action_date = record_date
+        for i in range(actions):
+            action_date = min(today, action_date + datetime.timedelta(days=rng.randint(0, 10)))
+            last = i == actions - 1
+            action_batch.append((
+                record_id,
+                action_date.isoformat(),
+                rng.choice(ACTION_TEXTS),
+                status if last else rng.choice(['En Proceso', 'Asignado a Técnicos']),
+                rng.randint(1, n_coordinators)
+            ))
+
+        if len(record_batch) >= BATCH_SIZE:
+            _flush(conn, record_batch, action_batch)
+            logger.info(f"Generated {record_id}/{records} incident records")
+    _flush(conn, record_batch, action_batch)
+
+    conn.execute('ANALYZE')
+    conn.commit()
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ['coordinators', 'verifiers', 'warehouses', 'incidents', 'incident_records', 'incident_actions']}
+    conn.close()
+    logger.info(f"Dataset written to {path}: {counts}")
+    return counts
+
+def _flush(conn, record_batch, action_batch):
+    conn.executemany('''
+        INSERT INTO incident_records (date, registering_coordinator_id, warehouse_id, causing_verifier_id,
+                                      incident_id, assigned_coordinator_id, explanation, status, responsible)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', record_batch)
+    conn.executemany('''
+        INSERT INTO incident_actions (incident_record_id, action_date, action_description, new_status, performed_by)
+        VALUES (?, ?, ?, ?, ?)
+    ''', action_batch)
+    conn.commit()
+    record_batch.clear()
+    action_batch.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera un conjunto de datos sintético del CRM')
+    parser.add_argument('--records', type=int, default=100000, help='Número de registros de incidencia')
+    parser.add_argument('--zone-skew', type=float, default=1.0, help='Exponente de Zipf del reparto entre zonas (0 = uniforme)')
+    parser.add_argument('--actions-per-record', type=float, default=1.5, help='Media de acciones por registro')
+    parser.add_argument('--days', type=int, default=730, help='Antigüedad máxima de los registros en días')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador aleatorio')
+    parser.add_argument('--output', default=None, help='Ruta de la base de datos SQLite a crear')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(ROOT_DIR, 'benchmarks', 'data', f'crm_{args.records}.db')
+    generate(output, args.records, args.zone_skew, args.actions_per_record, args.days, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de extremo a extremo de la capa de datos
+
+Mide cada función pública de lectura y escritura de utils/database.py (SQLite) y de
+utils/database_supabase.py (sobre el cliente Supabase simulado, con latencia configurable)
+contra un conjunto de datos generado con benchmarks/generate_dataset.py. Cada backend trabaja
+sobre su propia copia de la base de datos y los resultados se guardan en JSON para comparar
+versiones.
+
+Uso:
+    python benchmarks/run_benchmarks.py --dataset benchmarks/data/crm_100000.db --latency-ms 30
+    python benchmarks/run_benchmarks.py --dataset ... --compare benchmarks/results/anterior.json
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import inspect
+import logging
+import argparse
+import platform
+import datetime
+import tempfile
+import time
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('benchmarks')
+logger.setLevel(logging.INFO)
+
+BACKENDS = ['sqlite', 'supabase']
+
+# Funciones públicas que no se miden: conexiones, borrado total y sustitución del fichero de la base de datos
+EXCLUDED = {'get_db_connection', 'get_supabase_connection', 'reset_database', 'restore_database_file'}
+
+def _csv_upload(header, rows):
+    return io.BytesIO(('\n'.join([header] + rows) + '\n').encode('utf-8'))
+
+def _legacy_backup(ctx, rows=500):
+    """Copia en el formato JSON antiguo con `rows` coordinadores nuevos, para medir restore_backup"""
+    ctx['counter'] += 1
+    first_id = 1000000 + ctx['counter'] * rows
+    data = {'coordinators': [{'id': first_id + i, 'name': f"Restaurado{first_id + i}", 'surnames': 'Copia'} for i in range(rows)]}
+    return [(io.BytesIO(json.dumps(data).encode('utf-8')), 'bench_backup.json')]
+
+def _unique(ctx, prefix):
+    ctx['counter'] += 1
+    return f"{prefix}{ctx['counter']}"
+
+# Casos: (nombre, función, tipo, constructor de argumentos). El nombre permite variantes de una misma función
+CASES = [
+    ('init_db', 'init_db', 'write', lambda ctx: ((), {})),
+    ('get_coordinators', 'get_coordinators', 'read', lambda ctx: ((), {})),
+    ('get_verifiers', 'get_verifiers', 'read', lambda ctx: ((), {})),
+    ('get_warehouses', 'get_warehouses', 'read', lambda ctx: ((), {})),
+    ('get_incidents', 'get_incidents', 'read', lambda ctx: ((), {})),
+    ('get_incident_records', 'get_incident_records', 'read', lambda ctx: ((), {})),
+    ('get_incident_records_page', 'get_incident_records_page', 'read', lambda ctx: ((), {})),
+    ('get_incident_records_page[filtered]', 'get_incident_records_page', 'read',
+     lambda ctx: ((), {'warehouse': 'Celler', 'code': '001', 'status': 'Pendiente'})),
+    ('get_incident_actions', 'get_incident_actions', 'read', lambda ctx: ((ctx['record_id'],), {})),
+    ('get_incident_snapshot', 'get_incident_snapshot', 'read', lambda ctx: ((), {})),
+    ('get_incident_snapshot_version', 'get_incident_snapshot_version', 'read', lambda ctx: ((), {})),
+    ('get_incident_records_since[1h]', 'get_incident_records_since', 'read', lambda ctx: ((ctx['now'] - datetime.timedelta(hours=1),), {})),
+    ('get_incident_actions_since[1h]', 'get_incident_actions_since', 'read', lambda ctx: ((ctx['now'] - datetime.timedelta(hours=1),), {})),
+    ('get_all_incident_records_df', 'get_all_incident_records_df', 'read', lambda ctx: ((), {})),
+    ('search_incident_records_df', 'search_incident_records_df', 'read', lambda ctx: (('cariñena',), {})),
+    ('get_all_verifiers_df', 'get_all_verifiers_df', 'read', lambda ctx: ((), {})),
+    ('get_all_warehouses_df', 'get_all_warehouses_df', 'read', lambda ctx: ((), {})),
+    ('get_incidents_by_zone', 'get_incidents_by_zone', 'read', lambda ctx: ((), {})),
+    ('get_incidents_by_verifier', 'get_incidents_by_verifier', 'read', lambda ctx: ((), {})),
+    ('get_incidents_by_warehouse', 'get_incidents_by_warehouse', 'read', lambda ctx: ((), {})),
+    ('get_incidents_by_type', 'get_incidents_by_type', 'read', lambda ctx: ((), {})),
+    ('get_incidents_by_status', 'get_incidents_by_status', 'read', lambda ctx: ((), {})),
+    ('get_assignments_by_verifier', 'get_assignments_by_verifier', 'read', lambda ctx: ((), {})),
+    ('get_incident_breakdowns', 'get_incident_breakdowns', 'read', lambda ctx: ((), {})),
+    ('get_incident_record_details', 'get_incident_record_details', 'read', lambda ctx: ((ctx['record_id'],), {})),
+    ('export_incidents_to_excel[30d]', 'export_incidents_to_excel', 'read',
+     lambda ctx: ((), {'date_from': ctx['today'] - datetime.timedelta(days=30), 'date_to': ctx['today']})),
+    ('export_incidents_to_excel', 'export_incidents_to_excel', 'read', lambda ctx: ((), {})),
+    ('create_backup[full]', 'create_backup', 'read', lambda ctx: ((), {'full': True})),
+    ('create_backup[incremental]', 'create_backup', 'read', lambda ctx: ((), {'full': False})),
+    ('restore_backup', 'restore_backup', 'write', lambda ctx: ((_legacy_backup(ctx),), {})),
+    ('get_dashboard_stats', 'get_dashboard_stats', 'read', lambda ctx: ((), {})),
+    ('get_pending_incidents_summary', 'get_pending_incidents_summary', 'read', lambda ctx: ((), {})),
+    ('get_recent_actions', 'get_recent_actions', 'read', lambda ctx: ((), {})),
+    ('search_incident_by_code', 'search_incident_by_code', 'read', lambda ctx: (('001',), {})),
+    ('search_incident_records', 'search_incident_records', 'read', lambda ctx: (('precinto roto',), {})),
+    ('search_incident_records[page 5]', 'search_incident_records', 'read', lambda ctx: (('verificación',), {'page': 5})),
+    ('get_incident_records_by_incident_code', 'get_incident_records_by_incident_code', 'read', lambda ctx: (('010',), {})),
+    ('get_coordinator_by_id', 'get_coordinator_by_id', 'read', lambda ctx: ((1,), {})),
+    ('get_verifier_by_id', 'get_verifier_by_id', 'read', lambda ctx: ((1,), {})),
+    ('get_warehouse_by_id', 'get_warehouse_by_id', 'read', lambda ctx: ((1,), {})),
+    ('get_incident_by_id', 'get_incident_by_id', 'read', lambda ctx: ((1,), {})),
+    ('get_pending_incidents_by_coordinator', 'get_pending_incidents_by_coordinator', 'read', lambda ctx: ((1,), {})),
+    ('get_filtered_pending_incidents', 'get_filtered_pending_incidents', 'read',
+     lambda ctx: ((), {'status': 'Pendiente', 'days': 30})),
+    ('invalidate_incident_snapshot', 'invalidate_incident_snapshot', 'write', lambda ctx: ((), {})),
+    ('rebuild_incident_rollup', 'rebuild_incident_rollup', 'write', lambda ctx: ((), {})),
+    ('insert_coordinator', 'insert_coordinator', 'write', lambda ctx: ((_unique(ctx, 'Bench'), 'Coordinador'), {})),
+    ('insert_verifier', 'insert_verifier', 'write',
+     lambda ctx: ((_unique(ctx, 'Bench'), 'Verificador', '600000000', 'PENEDES'), {})),
+    ('insert_warehouse', 'insert_warehouse', 'write', lambda ctx: ((_unique(ctx, 'Bodega Bench '), _unique(ctx, 'BB'), 'CONCA'), {})),
+    ('insert_incident', 'insert_incident', 'write', lambda ctx: ((_unique(ctx, 'Incidencia de prueba '),), {})),
+    ('insert_incident_record', 'insert_incident_record', 'write',
+     lambda ctx: ((ctx['today'].isoformat(), 1, 1, 1, 1, 1, 'Registro de prueba', 'Pendiente', 'Bodega'), {})),
+    ('insert_incident_action', 'insert_incident_action', 'write',
+     lambda ctx: ((ctx['record_id'], ctx['today'].isoformat(), 'Acción de prueba', 'En Proceso', 1), {})),
+    # Cierre masivo: la misma acción sobre 200 registros
+    ('apply_incident_actions[200]', 'apply_incident_actions', 'write', lambda ctx: (([{
+        'incident_record_id': record_id, 'action_date': ctx['today'].isoformat(), 'action_description': 'Cierre de campaña',
+        'new_status': 'Solucionado', 'performed_by': 1
+    } for record_id in range(1, 201)],), {})),
+    ('update_coordinator', 'update_coordinator', 'write', lambda ctx: ((1, _unique(ctx, 'Bench'), 'Editado'), {})),
+    ('update_verifier', 'update_verifier', 'write', lambda ctx: ((1, _unique(ctx, 'Bench'), 'Editado', '600000000', 'PENEDES'), {})),
+    ('update_warehouse', 'update_warehouse', 'write', lambda ctx: ((1, _unique(ctx, 'Bodega '), 'B10000001A', 'PENEDES'), {})),
+    ('update_incident', 'update_incident', 'write', lambda ctx: ((1, '001', _unique(ctx, 'Descripción ')), {})),
+    ('load_csv_to_verifiers', 'load_csv_to_verifiers', 'write', lambda ctx: ((_csv_upload(
+        'name,surnames,phone,zone', [f"{_unique(ctx, 'CSV')},Verificador,600000000,REQUENA" for _ in range(200)]),), {})),
+    ('load_csv_to_warehouses', 'load_csv_to_warehouses', 'write', lambda ctx: ((_csv_upload(
+        'name,codigo_consejo,zone', [f"Bodega CSV,{_unique(ctx, 'CSV')},CARIÑENA" for _ in range(200)]),), {})),
+]
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+def count_rows(result):
+    """Filas devueltas por una función de datos, si el resultado tiene tamaño"""
+    if isinstance(result, dict):
+        if 'records' in result:
+            result = result['records']
+        elif 'success' in result:
+            return None
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+def table_counts(path):
+    conn = sqlite3.connect(path)
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ['coordinators', 'verifiers', 'warehouses', 'incidents', 'incident_records', 'incident_actions']}
+    conn.close()
+    return counts
+
+def load_backend(name, database, latency_ms):
+    """Importa el módulo de datos del backend apuntando a `database`. Devuelve (módulo, cliente)"""
+    # Las mediciones son en frío: sin la copia en disco de la instantánea
+    from utils import snapshot_file
+    snapshot_file.SNAPSHOT_DIR = ''
+    if name == 'sqlite':
+        from utils import database as module, backup_restore
+        module.DB_PATH = database
+        backup_restore.DB_PATH = database
+        return module, None
+
+    os.environ['SUPABASE_FAKE_DB'] = database
+    os.environ['SUPABASE_FAKE_LATENCY_MS'] = str(latency_ms)
+    import supabase_config
+    supabase_config._supabase_client = None
+    from utils import database_supabase as module
+    return module, module.get_supabase_connection()
+
+def reset_caches(module):
+    """Mide en frío: sin caché de referencia ni instantánea"""
+    module._reference_cache.invalidate()
+    module.invalidate_incident_snapshot()
+
+def summarize(timings, rows=None, requests=None, error=None):
+    summary = {'runs_ms': [round(t, 3) for t in timings], 'rows': rows, 'requests': requests, 'error': error}
+    if timings:
+        summary.update({
+            'min_ms': round(min(timings), 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'max_ms': round(max(timings), 3)
+        })
+    return summary
+
+def run_once(module, client, func, args, kwargs):
+    """Ejecuta una llamada en frío. Devuelve (ms, filas, peticiones)"""
+    reset_caches(module)
+    before = client.request_count if client else None
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, count_rows(result), (client.request_count - before if client else None)
+
+def run_case(module, client, func, build_args, ctx, kind, repeat):
+    """Mide un caso. Las escrituras se repiten con argumentos nuevos en cada ejecución"""
+    timings, rows, requests = [], None, None
+    args, kwargs = build_args(ctx)
+    try:
+        for _ in range(repeat):
+            if kind == 'write':
+                args, kwargs = build_args(ctx)
+            elapsed, rows, requests = run_once(module, client, func, args, kwargs)
+            timings.append(elapsed)
+    except Exception as e:
+        return summarize(timings, rows, requests, f"{type(e).__name__}: {e}")
+    return summarize(timings, rows, requests)
+
+def run_backend(name, dataset, workdir, latency_ms, repeat, selected):
+    database = os.path.join(workdir, f'{name}.db')
+    shutil.copy(dataset, database)
+    module, client = load_backend(name, database, latency_ms)
+    ctx = {
+        'counter': 0,
+        'today': datetime.date.today(),
+        'now': datetime.datetime.now(datetime.timezone.utc),
+        # Un registro intermedio, con historial de acciones si lo hay
+        'record_id': table_counts(database)['incident_records'] // 2 or 1
+    }
+
+    results = {}
+    for case_name, function_name, kind, build_args in CASES:
+        if selected and case_name not in selected and function_name not in selected:
+            continue
+        func = getattr(module, function_name, None)
+        if func is None:
+            continue
+        summary = run_case(module, client, func, build_args, ctx, kind, repeat)
+        summary['kind'] = kind
+        results[case_name] = summary
+        logger.info(f"[{name}] {case_name}: {summary.get('median_ms', 'error')} ms"
+                    + (f", {summary['requests']} requests" if summary.get('requests') is not None else ''))
+
+    public = {n for n, f in inspect.getmembers(module, inspect.isfunction)
+              if not n.startswith('_') and f.__module__ == module.__name__}
+    uncovered = sorted(public - EXCLUDED - {case[1] for case in CASES})
+    return results, uncovered
+
+def compare(current, baseline_path, threshold):
+    """Muestra la variación de la mediana frente a un resultado anterior. Devuelve el número de regresiones"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nComparación con {baseline_path} (commit {baseline['meta'].get('git_commit')})")
+    for backend, cases in current['results'].items():
+        for case_name, summary in cases.items():
+            previous = baseline.get('results', {}).get(backend, {}).get(case_name)
+            if not previous or 'median_ms' not in previous or 'median_ms' not in summary:
+                continue
+            change = (summary['median_ms'] - previous['median_ms']) / previous['median_ms'] if previous['median_ms'] else 0
+            flag = ''
+            if change > threshold:
+                flag = '  <-- REGRESIÓN'
+                regressions += 1
+            print(f"{backend:9} {case_name:45} {previous['median_ms']:10.1f} -> {summary['median_ms']:10.1f} ms ({change:+.0%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la capa de datos')
+    parser.add_argument('--dataset', required=True, help='Base de datos generada con generate_dataset.py')
+    parser.add_argument('--backend', choices=BACKENDS + ['both'], default='both')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latencia simulada por petición en el backend Supabase')
+    parser.add_argument('--repeat', type=int, default=3, help='Ejecuciones por caso')
+    parser.add_argument('--only', nargs='*', help='Casos o funciones a medir (por defecto, todos)')
+    parser.add_argument('--output', default=None, help='Archivo JSON de resultados')
+    parser.add_argument('--compare', default=None, help='Resultado anterior con el que comparar')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Empeoramiento relativo que se considera regresión')
+    args = parser.parse_args()
+
+    dataset = os.path.abspath(args.dataset)
+    backends = BACKENDS if args.backend == 'both' else [args.backend]
+    commit = git_commit()
+
+    report = {
+        'meta': {
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': dataset,
+            'dataset_rows': table_counts(dataset),
+            'latency_ms': args.latency_ms,
+            'repeat': args.repeat
+        },
+        'results': {},
+        'uncovered': {}
+    }
+
+    # Directorio de trabajo propio: las copias de seguridad y el esquema relativo no tocan el repositorio
+    workdir = tempfile.mkdtemp(prefix='crm_bench_')
+    os.makedirs(os.path.join(workdir, 'db'))
+    shutil.copy(os.path.join(ROOT_DIR, 'db', 'schema.sql'), os.path.join(workdir, 'db', 'schema.sql'))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for backend in backends:
+            results, uncovered = run_backend(backend, dataset, workdir, args.latency_ms, args.repeat, set(args.only or []))
+            report['results'][backend] = results
+            report['uncovered'][backend] = uncovered
+            if uncovered:
+                logger.warning(f"[{backend}] Functions without a benchmark case: {', '.join(uncovered)}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        ROOT_DIR, 'benchmarks', 'results', f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"Results written to {output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
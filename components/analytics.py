@@ -1,18 +1,19 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from utils.database_unified import get_all_incident_records_df, get_all_verifiers_df, get_all_warehouses_df, get_incidents_by_zone, get_incidents_by_verifier, get_incidents_by_warehouse, get_incidents_by_type, get_incidents_by_status, get_assignments_by_verifier
+from utils.search import filter_dataframe
+from utils.database_unified import get_all_incident_records_df, search_incident_records_df, get_all_verifiers_df, get_all_warehouses_df, get_incident_breakdowns
 
-def display_filtered_table(title, df_getter):
+def display_filtered_table(title, df_getter, searcher=None):
     st.subheader(title)
     df = df_getter()
     if df.empty:
         st.warning('No hay datos disponibles.')
         return
+    # Sin distinguir mayúsculas ni acentos; `searcher` usa el texto de búsqueda precalculado de la instantánea
     search_term = st.text_input('Búsqueda global', '')
     if search_term:
-        mask = df.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)
-        df = df[mask]
+        df = searcher(search_term) if searcher else filter_dataframe(df, search_term)
     
     # Mapeos de nombres amigables para cada tipo de tabla
     friendly_mappings = {
@@ -67,8 +68,8 @@ def display_filtered_table(title, df_getter):
             filtered_df = filtered_df[filtered_df[col].isin(vals)]
     filtered_df = filtered_df.rename(columns=tech_to_friendly)
     
-    # Ocultar columnas de códigos (asumiendo que son las que terminan en '_id' o 'id')
-    display_columns = [col for col in filtered_df.columns if not col.lower().endswith('_id') and col.lower() != 'id']
+    # Ocultar columnas de códigos (asumiendo que son las que terminan en '_id' o 'id') y la marca de modificación
+    display_columns = [col for col in filtered_df.columns if not col.lower().endswith('_id') and col.lower() not in ('id', 'updated_at')]
     st.dataframe(filtered_df[display_columns])
 
 def display_chart(title, df_getter, x_col, y_col='count'):
@@ -94,16 +95,19 @@ def display_chart(title, df_getter, x_col, y_col='count'):
     st.altair_chart(chart, use_container_width=True)
 
 def analytics_incidents():
-    display_filtered_table('Consulta de Incidencias', get_all_incident_records_df)
-    display_chart('Incidencias por Zona', get_incidents_by_zone, 'warehouse_zone')
-    display_chart('Incidencias por Verificador', get_incidents_by_verifier, 'causing_verifier')
-    display_chart('Incidencias por Bodega', get_incidents_by_warehouse, 'warehouse')
-    display_chart('Incidencias por Tipo', get_incidents_by_type, 'incident_type')
-    display_chart('Incidencias por Status', get_incidents_by_status, 'status')
+    display_filtered_table('Consulta de Incidencias', get_all_incident_records_df, search_incident_records_df)
+    # Todos los desgloses se obtienen con una única consulta agregada
+    breakdowns = get_incident_breakdowns()
+    display_chart('Incidencias por Zona', lambda: breakdowns['by_zone'], 'warehouse_zone')
+    display_chart('Incidencias por Verificador', lambda: breakdowns['by_verifier'], 'causing_verifier')
+    display_chart('Incidencias por Bodega', lambda: breakdowns['by_warehouse'], 'warehouse')
+    display_chart('Incidencias por Tipo', lambda: breakdowns['by_type'], 'incident_type')
+    display_chart('Incidencias por Status', lambda: breakdowns['by_status'], 'status')
 
 def analytics_verifiers():
     display_filtered_table('Consulta de Verificadores', get_all_verifiers_df)
-    display_chart('Asignaciones por Verificador', get_assignments_by_verifier, 'causing_verifier')
+    breakdowns = get_incident_breakdowns()
+    display_chart('Asignaciones por Verificador', lambda: breakdowns['assignments_by_verifier'], 'causing_verifier')
 
 def analytics_warehouses():
     display_filtered_table('Consulta de Bodegas', get_all_warehouses_df)
\ No newline at end of file
@@ -1,25 +1,54 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from utils.database_unified import get_dashboard_stats, get_pending_incidents_summary, get_recent_actions, get_coordinators, get_pending_incidents_by_coordinator, get_filtered_pending_incidents
+from utils.database_unified import get_dashboard_stats, get_recent_actions, get_coordinators, get_filtered_pending_incidents
+from utils.parallel import load_concurrently
 from datetime import datetime
 
+def _selected_filter(key):
+    """Valor elegido en un filtro del dashboard en el rerun anterior (None si aún no existe)"""
+    selected = st.session_state.get(key)
+    return selected[0] if selected else None
+
+def load_dashboard_data():
+    """Carga a la vez las secciones del dashboard, que son consultas independientes.
+
+    Los filtros de incidencias pendientes se leen de session_state para lanzar su consulta junto
+    con las demás, antes de dibujar los selectores. Devuelve un LoadResults: las secciones que
+    no terminan a tiempo quedan en `failed`.
+    """
+    coordinator_id = _selected_filter("coordinator_filter")
+    status_filter = _selected_filter("status_filter")
+    days_filter = _selected_filter("days_filter")
+    return load_concurrently({
+        'stats': get_dashboard_stats,
+        'recent_actions': get_recent_actions,
+        'coordinators': get_coordinators,
+        'filtered_incidents': lambda: get_filtered_pending_incidents(coordinator_id, status_filter, days_filter)
+    })
+
+def _section_unavailable(data, name, label):
+    """Aviso en lugar de una sección que no se pudo cargar"""
+    if data.failed.get(name) == 'timeout':
+        st.warning(f"⏳ {label}: la consulta tarda demasiado. Recarga la página para volver a intentarlo.")
+    else:
+        st.error(f"Error al cargar {label.lower()}: {data.failed.get(name)}")
+
 def dashboard_main():
     """Pantalla principal del dashboard con estadísticas y accesos directos"""
     st.title("📊 Dashboard - Gestión de Incidencias")
     st.markdown("---")
     
-    # Obtener estadísticas
-    try:
-        stats = get_dashboard_stats()
-        pending_incidents = get_pending_incidents_summary()
-        recent_actions = get_recent_actions()
-    except Exception as e:
-        st.error(f"Error al cargar datos del dashboard: {e}")
-        return
+    # Obtener los datos de todas las secciones en paralelo
+    data = load_dashboard_data()
+    stats = data.get('stats')
     
     # Sección de métricas principales
     st.subheader("📈 Resumen General")
+    if stats is None:
+        _section_unavailable(data, 'stats', "Resumen general")
+        stats = {'total_incidents': '—', 'pending_incidents': '—', 'resolved_incidents': '—',
+                 'recent_incidents': '—', 'by_status': pd.DataFrame()}
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
@@ -33,7 +62,7 @@ def dashboard_main():
         st.metric(
             label="Pendientes",
             value=stats['pending_incidents'],
-            delta=f"-{stats['resolved_incidents']} resueltas",
+            delta=f"-{stats['resolved_incidents']} resueltas" if 'stats' in data else None,
             delta_color="inverse",
             help="Incidencias que requieren atención"
         )
@@ -66,7 +95,7 @@ def dashboard_main():
         
         with col_filter1:
             # Filtro por coordinador
-            coordinators = get_coordinators()
+            coordinators = data.get('coordinators', [])
             coordinator_options = [(None, "Todos los coordinadores")] + [(coord['id'], f"{coord['name']} {coord['surnames']}") for coord in coordinators]
             
             selected_coordinator = st.selectbox(
@@ -85,7 +114,7 @@ def dashboard_main():
                 ("Esperando Verificación", "Esperando Verificación")
             ]
             
-            selected_status = st.selectbox(
+            st.selectbox(
                 "Estado:",
                 options=status_options,
                 format_func=lambda x: x[1],
@@ -101,21 +130,21 @@ def dashboard_main():
                 (30, "Últimos 30 días")
             ]
             
-            selected_days = st.selectbox(
+            st.selectbox(
                 "Período:",
                 options=days_options,
                 format_func=lambda x: x[1],
                 key="days_filter"
             )
         
-        # Obtener incidencias filtradas con múltiples criterios
         coordinator_id = selected_coordinator[0] if selected_coordinator[0] is not None else None
-        status_filter = selected_status[0] if selected_status[0] is not None else None
-        days_filter = selected_days[0] if selected_days[0] is not None else None
         
-        filtered_incidents = get_filtered_pending_incidents(coordinator_id, status_filter, days_filter)
+        # Ya cargadas en load_dashboard_data con los filtros de session_state, que son los que muestran los selectores
+        filtered_incidents = data.get('filtered_incidents')
         
-        if filtered_incidents.empty:
+        if filtered_incidents is None:
+            _section_unavailable(data, 'filtered_incidents', "Incidencias pendientes")
+        elif filtered_incidents.empty:
             if coordinator_id:
                 st.success(f"🎉 ¡Excelente! No hay incidencias pendientes para {selected_coordinator[1]}.")
             else:
@@ -186,7 +215,10 @@ def dashboard_main():
         # Acciones recientes
         st.subheader("🔄 Acciones Recientes")
         
-        if recent_actions.empty:
+        recent_actions = data.get('recent_actions')
+        if recent_actions is None:
+            _section_unavailable(data, 'recent_actions', "Acciones recientes")
+        elif recent_actions.empty:
             st.info("No hay acciones recientes")
         else:
             for idx, action in recent_actions.iterrows():
@@ -1,7 +1,12 @@
 import streamlit as st
 import os
-from utils.database_unified import reset_database, create_backup, export_incidents_to_excel
-from utils.backup_restore import restore_db
+import datetime
+from utils.database_unified import reset_database, create_backup, restore_backup, export_incidents_to_excel
+from utils.database import restore_database_file
+from components.forms import INCIDENT_STATUSES
+from utils import instrumentation, bootstrap
+from utils.sqlite_pool import lock_wait_stats
+import pandas as pd
 
 def delete_test_data_form():
     st.subheader("Borrar Datos de Prueba")
@@ -17,19 +22,20 @@ def delete_test_data_form():
 
 def backup_database_form():
     st.subheader("Copia de Seguridad de la Base de Datos")
-    st.info("Crea una copia de seguridad de toda la base de datos.")
+    st.info("Crea una copia de seguridad de la base de datos. Por defecto solo se copian los registros y acciones nuevos o modificados desde la copia anterior.")
+    full = st.checkbox("Copia completa", help="Copia todas las filas aunque exista una copia anterior")
     
     if st.button("Crear Copia de Seguridad"):
         try:
-            backup_path = create_backup()
+            backup_path = create_backup(full=full)
             st.success(f"Copia de seguridad creada exitosamente: {backup_path}")
             
-            # Ofrecer descarga del archivo
+            # Ofrecer descarga del archivo, ya comprimido
             if os.path.exists(backup_path):
                 with open(backup_path, 'rb') as f:
                     st.download_button(
                         label="Descargar Copia de Seguridad",
-                        data=f.read(),
+                        data=f,
                         file_name=os.path.basename(backup_path),
                         mime="application/octet-stream"
                     )
@@ -38,22 +44,31 @@ def backup_database_form():
 
 def export_excel_form():
     st.subheader("Exportar Historial a Excel")
-    st.info("Exporta el historial completo de incidencias y acciones a un archivo Excel.")
+    st.info("Exporta el historial de incidencias y acciones a un archivo Excel. Puedes limitarlo por fechas y estado.")
+    
+    filter_dates = st.checkbox("Filtrar por fechas")
+    date_from = date_to = None
+    if filter_dates:
+        col1, col2 = st.columns(2)
+        with col1:
+            date_from = st.date_input("Desde", datetime.date.today() - datetime.timedelta(days=30))
+        with col2:
+            date_to = st.date_input("Hasta", datetime.date.today())
+    status = st.selectbox("Estado", [None] + INCIDENT_STATUSES, format_func=lambda x: 'Todos' if x is None else x)
     
     if st.button("Exportar a Excel"):
         try:
-            filename = export_incidents_to_excel()
-            st.success(f"Archivo Excel creado exitosamente: {filename}")
+            # El Excel se genera en memoria, sin dejar archivos en el servidor
+            buffer = export_incidents_to_excel(date_from=date_from, date_to=date_to, status=status)
+            filename = f"historial_incidencias_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            st.success("Archivo Excel generado exitosamente.")
             
-            # Ofrecer descarga del archivo
-            if os.path.exists(filename):
-                with open(filename, 'rb') as f:
-                    st.download_button(
-                        label="Descargar Archivo Excel",
-                        data=f.read(),
-                        file_name=filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+            st.download_button(
+                label="Descargar Archivo Excel",
+                data=buffer,
+                file_name=filename,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
         except Exception as e:
              st.error(f"Error al exportar a Excel: {str(e)}")
              st.info("Nota: Asegúrate de que openpyxl esté instalado: pip install openpyxl")
@@ -62,43 +77,134 @@ def restore_database_form():
     st.subheader("Restaurar Copia de Seguridad")
     st.warning("Esta acción reemplazará completamente la base de datos actual. Asegúrate de hacer una copia de seguridad antes de proceder.")
     
-    uploaded_file = st.file_uploader(
-        "Selecciona el archivo de copia de seguridad (.db)",
-        type=['db'],
-        help="Sube un archivo de copia de seguridad generado previamente"
+    uploaded_files = st.file_uploader(
+        "Selecciona la copia de seguridad (.tar o .json de Supabase, .db o .db.gz de SQLite)",
+        type=['tar', 'json', 'db', 'gz'],
+        accept_multiple_files=True,
+        help="Para una copia incremental, sube también las anteriores de su cadena, desde la última completa"
     )
     
-    if uploaded_file is not None:
-        st.info(f"Archivo seleccionado: {uploaded_file.name}")
+    if uploaded_files:
+        st.info(f"Archivos seleccionados: {', '.join(f.name for f in uploaded_files)}")
+        sqlite_files = [f for f in uploaded_files if f.name.endswith(('.db', '.db.gz'))]
+        if sqlite_files and len(uploaded_files) > 1:
+            st.error("Un fichero .db de SQLite se restaura solo, sin otras copias.")
+            return
         
         # Código de confirmación
         access_code = st.text_input("Código de Acceso para Restauración", type="password")
         confirm_restore = st.checkbox("Confirmo que deseo restaurar la base de datos y reemplazar todos los datos actuales")
         
         if st.button("Restaurar Base de Datos", disabled=not confirm_restore):
-            if access_code == "197569":
+            if access_code != "197569":
+                st.error("Código de acceso incorrecto.")
+            elif sqlite_files:
+                _restore_sqlite_file(sqlite_files[0])
+            else:
                 try:
-                    # Guardar el archivo temporalmente
-                    temp_path = f"temp_restore_{uploaded_file.name}"
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Restaurar la base de datos
-                    restore_db(temp_path)
-                    
-                    # Limpiar archivo temporal
-                    os.remove(temp_path)
-                    
-                    st.success("Base de datos restaurada exitosamente.")
-                    st.info("La aplicación se reiniciará automáticamente para aplicar los cambios.")
-                    st.rerun()
-                    
+                    with st.spinner("Restaurando la copia de seguridad por lotes..."):
+                        restored = restore_backup([(f, f.name) for f in uploaded_files])
+                    st.success(f"Base de datos restaurada exitosamente: {sum(restored.values())} filas.")
+                    st.dataframe(pd.DataFrame([{'Tabla': table, 'Filas': rows} for table, rows in restored.items()]),
+                                 use_container_width=True, hide_index=True)
                 except Exception as e:
                     st.error(f"Error al restaurar la base de datos: {str(e)}")
-                    # Limpiar archivo temporal en caso de error
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-            else:
-                st.error("Código de acceso incorrecto.")
+                    st.info("Si la restauración se interrumpió, vuelve a lanzarla con los mismos archivos: continuará donde se quedó.")
+    else:
+        st.info("Por favor, selecciona un archivo de copia de seguridad para continuar.")
+
+def _restore_sqlite_file(uploaded_file):
+    """Sustituye el fichero de la base de datos SQLite por el subido (comprobado antes con integrity_check)"""
+    temp_path = f"temp_restore_{uploaded_file.name}"
+    try:
+        # Guardar el archivo temporalmente
+        with open(temp_path, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        
+        # Restaurar la base de datos
+        restore_database_file(temp_path)
+        # La base de datos restaurada puede necesitar migraciones
+        bootstrap.reset()
+        
+        st.success("Base de datos restaurada exitosamente.")
+        st.info("La aplicación se reiniciará automáticamente para aplicar los cambios.")
+        st.rerun()
+    except Exception as e:
+        st.error(f"Error al restaurar la base de datos: {str(e)}")
+    finally:
+        # Limpiar archivo temporal
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def diagnostics_form():
+    st.subheader("Diagnóstico de Rendimiento")
+    st.info("Llamadas a la base de datos de los últimos reruns: tiempo, peticiones HTTP, filas y bytes recibidos.")
+    
+    reruns = instrumentation.recent_reruns()
+    if st.button("Vaciar Registro"):
+        instrumentation.clear()
+        lock_wait_stats.reset()
+        st.rerun()
+    
+    # Estado de la inicialización del proceso
+    health = bootstrap.get_health()
+    if health is not None:
+        message = f"Inicialización del proceso: {health.status} ({health.started_at.strftime('%d/%m/%Y %H:%M:%S')}, {round(health.duration * 1000)} ms)"
+        if health.ok:
+            st.caption(message)
+        else:
+            st.warning(message + "\n\n" + "\n".join(f"- {error}" for error in health.errors))
+    
+    # Esperas del bloqueo de escritura de SQLite (solo con el backend SQLite)
+    lock_waits = lock_wait_stats.summary()
+    if lock_waits['count']:
+        st.markdown("**Bloqueo de escritura SQLite**")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Escrituras", lock_waits['count'])
+        col2.metric("Espera media (ms)", round(lock_waits['mean'] * 1000, 1))
+        col3.metric("Espera máxima (ms)", round(lock_waits['max'] * 1000, 1))
+        col4.metric("Bloqueos agotados", lock_waits['timeouts'])
+    if not reruns:
+        st.info("Todavía no hay reruns registrados.")
+        return
+    
+    st.markdown("**Por página**")
+    pages = instrumentation.page_summary()
+    st.dataframe(pd.DataFrame([{
+        'Página': page,
+        'Reruns': data['reruns'],
+        'Llamadas/rerun': round(data['calls'] / data['reruns'], 1),
+        'Peticiones/rerun': round(data['requests'] / data['reruns'], 1),
+        'Tiempo medio (ms)': round(data['duration'] * 1000 / data['reruns']),
+        'KB/rerun': round(data['bytes'] / 1024 / data['reruns'], 1)
+    } for page, data in pages.items()]), use_container_width=True, hide_index=True)
+    
+    st.markdown("**Últimos reruns**")
+    st.dataframe(pd.DataFrame([{
+        'Hora': stats.started_at.strftime('%H:%M:%S'),
+        'Página': stats.page or 'Sin página',
+        'Llamadas': len(stats.calls),
+        'Peticiones': stats.total('requests'),
+        'Filas': stats.total('rows'),
+        'KB': round(stats.total('bytes') / 1024, 1),
+        'Tiempo BD (ms)': round(stats.total('duration') * 1000),
+        'Errores': sum(1 for call in stats.calls if call.error)
+    } for stats in reruns]), use_container_width=True, hide_index=True)
+    
+    selected = st.selectbox(
+        "Ver llamadas más lentas del rerun",
+        range(len(reruns)),
+        format_func=lambda i: f"{reruns[i].started_at.strftime('%H:%M:%S')} - {reruns[i].page or 'Sin página'}"
+    )
+    slowest = reruns[selected].slowest()
+    if slowest:
+        st.dataframe(pd.DataFrame([{
+            'Función': call.name,
+            'Tiempo (ms)': round(call.duration * 1000, 1),
+            'Peticiones': call.requests,
+            'Filas': call.rows,
+            'KB': round(call.bytes / 1024, 1),
+            'Error': call.error or ''
+        } for call in slowest]), use_container_width=True, hide_index=True)
     else:
-        st.info("Por favor, selecciona un archivo de copia de seguridad para continuar.")
\ No newline at end of file
+        st.info("Este rerun no hizo llamadas a la base de datos.")
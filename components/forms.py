@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
 import datetime
-from utils.database_unified import insert_coordinator, insert_verifier, insert_warehouse, load_csv_to_verifiers, load_csv_to_warehouses, insert_incident, get_coordinators, get_verifiers, get_warehouses, get_incidents, insert_incident_record, get_incident_records, insert_incident_action, get_incident_actions, get_incident_record_details, search_incident_by_code, get_incident_records_by_incident_code, update_coordinator, update_verifier, update_warehouse, update_incident, get_coordinator_by_id, get_verifier_by_id, get_warehouse_by_id, get_incident_by_id
+from utils.database_unified import insert_coordinator, insert_verifier, insert_warehouse, load_csv_to_verifiers, load_csv_to_warehouses, insert_incident, get_coordinators, get_verifiers, get_warehouses, get_incidents, insert_incident_record, get_incident_records_page, insert_incident_action, apply_incident_actions, get_incident_actions, get_incident_record_details, search_incident_by_code, get_incident_records_by_incident_code, search_incident_records, update_coordinator, update_verifier, update_warehouse, update_incident, get_coordinator_by_id, get_verifier_by_id, get_warehouse_by_id, get_incident_by_id
+
+# Estados posibles de un registro de incidencia
+INCIDENT_STATUSES = ['Pendiente', 'En Proceso', 'Solucionado', 'Asignado a Técnicos', 'RRHH']
 
 def coordinator_form():
     st.subheader('Alta de Coordinador')
@@ -78,7 +81,7 @@ def csv_upload(section):
                         missing_cols = [col for col in required_columns if col not in df.columns]
                         available_cols = list(df.columns)
                         raise ValueError(f'El CSV debe contener las columnas: {", ".join(required_columns)}. Columnas faltantes: {", ".join(missing_cols)}. Columnas disponibles: {", ".join(available_cols)}')
-                    load_csv_to_verifiers(uploaded_file, sep=separator)
+                    report = load_csv_to_verifiers(uploaded_file, sep=separator)
                 elif section == 'Bodegas':
                     df = pd.read_csv(uploaded_file, sep=separator, encoding='utf-8-sig')
                     # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
@@ -88,8 +91,10 @@ def csv_upload(section):
                         missing_cols = [col for col in required_columns if col not in df.columns]
                         available_cols = list(df.columns)
                         raise ValueError(f'El CSV debe contener las columnas: {", ".join(required_columns)}. Columnas faltantes: {", ".join(missing_cols)}. Columnas disponibles: {", ".join(available_cols)}')
-                    load_csv_to_warehouses(uploaded_file, sep=separator)
-                st.success(f'{section} cargados exitosamente desde CSV.')
+                    report = load_csv_to_warehouses(uploaded_file, sep=separator)
+                st.success(f'{section} cargados desde CSV: {report["inserted"]} nuevos, {report["skipped"]} omitidos por existir ya.')
+                if report['failed']:
+                    st.warning(f'{report["failed"]} filas no se pudieron cargar (campos obligatorios vacíos o error al guardar).')
             except Exception as e:
                 st.error(f'Error al cargar el CSV: {str(e)}')
 
@@ -195,6 +200,71 @@ def search_incident_form():
     elif search_button and not search_code.strip():
         st.warning("⚠️ Por favor, ingrese un código de incidencia para buscar")
 
+# Resultados por página en la búsqueda de texto
+TEXT_SEARCH_PAGE_SIZE = 20
+
+def text_search_form():
+    """Búsqueda de texto completo en explicaciones, tipos de incidencia y acciones, paginada en el servidor"""
+    st.header("🔎 Búsqueda de Texto")
+    
+    query = st.text_input(
+        "Buscar",
+        placeholder="Ej: precinto roto, muestra extraviada",
+        help="Busca en la explicación del registro, el tipo de incidencia y las acciones realizadas. No distingue mayúsculas ni acentos",
+        key='text_search_query'
+    ).strip()
+    
+    if not query:
+        st.info("ℹ️ Introduzca una o varias palabras para buscar")
+        return
+    
+    # Volver a la primera página cuando cambia la búsqueda
+    if st.session_state.get('text_search_last_query') != query:
+        st.session_state.text_search_last_query = query
+        st.session_state.text_search_page = 1
+    page = st.session_state.get('text_search_page', 1)
+    
+    result = search_incident_records(query, page=page, page_size=TEXT_SEARCH_PAGE_SIZE)
+    if not result['records'] and page > 1:
+        # La página ya no existe (hay menos resultados que al paginar): volver a la primera
+        page = st.session_state.text_search_page = 1
+        result = search_incident_records(query, page=page, page_size=TEXT_SEARCH_PAGE_SIZE)
+    total = result['total']
+    if not total:
+        st.warning("⚠️ No se encontraron registros que coincidan con la búsqueda")
+        return
+    
+    pages = (total + TEXT_SEARCH_PAGE_SIZE - 1) // TEXT_SEARCH_PAGE_SIZE
+    st.caption(f"{total} registros encontrados, ordenados por relevancia")
+    
+    for record in result['records']:
+        with st.container(border=True):
+            col_text, col_button = st.columns([5, 1])
+            with col_text:
+                st.markdown(f"**ID {record['id']}** · {record['date']} · {record['warehouse'] or 'N/A'} · {record['incident'] or 'N/A'} · *{record['status']}*")
+                st.markdown(record['snippet'] or '')
+            with col_button:
+                if st.button('Ver acciones', key=f"text_search_open_{record['id']}"):
+                    # Abrir el registro en la gestión de acciones
+                    st.session_state.selected_incident_record_id = record['id']
+                    st.session_state.incident_actions_counter = st.session_state.get('incident_actions_counter', 0) + 1
+                    st.session_state.in_manage_actions = True
+                    st.session_state['main_menu_override'] = 'Incidencias'
+                    st.session_state['sub_menu_override'] = 'Gestión de Acciones'
+                    st.rerun()
+    
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button('◀ Anterior', key='text_search_prev', disabled=page == 1):
+            st.session_state.text_search_page = page - 1
+            st.rerun()
+    with col_page:
+        st.caption(f'Página {page} de {pages}')
+    with col_next:
+        if st.button('Siguiente ▶', key='text_search_next', disabled=page >= pages):
+            st.session_state.text_search_page = page + 1
+            st.rerun()
+
 def incident_record_form():
     st.subheader('Registro de Incidencia')
     
@@ -224,7 +294,7 @@ def incident_record_form():
     incident_id = st.selectbox('Incidencia', options=incidents, format_func=lambda x: x[1], key=f'inc_rec_incident_{st.session_state.incident_record_counter}')[0]
     assigned_coordinator_id = st.selectbox('Coordinador asignado', options=coordinators, format_func=lambda x: f"{x['name']} {x['surnames']}", key=f'inc_rec_assigned_coord_{st.session_state.incident_record_counter}')['id']
     explanation = st.text_area('Explicación', key=f'inc_rec_explanation_{st.session_state.incident_record_counter}', help='Explique los detalles de la incidencia')
-    status = st.selectbox('Status', ['Pendiente', 'En Proceso', 'Solucionado', 'Asignado a Técnicos', 'RRHH'], key=f'inc_rec_status_{st.session_state.incident_record_counter}', help='Seleccione el estado actual')
+    status = st.selectbox('Status', INCIDENT_STATUSES, key=f'inc_rec_status_{st.session_state.incident_record_counter}', help='Seleccione el estado actual')
     responsible = st.selectbox('Responsable', ['Bodega', 'Verificador', 'RRHH', 'Coordinacion', 'Servicios Informáticos'], key=f'inc_rec_responsible_{st.session_state.incident_record_counter}', help='Indique quién es responsable')
     if st.button('Guardar Registro de Incidencia'):
         if all([date, registering_coordinator_id, warehouse_id, causing_verifier_id, incident_id, assigned_coordinator_id, status, responsible]):
@@ -236,6 +306,159 @@ def incident_record_form():
         else:
             st.error('Por favor, complete todos los campos obligatorios.')
 
+# Número de registros por página en el selector de registros
+RECORD_PICKER_PAGE_SIZE = 25
+
+def _record_picker_filters(key):
+    """Filtros del selector de registros y pila de cursores de página (se reinicia al cambiar los filtros)"""
+    col_id, col_warehouse, col_code, col_status = st.columns(4)
+    with col_id:
+        record_id_text = st.text_input('ID', key=f'{key}_filter_id', help='Buscar por ID de registro')
+    with col_warehouse:
+        warehouse = st.text_input('Bodega', key=f'{key}_filter_warehouse', help='Nombre (o parte) de la bodega')
+    with col_code:
+        code = st.text_input('Código', key=f'{key}_filter_code', help='Código (o parte) de la incidencia')
+    with col_status:
+        status = st.selectbox('Estado', [None] + INCIDENT_STATUSES, format_func=lambda x: 'Todos' if x is None else x, key=f'{key}_filter_status')
+    
+    record_id = None
+    if record_id_text.strip():
+        if record_id_text.strip().isdigit():
+            record_id = int(record_id_text.strip())
+        else:
+            st.warning('El ID debe ser numérico.')
+    filters = {'record_id': record_id, 'warehouse': warehouse.strip() or None, 'code': code.strip() or None, 'status': status}
+    
+    # Volver a la primera página cuando cambian los filtros
+    cursors_key = f'{key}_cursors'
+    if st.session_state.get(f'{key}_filters') != filters or cursors_key not in st.session_state:
+        st.session_state[f'{key}_filters'] = filters
+        st.session_state[cursors_key] = [None]
+    return filters, st.session_state[cursors_key]
+
+def _record_picker_pagination(key, cursors, page):
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button('◀ Anterior', key=f'{key}_prev', disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f'Página {len(cursors)}')
+    with col_next:
+        if st.button('Siguiente ▶', key=f'{key}_next', disabled=page['next_cursor'] is None):
+            cursors.append(page['next_cursor'])
+            st.rerun()
+
+def incident_record_picker(key, selected_record_id=None, widget_key=None):
+    """Selector paginado de registros de incidencia con filtros aplicados en el servidor.
+    
+    Solo se consulta la página visible; la paginación usa un cursor (fecha, id) guardado en session_state.
+    Devuelve la tupla (id, descripción) seleccionada o None si no hay registros.
+    """
+    filters, cursors = _record_picker_filters(key)
+    
+    page = get_incident_records_page(cursor=cursors[-1], page_size=RECORD_PICKER_PAGE_SIZE, **filters)
+    options = page['records']
+    
+    # Mantener visible el registro seleccionado aunque no esté en la página actual
+    if selected_record_id and not any(record[0] == selected_record_id for record in options):
+        options = get_incident_records_page(record_id=selected_record_id, page_size=1)['records'] + options
+    
+    if not options:
+        return None
+    
+    default_index = 0
+    if selected_record_id:
+        for i, record in enumerate(options):
+            if record[0] == selected_record_id:
+                default_index = i
+                break
+    
+    selected_record = st.selectbox(
+        'Seleccionar Registro de Incidencia',
+        options=options,
+        format_func=lambda x: x[1],
+        index=default_index,
+        key=widget_key or f'{key}_record'
+    )
+    
+    _record_picker_pagination(key, cursors, page)
+    return selected_record
+
+# Máximo de registros que se pueden añadir de una vez con "Seleccionar todos los filtrados"
+BULK_ACTION_MAX_RECORDS = 500
+
+def incident_records_multi_picker(key, widget_key=None):
+    """Selección de varios registros de incidencia, que se conserva al cambiar de página o de filtros.
+    
+    Devuelve la lista de ids seleccionados.
+    """
+    filters, cursors = _record_picker_filters(key)
+    page = get_incident_records_page(cursor=cursors[-1], page_size=RECORD_PICKER_PAGE_SIZE, **filters)
+    
+    widget_key = widget_key or f'{key}_records'
+    labels = st.session_state.setdefault(f'{key}_labels', {})
+    labels.update(dict(page['records']))
+    selected = st.session_state.get(widget_key, [])
+    
+    # Los botones cambian la selección antes de crear el widget, en el mismo rerun
+    col_page, col_all, col_clear = st.columns(3)
+    with col_page:
+        if st.button('Seleccionar página', key=f'{key}_select_page', disabled=not page['records']):
+            selected = list(dict.fromkeys(selected + [record[0] for record in page['records']]))
+    with col_all:
+        if st.button(f'Seleccionar todos los filtrados (máx. {BULK_ACTION_MAX_RECORDS})', key=f'{key}_select_all'):
+            records = get_incident_records_page(page_size=BULK_ACTION_MAX_RECORDS, **filters)['records']
+            labels.update(dict(records))
+            selected = list(dict.fromkeys(selected + [record[0] for record in records]))
+    with col_clear:
+        if st.button('Vaciar selección', key=f'{key}_clear', disabled=not selected):
+            selected = []
+    st.session_state[widget_key] = selected
+    
+    selected = st.multiselect(
+        'Registros seleccionados',
+        options=list(dict.fromkeys(selected + [record[0] for record in page['records']])),
+        format_func=lambda record_id: labels.get(record_id, f'ID: {record_id}'),
+        key=widget_key
+    )
+    
+    _record_picker_pagination(key, cursors, page)
+    return selected
+
+def bulk_incident_actions_form():
+    """Aplica la misma acción (y cambio de estado) a varios registros en una sola petición"""
+    counter = st.session_state.incident_actions_counter
+    selected_ids = incident_records_multi_picker('inc_bulk_picker', widget_key=f'inc_bulk_records_{counter}')
+    st.caption(f'{len(selected_ids)} registros seleccionados')
+    
+    st.subheader('Acción para los Registros Seleccionados')
+    action_date = st.date_input('Fecha de la Acción', datetime.date.today(), key=f'inc_bulk_date_{counter}', help='Fecha en que se realizó la acción')
+    action_description = st.text_area('Descripción de la Acción', key=f'inc_bulk_desc_{counter}', help='Se guarda la misma descripción en cada registro')
+    new_status = st.selectbox('Nuevo Status (opcional)', [None] + INCIDENT_STATUSES, index=0, key=f'inc_bulk_status_{counter}', help='Estado que tendrán todos los registros seleccionados')
+    coordinators = get_coordinators()
+    performed_by = st.selectbox('Realizado por', options=coordinators, format_func=lambda x: f"{x['name']} {x['surnames']}", key=f'inc_bulk_by_{counter}')['id']
+    if st.button(f'Aplicar a {len(selected_ids)} registros', disabled=not selected_ids):
+        if action_date and action_description and performed_by:
+            result = apply_incident_actions([{
+                'incident_record_id': record_id,
+                'action_date': action_date,
+                'action_description': action_description,
+                'new_status': new_status,
+                'performed_by': performed_by
+            } for record_id in selected_ids])
+            if result['success']:
+                st.success(f"Acción guardada en {result['inserted']} registros ({result['updated']} cambios de estado).")
+                # Incrementar contador para limpiar formulario y selección
+                st.session_state.incident_actions_counter += 1
+                st.session_state['main_menu_override'] = 'Incidencias'
+                st.session_state['sub_menu_override'] = 'Gestión de Acciones'
+                st.rerun()
+            else:
+                st.error(f"No se guardó ninguna acción: {result['error']}")
+        else:
+            st.error('Por favor, complete fecha, descripción y realizado por.')
+
 def manage_incident_actions_form():
     st.subheader('Gestión de Acciones de Incidencia')
     
@@ -255,26 +478,21 @@ def manage_incident_actions_form():
         st.session_state['main_menu_override'] = 'Incidencias'
         st.session_state['sub_menu_override'] = 'Gestión de Acciones'
     
-    incident_records = get_incident_records()
-    if not incident_records:
-        st.warning('No hay registros de incidencias disponibles. Por favor, registre uno primero.')
+    mode = st.radio('Modo', ['Un registro', 'Varios registros'], horizontal=True, key='inc_act_mode',
+                    help='Con "Varios registros" se aplica la misma acción a todos los seleccionados en una sola operación')
+    if mode == 'Varios registros':
+        bulk_incident_actions_form()
         return
     
-    # Encontrar el índice del registro previamente seleccionado
-    default_index = 0
-    if st.session_state.selected_incident_record_id:
-        for i, record in enumerate(incident_records):
-            if record[0] == st.session_state.selected_incident_record_id:
-                default_index = i
-                break
-    
-    selected_record = st.selectbox(
-        'Seleccionar Registro de Incidencia', 
-        options=incident_records, 
-        format_func=lambda x: x[1], 
-        index=default_index,
-        key=f'inc_act_record_{st.session_state.incident_actions_counter}'
+    # Solo se consulta la página visible del selector, filtrada en el servidor
+    selected_record = incident_record_picker(
+        'inc_act_picker',
+        selected_record_id=st.session_state.selected_incident_record_id,
+        widget_key=f'inc_act_record_{st.session_state.incident_actions_counter}'
     )
+    if not selected_record:
+        st.warning('No hay registros de incidencias que coincidan. Registre uno o revise los filtros.')
+        return
     incident_record_id = selected_record[0]
     
     # Actualizar el ID seleccionado en session_state
@@ -322,7 +540,7 @@ def manage_incident_actions_form():
     st.subheader('Añadir Nueva Acción')
     action_date = st.date_input('Fecha de la Acción', datetime.date.today(), key=f'inc_act_date_{st.session_state.incident_actions_counter}', help='Fecha en que se realizó la acción')
     action_description = st.text_area('Descripción de la Acción', key=f'inc_act_desc_{st.session_state.incident_actions_counter}', help='Describa la acción tomada')
-    new_status = st.selectbox('Nuevo Status (opcional)', [None, 'Pendiente', 'En Proceso', 'Solucionado', 'Asignado a Técnicos', 'RRHH'], index=0, key=f'inc_act_status_{st.session_state.incident_actions_counter}', help='Actualice el estado si es necesario')
+    new_status = st.selectbox('Nuevo Status (opcional)', [None] + INCIDENT_STATUSES, index=0, key=f'inc_act_status_{st.session_state.incident_actions_counter}', help='Actualice el estado si es necesario')
     coordinators = get_coordinators()
     performed_by = st.selectbox('Realizado por', options=coordinators, format_func=lambda x: f"{x['name']} {x['surnames']}", key=f'inc_act_by_{st.session_state.incident_actions_counter}')['id']
     if st.button('Guardar Acción'):
@@ -1,3 +1,7 @@
+-- Esquema de la base de datos SQLite. Cada sección `-- @version N` contiene los objetos añadidos
+-- en esa versión del esquema (PRAGMA user_version): una base de datos nueva ejecuta el fichero
+-- entero y una existente, solo las secciones posteriores a su versión (ver utils/database.py).
+
 CREATE TABLE IF NOT EXISTS coordinators (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
@@ -36,6 +40,7 @@ CREATE TABLE IF NOT EXISTS incident_records (
     explanation TEXT,
     status TEXT NOT NULL,
     responsible TEXT NOT NULL,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
     FOREIGN KEY (registering_coordinator_id) REFERENCES coordinators(id),
     FOREIGN KEY (warehouse_id) REFERENCES warehouses(id),
     FOREIGN KEY (causing_verifier_id) REFERENCES verifiers(id),
@@ -50,6 +55,7 @@ CREATE TABLE IF NOT EXISTS incident_actions (
     action_description TEXT NOT NULL,
     new_status TEXT,
     performed_by INTEGER NOT NULL,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
     FOREIGN KEY (incident_record_id) REFERENCES incident_records(id),
     FOREIGN KEY (performed_by) REFERENCES coordinators(id)
 );
@@ -59,4 +65,209 @@ CREATE INDEX IF NOT EXISTS idx_verifiers_zone ON verifiers(zone);
 CREATE INDEX IF NOT EXISTS idx_incident_records_status ON incident_records(status);
 CREATE INDEX IF NOT EXISTS idx_incident_records_warehouse_id ON incident_records(warehouse_id);
 CREATE INDEX IF NOT EXISTS idx_incident_records_causing_verifier_id ON incident_records(causing_verifier_id);
-CREATE INDEX IF NOT EXISTS idx_incident_records_incident_id ON incident_records(incident_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_incident_records_incident_id ON incident_records(incident_id);
+
+-- @version 1
+CREATE INDEX IF NOT EXISTS idx_incident_records_date_id ON incident_records(date DESC, id DESC);
+
+-- @version 2
+-- Secuencias con nombre (p. ej. códigos automáticos de incidencia)
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO sequences (name, value) SELECT 'incident_code', COUNT(*) FROM incidents;
+
+-- @version 3
+-- Resumen diario de registros de incidencias, mantenido por triggers (ver supabase_schema.sql).
+-- La analítica y los contadores del dashboard leen esta tabla en lugar de recorrer todo el historial.
+CREATE TABLE IF NOT EXISTS incident_daily_rollup (
+    day DATE NOT NULL,
+    warehouse_id INTEGER NOT NULL,
+    causing_verifier_id INTEGER NOT NULL,
+    incident_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    responsible TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, warehouse_id, causing_verifier_id, incident_id, status, responsible)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS incident_records_rollup_insert
+AFTER INSERT ON incident_records
+BEGIN
+    INSERT INTO incident_daily_rollup (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+    VALUES (date(NEW.date), COALESCE(NEW.warehouse_id, 0), COALESCE(NEW.causing_verifier_id, 0), COALESCE(NEW.incident_id, 0),
+            COALESCE(NEW.status, ''), COALESCE(NEW.responsible, ''), 1)
+    ON CONFLICT (day, warehouse_id, causing_verifier_id, incident_id, status, responsible) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_records_rollup_delete
+AFTER DELETE ON incident_records
+BEGIN
+    UPDATE incident_daily_rollup SET count = count - 1
+    WHERE day = date(OLD.date) AND warehouse_id = COALESCE(OLD.warehouse_id, 0)
+      AND causing_verifier_id = COALESCE(OLD.causing_verifier_id, 0) AND incident_id = COALESCE(OLD.incident_id, 0)
+      AND status = COALESCE(OLD.status, '') AND responsible = COALESCE(OLD.responsible, '');
+    DELETE FROM incident_daily_rollup
+    WHERE day = date(OLD.date) AND warehouse_id = COALESCE(OLD.warehouse_id, 0)
+      AND causing_verifier_id = COALESCE(OLD.causing_verifier_id, 0) AND incident_id = COALESCE(OLD.incident_id, 0)
+      AND status = COALESCE(OLD.status, '') AND responsible = COALESCE(OLD.responsible, '') AND count <= 0;
+END;
+
+-- Incluye los cambios de estado que hace insert_incident_action al actualizar el registro
+CREATE TRIGGER IF NOT EXISTS incident_records_rollup_update
+AFTER UPDATE OF date, warehouse_id, causing_verifier_id, incident_id, status, responsible ON incident_records
+BEGIN
+    UPDATE incident_daily_rollup SET count = count - 1
+    WHERE day = date(OLD.date) AND warehouse_id = COALESCE(OLD.warehouse_id, 0)
+      AND causing_verifier_id = COALESCE(OLD.causing_verifier_id, 0) AND incident_id = COALESCE(OLD.incident_id, 0)
+      AND status = COALESCE(OLD.status, '') AND responsible = COALESCE(OLD.responsible, '');
+    DELETE FROM incident_daily_rollup
+    WHERE day = date(OLD.date) AND warehouse_id = COALESCE(OLD.warehouse_id, 0)
+      AND causing_verifier_id = COALESCE(OLD.causing_verifier_id, 0) AND incident_id = COALESCE(OLD.incident_id, 0)
+      AND status = COALESCE(OLD.status, '') AND responsible = COALESCE(OLD.responsible, '') AND count <= 0;
+    INSERT INTO incident_daily_rollup (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+    VALUES (date(NEW.date), COALESCE(NEW.warehouse_id, 0), COALESCE(NEW.causing_verifier_id, 0), COALESCE(NEW.incident_id, 0),
+            COALESCE(NEW.status, ''), COALESCE(NEW.responsible, ''), 1)
+    ON CONFLICT (day, warehouse_id, causing_verifier_id, incident_id, status, responsible) DO UPDATE SET count = count + 1;
+END;
+
+-- @version 4
+-- Marca de última modificación de registros y acciones (UTC), mantenida por triggers.
+-- Las lecturas incrementales piden solo las filas con updated_at posterior a su marca de agua.
+CREATE INDEX IF NOT EXISTS idx_incident_records_updated_at ON incident_records(updated_at);
+CREATE INDEX IF NOT EXISTS idx_incident_actions_updated_at ON incident_actions(updated_at);
+
+CREATE TRIGGER IF NOT EXISTS incident_records_updated_at_insert
+AFTER INSERT ON incident_records WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE incident_records SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_records_updated_at_update
+AFTER UPDATE ON incident_records WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE incident_records SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_actions_updated_at_insert
+AFTER INSERT ON incident_actions WHEN NEW.updated_at IS NULL
+BEGIN
+    UPDATE incident_actions SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_actions_updated_at_update
+AFTER UPDATE ON incident_actions WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE incident_actions SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+END;
+
+-- @version 5
+-- Versión de las tablas de referencia: avanza con cada modificación o borrado en ellas, que cambia
+-- los datos enriquecidos de los registros sin tocar su updated_at
+INSERT OR IGNORE INTO sequences (name, value) VALUES ('reference_version', 0);
+
+CREATE TRIGGER IF NOT EXISTS coordinators_reference_version_update AFTER UPDATE ON coordinators
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS coordinators_reference_version_delete AFTER DELETE ON coordinators
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS verifiers_reference_version_update AFTER UPDATE ON verifiers
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS verifiers_reference_version_delete AFTER DELETE ON verifiers
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS warehouses_reference_version_update AFTER UPDATE ON warehouses
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS warehouses_reference_version_delete AFTER DELETE ON warehouses
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS incidents_reference_version_update AFTER UPDATE ON incidents
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+CREATE TRIGGER IF NOT EXISTS incidents_reference_version_delete AFTER DELETE ON incidents
+BEGIN
+    UPDATE sequences SET value = value + 1 WHERE name = 'reference_version';
+END;
+
+-- @version 6
+-- Búsqueda de texto completo sobre registros (ver supabase_schema.sql): una fila por registro, con
+-- rowid = id del registro, mantenida por triggers. Sin acentos y sin distinguir mayúsculas.
+CREATE INDEX IF NOT EXISTS idx_incident_actions_record ON incident_actions(incident_record_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS incident_records_fts USING fts5(
+    explanation, incident, actions,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS incident_records_fts_insert
+AFTER INSERT ON incident_records
+BEGIN
+    INSERT INTO incident_records_fts (rowid, explanation, incident, actions)
+    VALUES (NEW.id, NEW.explanation, (SELECT code || ' ' || description FROM incidents WHERE id = NEW.incident_id), '');
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_records_fts_update
+AFTER UPDATE OF explanation, incident_id ON incident_records
+BEGIN
+    UPDATE incident_records_fts
+    SET explanation = NEW.explanation,
+        incident = (SELECT code || ' ' || description FROM incidents WHERE id = NEW.incident_id)
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_records_fts_delete
+AFTER DELETE ON incident_records
+BEGIN
+    DELETE FROM incident_records_fts WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_actions_fts_insert
+AFTER INSERT ON incident_actions
+BEGIN
+    UPDATE incident_records_fts
+    SET actions = (SELECT group_concat(action_description, ' ') FROM incident_actions WHERE incident_record_id = NEW.incident_record_id)
+    WHERE rowid = NEW.incident_record_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_actions_fts_update
+AFTER UPDATE OF action_description, incident_record_id ON incident_actions
+BEGIN
+    UPDATE incident_records_fts
+    SET actions = (SELECT group_concat(action_description, ' ') FROM incident_actions WHERE incident_record_id = incident_records_fts.rowid)
+    WHERE rowid IN (OLD.incident_record_id, NEW.incident_record_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS incident_actions_fts_delete
+AFTER DELETE ON incident_actions
+BEGIN
+    UPDATE incident_records_fts
+    SET actions = COALESCE((SELECT group_concat(action_description, ' ') FROM incident_actions WHERE incident_record_id = OLD.incident_record_id), '')
+    WHERE rowid = OLD.incident_record_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS incidents_fts_update
+AFTER UPDATE OF code, description ON incidents
+BEGIN
+    UPDATE incident_records_fts
+    SET incident = NEW.code || ' ' || NEW.description
+    WHERE rowid IN (SELECT id FROM incident_records WHERE incident_id = NEW.id);
+END;
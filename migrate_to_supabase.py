@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
 """
 Script para migrar datos de SQLite a Supabase
+
+Las filas se leen en streaming y se escriben con upsert por id, en lotes acotados por filas y
+bytes, varios a la vez dentro de cada nivel de dependencias. Si la migración se interrumpe,
+volver a ejecutar el script continúa desde el último lote confirmado (db/migration_checkpoint.json).
+
+Uso:
+    python migrate_to_supabase.py                 # migra (o continúa) db/cavacrm.db
+    python migrate_to_supabase.py --restart       # vuelve a empezar, ignorando el punto de control
 """
 
 import os
 import sys
+import json
+import time
+import hashlib
 import sqlite3
 import logging
-from datetime import datetime
+import argparse
+
+from utils.ndjson_backup import BackupSource, RestoreCheckpoint, RESTORE_LEVELS, restore_backups
+from utils.backup_restore import backup_db
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def check_sqlite_db():
+def check_sqlite_db(db_path='db/cavacrm.db'):
     """Verifica si existe la base de datos SQLite y tiene datos"""
-    db_path = 'db/cavacrm.db'
     
     if not os.path.exists(db_path):
         logger.info("❌ No se encontró la base de datos SQLite")
@@ -55,63 +68,89 @@ def check_sqlite_db():
         logger.error(f"❌ Error verificando SQLite: {e}")
         return False, None
 
-def migrate_table_data(sqlite_conn, supabase_client, table_name, batch_size=100):
-    """Migra datos de una tabla específica de SQLite a Supabase"""
+# Filas leídas de SQLite en cada fetchmany
+SQLITE_FETCH_SIZE = int(os.getenv('MIGRATION_FETCH_SIZE', '1000'))
+
+# Punto de control de la migración, junto a la base de datos de origen
+MIGRATION_CHECKPOINT_NAME = 'migration_checkpoint.json'
+
+def _sqlite_fingerprint(db_path, tables):
+    """Filas, mayor id y última modificación (updated_at, si la tabla la tiene) de cada tabla:
+    identifica el contenido de origen en el punto de control, también si solo se han editado filas"""
+    conn = sqlite3.connect(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True)
     try:
-        cursor = sqlite_conn.cursor()
-        cursor.execute(f"SELECT * FROM {table_name}")
-        
-        # Obtener nombres de columnas
-        columns = [description[0] for description in cursor.description]
-        
-        # Obtener todos los datos
-        rows = cursor.fetchall()
-        
-        if not rows:
-            logger.info(f"📋 {table_name}: No hay datos para migrar")
-            return True
-        
-        logger.info(f"🔄 Migrando {len(rows)} registros de {table_name}...")
-        
-        # Convertir a lista de diccionarios
-        data_to_insert = []
-        for row in rows:
-            record = {}
-            for i, value in enumerate(row):
-                # Convertir None a null para Supabase
-                record[columns[i]] = value
-            data_to_insert.append(record)
-        
-        # Insertar en lotes
-        for i in range(0, len(data_to_insert), batch_size):
-            batch = data_to_insert[i:i + batch_size]
-            
-            try:
-                result = supabase_client.table(table_name).insert(batch).execute()
-                logger.info(f"✅ {table_name}: Lote {i//batch_size + 1} insertado ({len(batch)} registros)")
-            except Exception as e:
-                logger.error(f"❌ Error insertando lote en {table_name}: {e}")
-                # Intentar insertar registro por registro en caso de error
-                for record in batch:
-                    try:
-                        supabase_client.table(table_name).insert(record).execute()
-                    except Exception as record_error:
-                        logger.error(f"❌ Error insertando registro individual en {table_name}: {record_error}")
-                        logger.error(f"Registro problemático: {record}")
-        
-        logger.info(f"✅ {table_name}: Migración completada")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error migrando {table_name}: {e}")
-        return False
+        fingerprint = []
+        for table in tables:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            updated_at = 'MAX(updated_at)' if 'updated_at' in columns else 'NULL'
+            fingerprint.append(list(conn.execute(f"SELECT COUNT(*), MAX(id), {updated_at} FROM {table}").fetchone()))
+        return fingerprint
+    finally:
+        conn.close()
+
+def open_sqlite_source(db_path, tables):
+    """La base de datos SQLite como origen de restore_backups: cada tabla se lee en streaming, por id"""
+    def open_table(table):
+        if table not in tables:
+            return
+        # Conexión de solo lectura por tabla: las tablas de un mismo nivel se leen en hilos distintos
+        conn = sqlite3.connect(f'file:{os.path.abspath(db_path)}?mode=ro', uri=True, check_same_thread=False)
+        try:
+            cursor = conn.execute(f"SELECT * FROM {table} ORDER BY id")
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(SQLITE_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            conn.close()
+
+    fingerprint = hashlib.sha256(json.dumps([os.path.abspath(db_path), _sqlite_fingerprint(db_path, tables)]).encode()).hexdigest()
+    name = f"sqlite:{os.path.basename(db_path)}:{fingerprint[:12]}"
+    return BackupSource(name, {'name': name, 'type': 'full', 'tables': {}}, open_table)
+
+def migrate_database(db_path, supabase_client, tables, batch_size=None, workers=None, batch_bytes=None, restart=False):
+    """Copia las tablas de SQLite a Supabase y devuelve las filas escritas por tabla.
+
+    Usa el motor de restauración de copias (utils.ndjson_backup): las tablas de cada nivel de
+    dependencias se copian a la vez, en lotes de tamaño acotado escritos en paralelo con upsert
+    por id. Repetir la migración no duplica filas y, tras una interrupción, continúa desde el
+    último lote confirmado mientras la base de datos de origen no cambie.
+    """
+    checkpoint_dir = os.path.dirname(os.path.abspath(db_path))
+    if restart:
+        RestoreCheckpoint(os.path.join(checkpoint_dir, MIGRATION_CHECKPOINT_NAME), None).clear()
+
+    def upsert(table, rows):
+        supabase_client.table(table).upsert(rows, on_conflict='id').execute()
+
+    return restore_backups(
+        [open_sqlite_source(db_path, tables)],
+        upsert,
+        lambda: supabase_client.rpc('reset_table_sequences').execute(),
+        checkpoint_dir=checkpoint_dir,
+        batch_size=batch_size,
+        workers=workers,
+        batch_bytes=batch_bytes,
+        checkpoint_name=MIGRATION_CHECKPOINT_NAME
+    )
 
 def main():
     """Función principal de migración"""
+    parser = argparse.ArgumentParser(description='Migra los datos de SQLite a Supabase (se puede repetir y continuar)')
+    parser.add_argument('--db', default='db/cavacrm.db', help='Base de datos SQLite de origen')
+    parser.add_argument('--batch-size', type=int, help='Máximo de filas por lote (por defecto RESTORE_BATCH_SIZE)')
+    parser.add_argument('--workers', type=int, help='Lotes de una misma tabla escritos a la vez (por defecto RESTORE_WORKERS)')
+    parser.add_argument('--restart', action='store_true', help='Ignorar el punto de control y migrar desde el principio')
+    args = parser.parse_args()
+    db_path = args.db
+    
     logger.info("🚀 Iniciando migración de SQLite a Supabase")
     
     # Verificar SQLite
-    has_data, table_counts = check_sqlite_db()
+    has_data, table_counts = check_sqlite_db(db_path)
     
     if not has_data:
         logger.info("✅ No hay datos en SQLite para migrar")
@@ -135,60 +174,34 @@ def main():
         logger.error(f"❌ Error configurando Supabase: {e}")
         return
     
-    # Conectar a SQLite
+    # Migrar todas las tablas con datos, en orden de dependencias de claves foráneas
+    tables = [table for level in RESTORE_LEVELS for table in level if table_counts.get(table)]
+    logger.info(f"🔄 Migrando {sum(table_counts[table] for table in tables)} registros de {len(tables)} tablas...")
+    
+    started = time.perf_counter()
     try:
-        sqlite_conn = sqlite3.connect('db/cavacrm.db')
-        logger.info("✅ Conexión a SQLite establecida")
+        migrated = migrate_database(db_path, supabase, tables, batch_size=args.batch_size,
+                                    workers=args.workers, restart=args.restart)
     except Exception as e:
-        logger.error(f"❌ Error conectando a SQLite: {e}")
-        return
-    
-    # Orden de migración (respetando dependencias de claves foráneas)
-    migration_order = [
-        'coordinators',
-        'verifiers', 
-        'warehouses',
-        'incidents',
-        'incident_records',
-        'incident_actions'
-    ]
-    
-    # Migrar cada tabla
-    successful_migrations = 0
-    total_tables = len([table for table in migration_order if table in table_counts])
-    
-    for table_name in migration_order:
-        if table_name in table_counts and table_counts[table_name] > 0:
-            logger.info(f"\n📋 Migrando tabla: {table_name}")
-            
-            if migrate_table_data(sqlite_conn, supabase, table_name):
-                successful_migrations += 1
-            else:
-                logger.error(f"❌ Falló la migración de {table_name}")
-    
-    # Cerrar conexión SQLite
-    sqlite_conn.close()
+        logger.error(f"❌ Error migrando a Supabase: {e}")
+        logger.error("Vuelve a ejecutar el script para continuar desde el último lote confirmado")
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - started
     
     # Resumen final
     logger.info(f"\n📊 Resumen de migración:")
-    logger.info(f"✅ Tablas migradas exitosamente: {successful_migrations}/{total_tables}")
+    for table in tables:
+        logger.info(f"✅ {table}: {migrated[table]} registros")
+    total_rows = sum(migrated.values())
+    logger.info(f"⏱️ {total_rows} registros en {elapsed:.1f} s ({total_rows / elapsed if elapsed else 0:.0f} registros/s)")
+    logger.info("🎉 ¡Migración completada exitosamente!")
     
-    if successful_migrations == total_tables:
-        logger.info("🎉 ¡Migración completada exitosamente!")
-        
-        # Crear backup de SQLite después de migración exitosa
-        backup_name = f"backup_pre_supabase_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        backup_path = f"db/backups/{backup_name}"
-        
-        try:
-            os.makedirs('db/backups', exist_ok=True)
-            import shutil
-            shutil.copy2('db/cavacrm.db', backup_path)
-            logger.info(f"💾 Backup creado: {backup_path}")
-        except Exception as e:
-            logger.error(f"⚠️ Error creando backup: {e}")
-    else:
-        logger.error("❌ La migración no se completó correctamente")
+    # Crear backup de SQLite después de migración exitosa (copia en caliente: la base de datos usa WAL)
+    try:
+        backup_path = backup_db(backup_dir='db/backups', db_path=db_path)
+        logger.info(f"💾 Backup creado: {backup_path}")
+    except Exception as e:
+        logger.error(f"⚠️ Error creando backup: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Script para reconstruir el resumen diario de incidencias (incident_daily_rollup)
+
+Los triggers mantienen el resumen al día; este script solo hace falta tras cargas masivas
+hechas con los triggers desactivados o si se sospecha que el resumen está desincronizado.
+
+Uso:
+    python rebuild_incident_rollup.py            # backend activo (Supabase o SQLite)
+    python rebuild_incident_rollup.py --sqlite   # base de datos SQLite local
+"""
+
+import logging
+import argparse
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstruye el resumen diario de incidencias')
+    parser.add_argument('--sqlite', action='store_true', help='Usar la base de datos SQLite local')
+    args = parser.parse_args()
+
+    if args.sqlite:
+        from utils.database import rebuild_incident_rollup
+    else:
+        from utils.database_unified import rebuild_incident_rollup
+
+    try:
+        rows = rebuild_incident_rollup()
+        print(f"✅ Resumen diario reconstruido: {rows} filas")
+    except Exception as e:
+        logger.error(f"Error rebuilding incident rollup: {e}")
+        print(f"❌ Error al reconstruir el resumen diario: {e}")
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,14 @@ def get_supabase_client() -> Client:
     """Obtiene el cliente de Supabase (singleton)"""
     global _supabase_client
     
+    if _supabase_client is None and os.environ.get("SUPABASE_FAKE_DB"):
+        # Cliente simulado sobre SQLite (pruebas y benchmarks sin red)
+        from utils.fake_supabase import FakeSupabaseClient
+        _supabase_client = FakeSupabaseClient(
+            os.environ["SUPABASE_FAKE_DB"],
+            latency_ms=float(os.environ.get("SUPABASE_FAKE_LATENCY_MS", "0"))
+        )
+    
     if _supabase_client is None:
         # Permitir override desde variables de entorno para mayor seguridad
         url = os.environ.get("SUPABASE_URL", SUPABASE_URL)
@@ -24,6 +32,12 @@ def get_supabase_client() -> Client:
     
     return _supabase_client
 
+def get_supabase_source() -> str:
+    """Identificador de la base de datos a la que apunta el cliente (URL del proyecto o base simulada)"""
+    if os.environ.get("SUPABASE_FAKE_DB"):
+        return f"fake:{os.path.abspath(os.environ['SUPABASE_FAKE_DB'])}"
+    return os.environ.get("SUPABASE_URL", SUPABASE_URL)
+
 def test_connection() -> bool:
     """Prueba la conexión con Supabase"""
     try:
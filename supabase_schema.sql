@@ -58,12 +58,465 @@ CREATE TABLE IF NOT EXISTS incident_actions (
 
 -- Crear índices para optimizar consultas
 CREATE INDEX IF NOT EXISTS idx_incident_records_date ON incident_records(date);
+CREATE INDEX IF NOT EXISTS idx_incident_records_date_id ON incident_records(date DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_incident_records_status ON incident_records(status);
 CREATE INDEX IF NOT EXISTS idx_incident_records_warehouse ON incident_records(warehouse_id);
 CREATE INDEX IF NOT EXISTS idx_incident_records_coordinator ON incident_records(assigned_coordinator_id);
 CREATE INDEX IF NOT EXISTS idx_incident_actions_record ON incident_actions(incident_record_id);
 CREATE INDEX IF NOT EXISTS idx_incident_actions_date ON incident_actions(action_date);
 
+-- Marca de última modificación de registros y acciones, mantenida por la base de datos.
+-- Las lecturas incrementales piden solo las filas con updated_at posterior a su marca de agua.
+ALTER TABLE incident_records ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE incident_actions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS idx_incident_records_updated_at ON incident_records(updated_at);
+CREATE INDEX IF NOT EXISTS idx_incident_actions_updated_at ON incident_actions(updated_at);
+
+-- clock_timestamp() y no now(): la marca queda lo más cerca posible de la confirmación
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS incident_records_updated_at ON incident_records;
+CREATE TRIGGER incident_records_updated_at
+    BEFORE INSERT OR UPDATE ON incident_records
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS incident_actions_updated_at ON incident_actions;
+CREATE TRIGGER incident_actions_updated_at
+    BEFORE INSERT OR UPDATE ON incident_actions
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Versión de las tablas de referencia: avanza con cada modificación o borrado en ellas, que cambia
+-- los datos enriquecidos de los registros sin tocar su updated_at
+CREATE SEQUENCE IF NOT EXISTS reference_version_seq;
+
+CREATE OR REPLACE FUNCTION bump_reference_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM nextval('reference_version_seq');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS coordinators_reference_version ON coordinators;
+CREATE TRIGGER coordinators_reference_version
+    AFTER UPDATE OR DELETE ON coordinators
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+DROP TRIGGER IF EXISTS verifiers_reference_version ON verifiers;
+CREATE TRIGGER verifiers_reference_version
+    AFTER UPDATE OR DELETE ON verifiers
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+DROP TRIGGER IF EXISTS warehouses_reference_version ON warehouses;
+CREATE TRIGGER warehouses_reference_version
+    AFTER UPDATE OR DELETE ON warehouses
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+DROP TRIGGER IF EXISTS incidents_reference_version ON incidents;
+CREATE TRIGGER incidents_reference_version
+    AFTER UPDATE OR DELETE ON incidents
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+
+-- Versión de los datos de la instantánea de registros enriquecidos, en una sola llamada barata:
+-- si no cambia, la copia local sigue siendo válida
+CREATE OR REPLACE FUNCTION get_incident_snapshot_version()
+RETURNS JSON
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT json_build_object(
+        'records', (SELECT COUNT(*) FROM incident_records),
+        'updated_at', (SELECT MAX(updated_at) FROM incident_records),
+        'reference', (SELECT last_value FROM reference_version_seq)
+    );
+$$;
+
+-- Secuencia para los códigos automáticos de incidencia, alineada con las incidencias existentes
+CREATE SEQUENCE IF NOT EXISTS incident_code_seq;
+SELECT setval('incident_code_seq', GREATEST(COUNT(*), 1), COUNT(*) > 0) FROM incidents;
+
+-- Inserta una incidencia y devuelve su código en una sola llamada.
+-- Sin código personalizado se usa el siguiente valor de la secuencia (001, 002, ...),
+-- saltando los que ya existan como códigos personalizados.
+CREATE OR REPLACE FUNCTION insert_incident_with_code(p_description TEXT, p_code TEXT DEFAULT NULL)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_value BIGINT;
+    v_code TEXT;
+BEGIN
+    IF p_code IS NOT NULL THEN
+        -- Un código duplicado provoca unique_violation (23505), que se devuelve al cliente
+        INSERT INTO incidents (code, description) VALUES (p_code, p_description);
+        RETURN p_code;
+    END IF;
+
+    LOOP
+        v_value := nextval('incident_code_seq');
+        v_code := LPAD(v_value::TEXT, GREATEST(3, LENGTH(v_value::TEXT)), '0');
+        BEGIN
+            INSERT INTO incidents (code, description) VALUES (v_code, p_description);
+            RETURN v_code;
+        EXCEPTION WHEN unique_violation THEN
+            -- Código ya ocupado: probar con el siguiente valor
+        END;
+    END LOOP;
+END;
+$$;
+
+-- Resumen diario de registros de incidencias, mantenido por triggers.
+-- La analítica y los contadores del dashboard leen esta tabla en lugar de recorrer todo el historial.
+-- Se guarda por identificador (la zona y los nombres se obtienen al leer), así que renombrar una
+-- bodega o cambiar su zona no obliga a reconstruirla. Los valores nulos se guardan como 0 / ''.
+CREATE TABLE IF NOT EXISTS incident_daily_rollup (
+    day DATE NOT NULL,
+    warehouse_id INTEGER NOT NULL,
+    causing_verifier_id INTEGER NOT NULL,
+    incident_id INTEGER NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    responsible VARCHAR(200) NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, warehouse_id, causing_verifier_id, incident_id, status, responsible)
+);
+
+CREATE OR REPLACE FUNCTION incident_rollup_add(
+    p_date TIMESTAMP, p_warehouse_id INTEGER, p_verifier_id INTEGER, p_incident_id INTEGER,
+    p_status TEXT, p_responsible TEXT, p_delta INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO incident_daily_rollup AS r (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+    VALUES (p_date::DATE, COALESCE(p_warehouse_id, 0), COALESCE(p_verifier_id, 0), COALESCE(p_incident_id, 0),
+            COALESCE(p_status, ''), COALESCE(p_responsible, ''), p_delta)
+    ON CONFLICT (day, warehouse_id, causing_verifier_id, incident_id, status, responsible)
+    DO UPDATE SET count = r.count + EXCLUDED.count;
+
+    IF p_delta < 0 THEN
+        DELETE FROM incident_daily_rollup
+        WHERE day = p_date::DATE AND warehouse_id = COALESCE(p_warehouse_id, 0)
+          AND causing_verifier_id = COALESCE(p_verifier_id, 0) AND incident_id = COALESCE(p_incident_id, 0)
+          AND status = COALESCE(p_status, '') AND responsible = COALESCE(p_responsible, '') AND count <= 0;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION incident_records_rollup_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM incident_rollup_add(OLD.date, OLD.warehouse_id, OLD.causing_verifier_id, OLD.incident_id,
+                                    OLD.status, OLD.responsible, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM incident_rollup_add(NEW.date, NEW.warehouse_id, NEW.causing_verifier_id, NEW.incident_id,
+                                    NEW.status, NEW.responsible, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Incluye los cambios de estado que hace insert_incident_action al actualizar el registro
+DROP TRIGGER IF EXISTS incident_records_rollup ON incident_records;
+CREATE TRIGGER incident_records_rollup
+AFTER INSERT OR DELETE OR UPDATE OF date, warehouse_id, causing_verifier_id, incident_id, status, responsible
+ON incident_records
+FOR EACH ROW EXECUTE FUNCTION incident_records_rollup_trigger();
+
+-- Reconstruye el resumen desde incident_records (carga inicial o corrección). Devuelve el número de filas
+CREATE OR REPLACE FUNCTION rebuild_incident_daily_rollup()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    -- Bloquear las escrituras en incident_records mientras se reconstruye
+    LOCK TABLE incident_records IN SHARE MODE;
+    DELETE FROM incident_daily_rollup;
+    INSERT INTO incident_daily_rollup (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+    SELECT date::DATE, COALESCE(warehouse_id, 0), COALESCE(causing_verifier_id, 0), COALESCE(incident_id, 0),
+           COALESCE(status, ''), COALESCE(responsible, ''), COUNT(*)
+    FROM incident_records
+    GROUP BY 1, 2, 3, 4, 5, 6;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$;
+
+SELECT rebuild_incident_daily_rollup();
+
+-- Función agregada para la analítica de incidencias: devuelve todos los desgloses en una sola llamada,
+-- calculados sobre el resumen diario
+CREATE OR REPLACE FUNCTION get_incident_breakdowns()
+RETURNS JSON
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH enriched AS (
+        SELECT
+            COALESCE(w.zone, 'N/A') AS warehouse_zone,
+            COALESCE(w.name, 'N/A') AS warehouse,
+            COALESCE(v.name || ' ' || v.surnames, 'N/A') AS causing_verifier,
+            COALESCE(i.description, 'N/A') AS incident_type,
+            NULLIF(r.status, '') AS status,
+            NULLIF(r.responsible, '') AS responsible,
+            r.count
+        FROM incident_daily_rollup r
+        LEFT JOIN warehouses w ON w.id = r.warehouse_id
+        LEFT JOIN verifiers v ON v.id = r.causing_verifier_id
+        LEFT JOIN incidents i ON i.id = r.incident_id
+    )
+    SELECT json_build_object(
+        'by_zone', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT warehouse_zone, SUM(count) AS count FROM enriched GROUP BY warehouse_zone) t),
+        'by_verifier', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT causing_verifier, SUM(count) AS count FROM enriched GROUP BY causing_verifier) t),
+        'by_warehouse', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT warehouse, SUM(count) AS count FROM enriched GROUP BY warehouse) t),
+        'by_type', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT incident_type, SUM(count) AS count FROM enriched GROUP BY incident_type) t),
+        'by_status', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT status, SUM(count) AS count FROM enriched GROUP BY status) t),
+        'assignments_by_verifier', (SELECT COALESCE(json_agg(t), '[]'::json) FROM (
+            SELECT causing_verifier, SUM(count) AS count FROM enriched
+            WHERE responsible = 'Verificador' GROUP BY causing_verifier) t)
+    );
+$$;
+
+-- Estadísticas del dashboard: todos los contadores y el desglose por estado en una sola llamada,
+-- calculados sobre el resumen diario
+CREATE OR REPLACE FUNCTION get_dashboard_stats()
+RETURNS JSON
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH by_status AS (
+        SELECT
+            NULLIF(status, '') AS status,
+            SUM(count) AS count,
+            COALESCE(SUM(count) FILTER (WHERE day >= CURRENT_DATE - 7), 0) AS recent
+        FROM incident_daily_rollup
+        GROUP BY status
+    )
+    SELECT json_build_object(
+        'total_incidents', COALESCE(SUM(count), 0),
+        'pending_incidents', COALESCE(SUM(count) FILTER (WHERE status <> 'Solucionado'), 0),
+        'resolved_incidents', COALESCE(SUM(count) FILTER (WHERE status = 'Solucionado'), 0),
+        'recent_incidents', COALESCE(SUM(recent), 0),
+        'by_status', COALESCE(json_agg(json_build_object('status', status, 'count', count) ORDER BY count DESC), '[]'::json)
+    )
+    FROM by_status;
+$$;
+
+-- Búsqueda de texto completo sobre registros: explicación (peso A), código y descripción del tipo
+-- de incidencia (B) y descripciones de sus acciones (C), con la configuración 'es_unaccent' ('spanish'
+-- sin acentos). El vector se guarda en incident_records y lo mantienen los triggers de las tres tablas.
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- Quita los acentos al normalizar cada palabra y no en el texto, así ts_headline resalta el original
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+        ALTER TEXT SEARCH CONFIGURATION es_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END $$;
+
+ALTER TABLE incident_records ADD COLUMN IF NOT EXISTS search_vector tsvector;
+CREATE INDEX IF NOT EXISTS idx_incident_records_search_vector ON incident_records USING GIN (search_vector);
+
+CREATE OR REPLACE FUNCTION incident_record_search_vector(p_record_id INTEGER, p_explanation TEXT, p_incident_id INTEGER)
+RETURNS tsvector
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT setweight(to_tsvector('es_unaccent', COALESCE(p_explanation, '')), 'A')
+        || setweight(to_tsvector('es_unaccent', COALESCE(
+               (SELECT code || ' ' || description FROM incidents WHERE id = p_incident_id), '')), 'B')
+        || setweight(to_tsvector('es_unaccent', COALESCE(
+               (SELECT string_agg(action_description, ' ' ORDER BY id) FROM incident_actions WHERE incident_record_id = p_record_id), '')), 'C');
+$$;
+
+CREATE OR REPLACE FUNCTION incident_records_search_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.search_vector := incident_record_search_vector(NEW.id, NEW.explanation, NEW.incident_id);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS incident_records_search ON incident_records;
+CREATE TRIGGER incident_records_search
+    BEFORE INSERT OR UPDATE OF explanation, incident_id ON incident_records
+    FOR EACH ROW EXECUTE FUNCTION incident_records_search_trigger();
+
+CREATE OR REPLACE FUNCTION incident_actions_search_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_record_id INTEGER;
+BEGIN
+    FOREACH v_record_id IN ARRAY ARRAY[
+        CASE WHEN TG_OP <> 'INSERT' THEN OLD.incident_record_id END,
+        CASE WHEN TG_OP <> 'DELETE' THEN NEW.incident_record_id END
+    ] LOOP
+        IF v_record_id IS NOT NULL THEN
+            UPDATE incident_records
+            SET search_vector = incident_record_search_vector(id, explanation, incident_id)
+            WHERE id = v_record_id;
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS incident_actions_search ON incident_actions;
+CREATE TRIGGER incident_actions_search
+    AFTER INSERT OR DELETE OR UPDATE OF action_description, incident_record_id ON incident_actions
+    FOR EACH ROW EXECUTE FUNCTION incident_actions_search_trigger();
+
+CREATE OR REPLACE FUNCTION incidents_search_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE incident_records
+    SET search_vector = incident_record_search_vector(id, explanation, incident_id)
+    WHERE incident_id = NEW.id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS incidents_search ON incidents;
+CREATE TRIGGER incidents_search
+    AFTER UPDATE OF code, description ON incidents
+    FOR EACH ROW EXECUTE FUNCTION incidents_search_trigger();
+
+-- Registros existentes: solo se escriben los vectores que faltan o que cambian (p. ej. los calculados
+-- con una configuración anterior), para que el script pueda repetirse
+UPDATE incident_records
+SET search_vector = incident_record_search_vector(id, explanation, incident_id)
+WHERE search_vector IS DISTINCT FROM incident_record_search_vector(id, explanation, incident_id);
+
+-- Búsqueda ordenada por relevancia, paginada en el servidor. `total` es el número de coincidencias
+-- y `snippet` el fragmento con los términos resaltados en Markdown (**término**).
+CREATE OR REPLACE FUNCTION search_incident_records(p_query TEXT, p_limit INTEGER DEFAULT 20, p_offset INTEGER DEFAULT 0)
+RETURNS TABLE (
+    id INTEGER, date TIMESTAMP, status VARCHAR, warehouse VARCHAR, incident TEXT,
+    rank REAL, snippet TEXT, total BIGINT
+)
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH query AS (
+        SELECT websearch_to_tsquery('es_unaccent', p_query) AS q
+    ),
+    page AS (
+        SELECT ir.id, ts_rank(ir.search_vector, query.q) AS rank, COUNT(*) OVER () AS total
+        FROM incident_records ir, query
+        WHERE ir.search_vector @@ query.q
+        ORDER BY rank DESC, ir.id DESC
+        LIMIT p_limit OFFSET p_offset
+    )
+    SELECT
+        ir.id,
+        ir.date,
+        ir.status,
+        w.name,
+        i.code || ' - ' || i.description,
+        page.rank,
+        ts_headline('es_unaccent', concat_ws(' · ', ir.explanation, i.description, actions.text), query.q,
+                    'StartSel=**, StopSel=**, MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "'),
+        page.total
+    FROM page
+    JOIN incident_records ir ON ir.id = page.id
+    LEFT JOIN warehouses w ON w.id = ir.warehouse_id
+    LEFT JOIN incidents i ON i.id = ir.incident_id
+    LEFT JOIN LATERAL (
+        SELECT string_agg(a.action_description, ' ' ORDER BY a.id) AS text
+        FROM incident_actions a
+        WHERE a.incident_record_id = ir.id
+    ) actions ON TRUE
+    CROSS JOIN query
+    ORDER BY page.rank DESC, page.id DESC;
+$$;
+
+-- Alinea las secuencias de los identificadores con los datos después de una restauración,
+-- que inserta las filas con sus ids originales. Devuelve el mayor id de cada tabla.
+CREATE OR REPLACE FUNCTION reset_table_sequences()
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_table TEXT;
+    v_max BIGINT;
+    v_result JSONB := '{}'::JSONB;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['coordinators', 'verifiers', 'warehouses', 'incidents', 'incident_records', 'incident_actions'] LOOP
+        EXECUTE format('SELECT COALESCE(MAX(id), 0) FROM %I', v_table) INTO v_max;
+        PERFORM setval(pg_get_serial_sequence(v_table, 'id'), GREATEST(v_max, 1), v_max > 0);
+        v_result := v_result || jsonb_build_object(v_table, v_max);
+    END LOOP;
+    -- Códigos automáticos de incidencia, igual que al crear la secuencia
+    PERFORM setval('incident_code_seq', GREATEST(COUNT(*), 1), COUNT(*) > 0) FROM incidents;
+    RETURN v_result;
+END;
+$$;
+
+-- Inserta una o varias acciones y aplica sus cambios de estado en una sola transacción:
+-- si una acción falla (p. ej. un registro que no existe) no se guarda ninguna.
+-- p_actions: [{"incident_record_id", "action_date", "action_description", "new_status", "performed_by"}, ...]
+-- Con varias acciones con estado para un mismo registro queda el de la última del array.
+CREATE OR REPLACE FUNCTION apply_incident_actions(p_actions JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_inserted INTEGER;
+    v_updated INTEGER;
+BEGIN
+    -- jsonb_populate_recordset toma los tipos de las columnas de incident_actions
+    INSERT INTO incident_actions (incident_record_id, action_date, action_description, new_status, performed_by)
+    SELECT a.incident_record_id, a.action_date, a.action_description, NULLIF(a.new_status, ''), a.performed_by
+    FROM jsonb_populate_recordset(NULL::incident_actions, p_actions) WITH ORDINALITY AS a
+    ORDER BY a.ordinality;
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+    UPDATE incident_records ir
+    SET status = last.new_status
+    FROM (
+        SELECT DISTINCT ON (a.incident_record_id) a.incident_record_id, a.new_status
+        FROM jsonb_populate_recordset(NULL::incident_actions, p_actions) WITH ORDINALITY AS a
+        WHERE NULLIF(a.new_status, '') IS NOT NULL
+        ORDER BY a.incident_record_id, a.ordinality DESC
+    ) last
+    WHERE ir.id = last.incident_record_id
+      AND ir.status IS DISTINCT FROM last.new_status;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    RETURN jsonb_build_object('inserted', v_inserted, 'updated', v_updated);
+END;
+$$;
+
 -- Las tablas se crean vacías, sin datos de prueba
 -- Puedes agregar tus propios datos a través de la aplicación
 
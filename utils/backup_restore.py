@@ -2,19 +2,109 @@ import sqlite3
 import shutil
 import datetime
 import os
+import gzip
+import time
+import logging
+from . import sqlite_pool
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = 'db/cavacrm.db'
 
-def backup_db(backup_dir='backups'):
+# Páginas copiadas en cada paso de la copia en caliente; entre pasos los escritores pueden continuar
+BACKUP_PAGES_PER_STEP = int(os.getenv('SQLITE_BACKUP_PAGES_PER_STEP', '4096'))
+
+# Pausa (segundos) entre pasos de la copia
+BACKUP_STEP_SLEEP = float(os.getenv('SQLITE_BACKUP_STEP_SLEEP', '0.005'))
+
+def _log_progress(copied, total):
+    # Aproximadamente cada 10 % de las páginas
+    if total and (copied == total or copied * 10 // total != (copied - BACKUP_PAGES_PER_STEP) * 10 // total):
+        logger.info(f"SQLite backup: {copied}/{total} pages ({copied * 100 // total}%)")
+
+def check_integrity(path):
+    """Ejecuta PRAGMA integrity_check sobre `path` y lanza ValueError si la base de datos está dañada"""
+    conn = sqlite3.connect(path)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise ValueError(f"La base de datos {os.path.basename(path)} no supera integrity_check: {'; '.join(result[:5])}")
+
+def backup_db(backup_dir='backups', compress=False, progress=None, db_path=None):
+    """Copia consistente de la base de datos con la API de copia en caliente de SQLite.
+
+    La copia avanza por pasos de BACKUP_PAGES_PER_STEP páginas, sin bloquear a los escritores
+    durante toda la copia. `progress(copiadas, total)` recibe el avance en páginas. El resultado
+    se comprueba con integrity_check y, con `compress`, se guarda como .db.gz. `db_path` permite
+    copiar otra base de datos distinta de DB_PATH.
+    """
+    db_path = db_path or DB_PATH
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     backup_path = os.path.join(backup_dir, f'cavacrm_backup_{timestamp}.db')
-    shutil.copy(DB_PATH, backup_path)
+    temp_path = f'{backup_path}.tmp'
+    progress = progress or _log_progress
+
+    started = time.perf_counter()
+    # Conexiones propias, fuera del pool: la copia no debe compartir transacción con la aplicación
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP,
+                      progress=lambda status, remaining, total: progress(total - remaining, total))
+    except Exception:
+        target.close()
+        os.remove(temp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    try:
+        check_integrity(temp_path)
+        if compress:
+            backup_path += '.gz'
+            with open(temp_path, 'rb') as src, gzip.open(backup_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            os.replace(temp_path, backup_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(f"SQLite backup written to {backup_path} in {time.perf_counter() - started:.1f} s")
     return backup_path
 
 def restore_db(backup_path):
+    """Sustituye la base de datos por la copia `backup_path` (.db o .db.gz).
+
+    La copia se descomprime o copia junto a la base de datos, se comprueba con integrity_check
+    y solo entonces reemplaza el fichero actual con os.replace (atómico).
+    """
     if not os.path.exists(backup_path):
         raise FileNotFoundError(f"Backup file not found: {backup_path}")
-    shutil.copy(backup_path, DB_PATH)
-    return DB_PATH
\ No newline at end of file
+    temp_path = f'{DB_PATH}.restore.tmp'
+    try:
+        if backup_path.endswith('.gz'):
+            with gzip.open(backup_path, 'rb') as src, open(temp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            shutil.copy(backup_path, temp_path)
+        check_integrity(temp_path)
+
+        # Las conexiones abiertas y el WAL pertenecen a la base de datos que se sustituye; ningún
+        # hilo puede abrir otra (y recrear el WAL) hasta que el fichero nuevo esté en su sitio
+        with sqlite_pool.replacing(DB_PATH):
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
+            os.replace(temp_path, DB_PATH)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(f"Database restored from {backup_path}")
+    return DB_PATH
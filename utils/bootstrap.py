@@ -0,0 +1,107 @@
+"""Inicialización de la aplicación una sola vez por proceso del servidor
+
+Streamlit vuelve a ejecutar app.py en cada interacción, pero los módulos importados se
+conservan: el estado de este módulo dura lo que el proceso. Los reruns solo leen el estado.
+"""
+
+import os
+import time
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Segundos tras una inicialización fallida antes de volver a intentarla en otro rerun
+BOOTSTRAP_RETRY_INTERVAL = float(os.getenv('BOOTSTRAP_RETRY_INTERVAL', '60'))
+
+class HealthState:
+    """Resultado de la inicialización del proceso"""
+
+    def __init__(self):
+        self.started_at = datetime.datetime.now()
+        self.finished_at = None
+        self.duration = 0.0
+        self.database_ready = False
+        # 'skipped' fuera de los entornos de deploy, 'ok' o 'error'
+        self.default_data = 'skipped'
+        self.errors = []
+
+    @property
+    def ok(self):
+        return self.database_ready and not self.errors
+
+    @property
+    def status(self):
+        if self.ok:
+            return 'ok'
+        return 'degraded' if self.database_ready else 'error'
+
+_lock = threading.Lock()
+# (HealthState, instante del fallo o None): se publica en una sola asignación, porque se lee sin bloqueo
+_state = (None, None)
+
+def _initialize():
+    from utils.database_unified import init_db
+    health = HealthState()
+    started = time.perf_counter()
+
+    logger.info("Initializing database (once per process)...")
+    try:
+        health.database_ready = bool(init_db())
+        if not health.database_ready:
+            health.errors.append("La base de datos no está inicializada")
+    except Exception as e:
+        logger.error(f"Error initializing database: {e}")
+        health.errors.append(f"Error al inicializar la base de datos: {e}")
+
+    # Datos por defecto solo en entornos de deploy
+    try:
+        from config import is_deployed_environment
+        if is_deployed_environment() and health.database_ready:
+            from init_default_data import run_default_initialization
+            logger.info("Deploy environment detected, checking for default data...")
+            run_default_initialization()
+            health.default_data = 'ok'
+    except ImportError:
+        logger.info("Default data initialization not available")
+    except Exception as e:
+        logger.error(f"Error loading default data: {e}")
+        health.default_data = 'error'
+        health.errors.append(f"Error al cargar los datos por defecto: {e}")
+
+    health.duration = time.perf_counter() - started
+    health.finished_at = datetime.datetime.now()
+    logger.info(f"Process initialization finished in {health.duration * 1000:.0f} ms: {health.status}")
+    return health
+
+def _retry_due(failed_at):
+    return failed_at is None or time.monotonic() - failed_at >= BOOTSTRAP_RETRY_INTERVAL
+
+def ensure_initialized():
+    """Inicializa el proceso la primera vez y devuelve su HealthState.
+    
+    Las llamadas siguientes no hacen ninguna consulta. Si la inicialización falló, se repite
+    como mucho cada BOOTSTRAP_RETRY_INTERVAL segundos.
+    """
+    global _state
+    health, failed_at = _state
+    if health is not None and (health.ok or not _retry_due(failed_at)):
+        return health
+    with _lock:
+        # Otra sesión pudo inicializar el proceso mientras se esperaba el bloqueo
+        health, failed_at = _state
+        if health is None or (not health.ok and _retry_due(failed_at)):
+            health = _initialize()
+            _state = (health, None if health.ok else time.monotonic())
+        return health
+
+def get_health():
+    """Estado de la inicialización del proceso (None si aún no se ha hecho), sin hacer consultas"""
+    return _state[0]
+
+def reset():
+    """Fuerza una nueva inicialización en el siguiente rerun (p. ej. tras restaurar la base de datos)"""
+    global _state
+    with _lock:
+        _state = (None, None)
@@ -0,0 +1,70 @@
+"""Caché de proceso para los datos de referencia (coordinadores, verificadores, bodegas y tipos de incidencia)"""
+
+import os
+import time
+import logging
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Segundos que una entrada permanece en caché. Las escrituras locales la invalidan antes;
+# el TTL solo acota cuánto tarda en verse un cambio hecho desde otro proceso.
+REFERENCE_CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL', '300'))
+
+class ReferenceCache:
+    """Caché con TTL e invalidación explícita por tabla, compartida por todas las sesiones del proceso"""
+
+    def __init__(self, ttl=None):
+        self.ttl = REFERENCE_CACHE_TTL if ttl is None else ttl
+        self._entries = {}
+        self._generations = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, table, key, loader):
+        """Devuelve el valor cacheado de `key` o lo carga con `loader`.
+
+        Los resultados vacíos no se cachean: los lectores devuelven una lista vacía
+        también cuando la consulta falla.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((table, key))
+            if entry is not None and now - entry[0] < self.ttl:
+                return list(entry[1])
+            generation = self._generation(table)
+
+        value = loader()
+
+        if value:
+            with self._lock:
+                # No guardar datos leídos antes de una invalidación concurrente
+                if self._generation(table) == generation:
+                    self._entries[(table, key)] = (time.monotonic(), value)
+            return list(value)
+        return value
+
+    def _generation(self, table):
+        return (self._global_generation, self._generations.get(table, 0))
+
+    def invalidate(self, *tables):
+        """Descarta las entradas de las tablas indicadas (todas si no se indica ninguna)"""
+        with self._lock:
+            if not tables:
+                self._entries.clear()
+                self._global_generation += 1
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for entry_key in [k for k in self._entries if k[0] == table]:
+                    del self._entries[entry_key]
+        logger.debug(f"Reference cache invalidated: {', '.join(tables) if tables else 'all'}")
+
+    def cached(self, table):
+        """Decorador para lectores sin argumentos de una tabla de referencia"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper():
+                return self.get_or_load(table, func.__name__, func)
+            return wrapper
+        return decorator
@@ -0,0 +1,31 @@
+"""Lectura de CSV subidos para la importación masiva de verificadores y bodegas (común a ambos backends)"""
+
+import pandas as pd
+
+def read_upload_csv(csv_file, sep):
+    """Lee un CSV subido con todas las columnas como texto y nombres de columna normalizados"""
+    # Resetear el puntero del archivo al inicio
+    csv_file.seek(0)
+    df = pd.read_csv(csv_file, sep=sep, encoding='utf-8-sig', dtype=str)
+    # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('ï»¿', '')
+    return df
+
+def new_rows(df, key_columns, existing_rows, columns, required_columns):
+    """Separa las filas del CSV que no existen todavía, con operaciones vectorizadas.
+    
+    Devuelve (filas_nuevas, omitidas, inválidas): las filas sin algún campo obligatorio son
+    inválidas y las que ya existen (o están repetidas en el propio archivo) se omiten.
+    """
+    for column in columns:
+        if column not in df.columns:
+            df[column] = ''
+    invalid = df[required_columns].isna().any(axis=1)
+    valid = df.loc[~invalid, columns].fillna('').drop_duplicates(subset=key_columns)
+    
+    existing = pd.DataFrame(existing_rows, columns=key_columns).dropna().drop_duplicates()
+    merged = valid.merge(existing, on=key_columns, how='left', indicator=True)
+    new = merged.loc[merged['_merge'] == 'left_only', columns]
+    
+    skipped = int((~invalid).sum()) - len(new)
+    return new.to_dict('records'), skipped, int(invalid.sum())
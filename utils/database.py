@@ -1,9 +1,16 @@
 import sqlite3
 import pandas as pd
 import os
+import re
 import logging
-import datetime
-from .backup_restore import backup_db
+from . import sqlite_pool
+from .backup_restore import backup_db, restore_db
+from .ndjson_backup import open_backup, restore_backups
+from .snapshot import SnapshotStore
+from .snapshot_file import SnapshotFile
+from .cache import ReferenceCache
+from .excel_export import write_history_workbook
+from .csv_import import read_upload_csv, new_rows
 try:
     from config import is_deployed_environment, DB_CONFIG
 except ImportError:
@@ -15,12 +22,82 @@ except ImportError:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Caché de proceso de las tablas de referencia; las escrituras la invalidan
+_reference_cache = ReferenceCache()
+
 DB_PATH = DB_CONFIG['path']
 
+# Reconstrucción del resumen diario de incident_records (carga inicial o corrección)
+REBUILD_INCIDENT_ROLLUP = '''
+    DELETE FROM incident_daily_rollup;
+    INSERT INTO incident_daily_rollup (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+    SELECT date(date), COALESCE(warehouse_id, 0), COALESCE(causing_verifier_id, 0), COALESCE(incident_id, 0),
+           COALESCE(status, ''), COALESCE(responsible, ''), COUNT(*)
+    FROM incident_records
+    GROUP BY 1, 2, 3, 4, 5, 6;
+'''
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db', 'schema.sql')
+
+_SCHEMA_VERSION_MARKER = re.compile(r'^-- @version (\d+)[ \t]*$', re.MULTILINE)
+
+def _schema_sections():
+    """Secciones de db/schema.sql por versión de esquema: [(versión, script)], con 0 para las tablas iniciales"""
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+    parts = _SCHEMA_VERSION_MARKER.split(schema)
+    return [(0, parts[0])] + [(int(version), script) for version, script in zip(parts[1::2], parts[2::2])]
+
+# Pasos de migración que no están en db/schema.sql porque solo hacen falta al actualizar una base
+# de datos existente: (antes, después) del DDL de la sección de esa versión
+SCHEMA_UPGRADE_STEPS = {
+    # Resumen diario de los registros que ya existían
+    3: ('', REBUILD_INCIDENT_ROLLUP),
+    # Columnas que el esquema actual ya crea con la tabla
+    4: ('''
+    ALTER TABLE incident_records ADD COLUMN updated_at TEXT;
+    ALTER TABLE incident_actions ADD COLUMN updated_at TEXT;
+    UPDATE incident_records SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now');
+    UPDATE incident_actions SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now');
+    ''', ''),
+    # Índice de búsqueda de los registros que ya existían
+    6: ('', '''
+    INSERT INTO incident_records_fts (rowid, explanation, incident, actions)
+    SELECT ir.id, ir.explanation, i.code || ' ' || i.description,
+           COALESCE((SELECT group_concat(action_description, ' ') FROM incident_actions WHERE incident_record_id = ir.id), '')
+    FROM incident_records ir
+    LEFT JOIN incidents i ON i.id = ir.incident_id;
+    '''),
+}
+
+SCHEMA_VERSION = _schema_sections()[-1][0]
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Conexión del hilo actual, reutilizada entre llamadas (ver utils/sqlite_pool.py)"""
+    return sqlite_pool.connect(DB_PATH)
+
+def _run_in_transaction(conn, script):
+    """Ejecuta `script` en una sola transacción: si falla, no queda ningún cambio a medias"""
+    try:
+        # executescript confirma cualquier transacción abierta, así que la transacción va en el propio script
+        conn.executescript('BEGIN IMMEDIATE;\n' + script + '\nCOMMIT;')
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+def _apply_schema_migrations(conn):
+    """Aplica las migraciones de esquema pendientes según PRAGMA user_version.
+    
+    Cada versión es su sección de db/schema.sql más sus SCHEMA_UPGRADE_STEPS, y se aplica en una
+    transacción junto con el nuevo user_version.
+    """
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, script in _schema_sections():
+        if version > current_version:
+            logger.info(f"Applying schema migration {version}")
+            before, after = SCHEMA_UPGRADE_STEPS.get(version, ('', ''))
+            _run_in_transaction(conn, before + script + after + f'\nPRAGMA user_version = {version};')
 
 def init_db():
     # Verificar entorno y configuración
@@ -73,13 +150,19 @@ def init_db():
     # En entornos de deploy, ser extra cuidadoso
     if not tables_exist or (not deployed and not preserve_data):
         logger.info("Executing schema to create/update tables...")
-        with open(os.path.join('db', 'schema.sql'), 'r', encoding='utf-8') as f:
-            cursor.executescript(f.read())
-        conn.commit()
+        with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+            schema = f.read()
+        if not tables_exist:
+            # El esquema recién creado ya incluye todas las migraciones
+            schema += f'\nPRAGMA user_version = {SCHEMA_VERSION};'
+        _run_in_transaction(conn, schema)
         logger.info("Schema executed successfully")
     else:
         logger.info("Tables already exist, skipping schema execution to preserve data")
     
+    # Aplicar los cambios de esquema pendientes sin tocar los datos existentes
+    _apply_schema_migrations(conn)
+    
     # Verificar datos después de la inicialización
     try:
         final_count = cursor.execute('SELECT COUNT(*) FROM coordinators').fetchone()[0]
@@ -111,6 +194,7 @@ def insert_coordinator(name, surnames):
         conn = get_db_connection()
         conn.execute('INSERT INTO coordinators (name, surnames) VALUES (?, ?)', (name, surnames))
         conn.commit()
+        _reference_cache.invalidate('coordinators')
         logger.info(f"Inserted coordinator: {name} {surnames}")
     except sqlite3.Error as e:
         logger.error(f"Error inserting coordinator: {e}")
@@ -122,6 +206,7 @@ def insert_verifier(name, surnames, phone, zone):
         conn = get_db_connection()
         conn.execute('INSERT INTO verifiers (name, surnames, phone, zone) VALUES (?, ?, ?, ?)', (name, surnames, phone, zone))
         conn.commit()
+        _reference_cache.invalidate('verifiers')
         logger.info(f"Inserted verifier: {name} {surnames}")
     except sqlite3.Error as e:
         logger.error(f"Error inserting verifier: {e}")
@@ -133,78 +218,124 @@ def insert_warehouse(name, codigo_consejo, zone):
         conn = get_db_connection()
         conn.execute('INSERT INTO warehouses (name, codigo_consejo, zone) VALUES (?, ?, ?)', (name, codigo_consejo, zone))
         conn.commit()
+        _reference_cache.invalidate('warehouses')
         logger.info(f"Inserted warehouse: {name} with Código Consejo {codigo_consejo}")
     except sqlite3.Error as e:
         logger.error(f"Error inserting warehouse: {e}")
     finally:
         conn.close()
 
+# Filas por sentencia en las inserciones masivas
+BULK_INSERT_CHUNK_SIZE = 500
+
+def _bulk_insert(conn, table, rows, columns):
+    """Inserta filas por bloques con executemany; un bloque fallido se deshace sin afectar a los demás.
+    
+    Devuelve (insertadas, fallidas).
+    """
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    inserted = failed = 0
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+        conn.execute('SAVEPOINT bulk_chunk')
+        try:
+            conn.executemany(query, [tuple(row[column] for column in columns) for row in chunk])
+            inserted += len(chunk)
+        except sqlite3.Error as e:
+            logger.error(f"Error bulk inserting {len(chunk)} rows into {table}: {e}")
+            conn.execute('ROLLBACK TO SAVEPOINT bulk_chunk')
+            failed += len(chunk)
+        conn.execute('RELEASE SAVEPOINT bulk_chunk')
+    return inserted, failed
+
 def load_csv_to_verifiers(csv_file, sep=','):
-    # Resetear el puntero del archivo al inicio
-    csv_file.seek(0)
-    df = pd.read_csv(csv_file, sep=sep, encoding='utf-8-sig')
-    # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('ï»¿', '')
+    """Importa verificadores desde CSV en bloque, omitiendo los que ya existen (nombre y apellidos).
+    
+    Devuelve un informe {'inserted', 'skipped', 'failed'}.
+    """
+    df = read_upload_csv(csv_file, sep)
     conn = get_db_connection()
-    for _, row in df.iterrows():
-        name = row['name']
-        surnames = row['surnames']
-        cursor = conn.execute('SELECT COUNT(*) FROM verifiers WHERE name = ? AND surnames = ?', (name, surnames))
-        if cursor.fetchone()[0] == 0:
-            insert_verifier(name, surnames, row.get('phone', ''), row.get('zone', ''))
-        else:
-            print(f"Verifier {name} {surnames} already exists, skipping.")
-    conn.close()
+    try:
+        # Con el bloqueo de escritura nadie puede insertar las mismas claves entre la lectura y la inserción
+        conn.execute('BEGIN IMMEDIATE')
+        existing = [dict(row) for row in conn.execute('SELECT name, surnames FROM verifiers')]
+        rows, skipped, invalid = new_rows(df, ['name', 'surnames'], existing, ['name', 'surnames', 'phone', 'zone'], ['name', 'surnames'])
+        inserted, failed = _bulk_insert(conn, 'verifiers', rows, ['name', 'surnames', 'phone', 'zone'])
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if inserted:
+        _reference_cache.invalidate('verifiers')
+    report = {'inserted': inserted, 'skipped': skipped, 'failed': failed + invalid}
+    logger.info(f"Verifiers CSV import: {report}")
+    return report
 
 def load_csv_to_warehouses(csv_file, sep=','):
-    # Resetear el puntero del archivo al inicio
-    csv_file.seek(0)
-    df = pd.read_csv(csv_file, sep=sep, encoding='utf-8-sig')
-    # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('ï»¿', '')
+    """Importa bodegas desde CSV en bloque, omitiendo las que ya existen (código consejo).
+    
+    Devuelve un informe {'inserted', 'skipped', 'failed'}.
+    """
+    df = read_upload_csv(csv_file, sep)
     conn = get_db_connection()
-    for _, row in df.iterrows():
-        codigo_consejo = row['codigo_consejo']
-        cursor = conn.execute('SELECT COUNT(*) FROM warehouses WHERE codigo_consejo = ?', (codigo_consejo,))
-        if cursor.fetchone()[0] == 0:
-            insert_warehouse(row['name'], codigo_consejo, row.get('zone', ''))
-        else:
-            print(f"Warehouse with Código Consejo {codigo_consejo} already exists, skipping.")
-    conn.close()
+    try:
+        # Con el bloqueo de escritura nadie puede insertar las mismas claves entre la lectura y la inserción
+        conn.execute('BEGIN IMMEDIATE')
+        existing = [dict(row) for row in conn.execute('SELECT codigo_consejo FROM warehouses')]
+        rows, skipped, invalid = new_rows(df, ['codigo_consejo'], existing, ['name', 'codigo_consejo', 'zone'], ['name', 'codigo_consejo'])
+        inserted, failed = _bulk_insert(conn, 'warehouses', rows, ['name', 'codigo_consejo', 'zone'])
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if inserted:
+        _reference_cache.invalidate('warehouses')
+    report = {'inserted': inserted, 'skipped': skipped, 'failed': failed + invalid}
+    logger.info(f"Warehouses CSV import: {report}")
+    return report
 
 def insert_incident(description, custom_code=None):
-    """Inserta una nueva incidencia con código automático o personalizado"""
+    """Inserta una nueva incidencia con código automático o personalizado.
+    
+    El código automático sale de la tabla `sequences` dentro de una transacción con bloqueo
+    de escritura (BEGIN IMMEDIATE), de modo que dos inserciones simultáneas nunca reciben el mismo código.
+    """
     try:
         conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
         
         if custom_code:
-            # Verificar si el código personalizado ya existe
-            existing = conn.execute('SELECT id FROM incidents WHERE code = ?', (custom_code,)).fetchone()
-            if existing:
-                return {'success': False, 'error': f'El código "{custom_code}" ya existe. Por favor, use un código diferente.'}
             code = custom_code
         else:
-            # Generar código automático
-            cursor = conn.execute('SELECT COUNT(*) FROM incidents')
-            count = cursor.fetchone()[0]
-            code = f"{count + 1:03d}"
-            
-            # Verificar que el código automático no exista (por seguridad)
-            while conn.execute('SELECT id FROM incidents WHERE code = ?', (code,)).fetchone():
-                count += 1
-                code = f"{count + 1:03d}"
+            # Siguiente valor de la secuencia, saltando los códigos ya usados como personalizados
+            while True:
+                conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'incident_code'")
+                value = conn.execute("SELECT value FROM sequences WHERE name = 'incident_code'").fetchone()[0]
+                code = f"{value:03d}"
+                if not conn.execute('SELECT 1 FROM incidents WHERE code = ?', (code,)).fetchone():
+                    break
         
         conn.execute('INSERT INTO incidents (code, description) VALUES (?, ?)', (code, description))
         conn.commit()
+        _reference_cache.invalidate('incidents')
         logger.info(f"Inserted incident with code {code}")
         return {'success': True, 'code': code}
         
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        # Solo un código personalizado puede chocar con uno existente; el automático ya se comprobó
+        if custom_code:
+            return {'success': False, 'error': f'El código "{custom_code}" ya existe. Por favor, use un código diferente.'}
+        logger.error(f"Error inserting incident: {e}")
+        return {'success': False, 'error': f'Error al guardar la incidencia: {str(e)}'}
     except sqlite3.Error as e:
+        conn.rollback()
         logger.error(f"Error inserting incident: {e}")
         return {'success': False, 'error': f'Error al guardar la incidencia: {str(e)}'}
     finally:
         conn.close()
 
+@_reference_cache.cached('coordinators')
 def get_coordinators():
     try:
         conn = get_db_connection()
@@ -216,18 +347,21 @@ def get_coordinators():
     finally:
         conn.close()
 
+@_reference_cache.cached('verifiers')
 def get_verifiers():
     conn = get_db_connection()
     verifiers = conn.execute('SELECT id, name, surnames, phone, zone FROM verifiers').fetchall()
     conn.close()
     return [dict(row) for row in verifiers]
 
+@_reference_cache.cached('warehouses')
 def get_warehouses():
     conn = get_db_connection()
     warehouses = conn.execute('SELECT id, name, codigo_consejo, zone FROM warehouses').fetchall()
     conn.close()
     return [dict(row) for row in warehouses]
 
+@_reference_cache.cached('incidents')
 def get_incidents():
     conn = get_db_connection()
     incidents = conn.execute('SELECT id, code || " - " || description AS label FROM incidents').fetchall()
@@ -240,6 +374,7 @@ def insert_incident_record(date, registering_coordinator_id, warehouse_id, causi
         conn.execute('INSERT INTO incident_records (date, registering_coordinator_id, warehouse_id, causing_verifier_id, incident_id, assigned_coordinator_id, explanation, status, responsible) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', 
                      (date, registering_coordinator_id, warehouse_id, causing_verifier_id, incident_id, assigned_coordinator_id, explanation, status, responsible))
         conn.commit()
+        invalidate_incident_snapshot(rows_only=True)
         logger.info(f"Inserted incident record on date {date}")
     except sqlite3.Error as e:
         logger.error(f"Error inserting incident record: {e}")
@@ -252,31 +387,201 @@ def get_incident_records():
     conn.close()
     return [(row['id'], f"ID: {row['id']} - Fecha: {row['date']} - Incidencia: {row['incident']} - Bodega: {row['warehouse']} - Verificador: {row['causing_verifier']} - Coordinador: {row['assigned_coordinator']}") for row in records]
 
-def insert_incident_action(incident_record_id, action_date, action_description, new_status, performed_by):
+def _like_contains(text):
+    """Patrón LIKE (con ESCAPE '\\') que contiene `text` literalmente: % y _ del usuario no son comodines"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+
+def get_incident_records_page(cursor=None, page_size=25, record_id=None, warehouse=None, code=None, status=None):
+    """Página de registros para el selector, ordenada por (fecha, id) descendente.
+    
+    `cursor` es el (fecha, id) del último registro de la página anterior; la respuesta
+    incluye `next_cursor` (None si no hay más páginas). Los filtros se aplican en la consulta.
+    """
+    query = '''
+    SELECT ir.id, ir.date, i.code || " - " || i.description AS incident, w.name AS warehouse,
+           v.name || " " || v.surnames AS causing_verifier, ac.name || " " || ac.surnames AS assigned_coordinator
+    FROM incident_records ir
+    JOIN warehouses w ON ir.warehouse_id = w.id
+    JOIN verifiers v ON ir.causing_verifier_id = v.id
+    JOIN incidents i ON ir.incident_id = i.id
+    JOIN coordinators ac ON ir.assigned_coordinator_id = ac.id
+    WHERE 1 = 1
+    '''
+    params = []
+    
+    if cursor:
+        query += " AND (ir.date < ? OR (ir.date = ? AND ir.id < ?))"
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    if record_id:
+        query += " AND ir.id = ?"
+        params.append(record_id)
+    if warehouse:
+        query += " AND w.name LIKE ? ESCAPE '\\'"
+        params.append(_like_contains(warehouse))
+    if code:
+        query += " AND i.code LIKE ? ESCAPE '\\'"
+        params.append(_like_contains(code))
+    if status:
+        query += " AND ir.status = ?"
+        params.append(status)
+    
+    # Se pide un registro de más para saber si existe una página siguiente
+    query += " ORDER BY ir.date DESC, ir.id DESC LIMIT ?"
+    params.append(page_size + 1)
+    
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    page = rows[:page_size]
+    next_cursor = (page[-1]['date'], page[-1]['id']) if len(rows) > page_size else None
+    records = [(row['id'], f"ID: {row['id']} - Fecha: {row['date']} - Incidencia: {row['incident']} - Bodega: {row['warehouse']} - Verificador: {row['causing_verifier']} - Coordinador: {row['assigned_coordinator']}") for row in page]
+    return {'records': records, 'next_cursor': next_cursor}
+
+def apply_incident_actions(actions):
+    """Inserta una o varias acciones y aplica sus cambios de estado en una sola transacción.
+    
+    `actions` es una lista de diccionarios con incident_record_id, action_date, action_description,
+    new_status y performed_by. Si alguna falla (p. ej. un registro que no existe), no se guarda ninguna.
+    Devuelve {'success': True, 'inserted': n, 'updated': m} o {'success': False, 'error': mensaje}.
+    """
+    if not actions:
+        return {'success': True, 'inserted': 0, 'updated': 0}
+    rows = [(action['incident_record_id'], str(action['action_date']), action['action_description'],
+             action.get('new_status') or None, action['performed_by']) for action in actions]
+    # Último estado de cada registro, en el orden de las acciones
+    last_status = {row[0]: row[3] for row in rows if row[3]}
+    record_ids = list({row[0] for row in rows})
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        conn.execute('INSERT INTO incident_actions (incident_record_id, action_date, action_description, new_status, performed_by) VALUES (?, ?, ?, ?, ?)', (incident_record_id, action_date, action_description, new_status, performed_by))
-        if new_status:
-            conn.execute('UPDATE incident_records SET status = ? WHERE id = ?', (new_status, incident_record_id))
+        existing = {row[0] for row in conn.execute(
+            f"SELECT id FROM incident_records WHERE id IN ({','.join('?' * len(record_ids))})", record_ids)}
+        missing = [record_id for record_id in record_ids if record_id not in existing]
+        if missing:
+            return {'success': False, 'error': f"No existen los registros de incidencia: {', '.join(map(str, sorted(missing)))}"}
+        conn.executemany('INSERT INTO incident_actions (incident_record_id, action_date, action_description, new_status, performed_by) VALUES (?, ?, ?, ?, ?)', rows)
+        updated = conn.executemany('UPDATE incident_records SET status = ? WHERE id = ? AND status IS NOT ?',
+                                   [(status, record_id, status) for record_id, status in last_status.items()]).rowcount
         conn.commit()
-        logger.info(f"Inserted action for incident record {incident_record_id}")
+        if last_status:
+            invalidate_incident_snapshot(rows_only=True)
+        logger.info(f"Applied {len(rows)} incident actions ({updated} status changes)")
+        return {'success': True, 'inserted': len(rows), 'updated': updated}
     except sqlite3.Error as e:
-        logger.error(f"Error inserting incident action: {e}")
+        logger.error(f"Error applying incident actions: {e}")
+        return {'success': False, 'error': str(e)}
     finally:
         conn.close()
 
+def insert_incident_action(incident_record_id, action_date, action_description, new_status, performed_by):
+    result = apply_incident_actions([{
+        'incident_record_id': incident_record_id,
+        'action_date': action_date,
+        'action_description': action_description,
+        'new_status': new_status,
+        'performed_by': performed_by
+    }])
+    if result['success']:
+        logger.info(f"Inserted action for incident record {incident_record_id}")
+    else:
+        logger.error(f"Error inserting incident action: {result['error']}")
+
 def get_incident_actions(incident_record_id):
     conn = get_db_connection()
     actions = conn.execute('SELECT ia.action_date, ia.action_description, ia.new_status, c.name || " " || c.surnames AS performed_by FROM incident_actions ia JOIN coordinators c ON ia.performed_by = c.id WHERE ia.incident_record_id = ? ORDER BY ia.action_date', (incident_record_id,)).fetchall()
     conn.close()
     return actions
 
-def get_all_incident_records_df():
+INCIDENT_RECORDS_DF_QUERY = 'SELECT ir.*, c.name || " " || c.surnames AS registering_coordinator, w.name AS warehouse, w.zone AS warehouse_zone, v.name || " " || v.surnames AS causing_verifier, v.zone AS verifier_zone, i.description AS incident_type, ac.name || " " || ac.surnames AS assigned_coordinator FROM incident_records ir JOIN coordinators c ON ir.registering_coordinator_id = c.id JOIN warehouses w ON ir.warehouse_id = w.id JOIN verifiers v ON ir.causing_verifier_id = v.id JOIN incidents i ON ir.incident_id = i.id JOIN coordinators ac ON ir.assigned_coordinator_id = ac.id'
+
+def _fetch_incident_records_df():
+    """Lee los registros de incidencias enriquecidos (usar la instantánea compartida)"""
     conn = get_db_connection()
-    df = pd.read_sql_query('SELECT ir.*, c.name || " " || c.surnames AS registering_coordinator, w.name AS warehouse, w.zone AS warehouse_zone, v.name || " " || v.surnames AS causing_verifier, v.zone AS verifier_zone, i.description AS incident_type, ac.name || " " || ac.surnames AS assigned_coordinator FROM incident_records ir JOIN coordinators c ON ir.registering_coordinator_id = c.id JOIN warehouses w ON ir.warehouse_id = w.id JOIN verifiers v ON ir.causing_verifier_id = v.id JOIN incidents i ON ir.incident_id = i.id JOIN coordinators ac ON ir.assigned_coordinator_id = ac.id', conn)
+    df = pd.read_sql_query(INCIDENT_RECORDS_DF_QUERY, conn)
     conn.close()
     return df
 
+def _watermark_param(watermark):
+    """Marca de agua (datetime en UTC) con el formato de updated_at"""
+    return watermark.strftime('%Y-%m-%d %H:%M:%S')
+
+def get_incident_records_since(watermark):
+    """Registros de incidencias enriquecidos modificados desde `watermark` (datetime en UTC).
+    
+    Devuelve None si la lectura falla. Los borrados no se detectan: reset_database invalida la instantánea completa.
+    """
+    conn = get_db_connection()
+    try:
+        return pd.read_sql_query(INCIDENT_RECORDS_DF_QUERY + ' WHERE ir.updated_at >= ?', conn, params=(_watermark_param(watermark),))
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        logger.error(f"Error getting incident records since {watermark}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_incident_actions_since(watermark):
+    """Acciones creadas o modificadas desde `watermark` (datetime en UTC), o None si la lectura falla"""
+    conn = get_db_connection()
+    try:
+        return pd.read_sql_query('''
+            SELECT ia.id, ia.incident_record_id, ia.action_date, ia.action_description, ia.new_status,
+                   COALESCE(c.name || ' ' || c.surnames, 'N/A') AS performed_by, ia.updated_at
+            FROM incident_actions ia
+            LEFT JOIN coordinators c ON ia.performed_by = c.id
+            WHERE ia.updated_at >= ?
+            ORDER BY ia.id
+        ''', conn, params=(_watermark_param(watermark),))
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        logger.error(f"Error getting incident actions since {watermark}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_incident_snapshot_version():
+    """Versión de los datos de la instantánea: número de registros, último updated_at y versión
+    de las tablas de referencia. None si la consulta falla"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM incident_records) AS records,
+                   (SELECT MAX(updated_at) FROM incident_records) AS updated_at,
+                   (SELECT value FROM sequences WHERE name = 'reference_version') AS reference
+        ''').fetchone()
+        return dict(row)
+    except sqlite3.Error as e:
+        logger.error(f"Error getting incident snapshot version: {e}")
+        return None
+    finally:
+        conn.close()
+
+# Instantánea de los registros enriquecidos: se lee completa una vez (o del disco al arrancar)
+# y después se renueva como máximo una vez por rerun con los registros modificados
+_incident_snapshots = SnapshotStore(
+    _fetch_incident_records_df,
+    delta_loader=get_incident_records_since,
+    version_loader=get_incident_snapshot_version,
+    snapshot_file=SnapshotFile('incident_records_sqlite', lambda: os.path.abspath(DB_PATH))
+)
+
+def get_incident_snapshot():
+    """Obtiene la instantánea compartida de los registros de incidencias enriquecidos"""
+    return _incident_snapshots.get()
+
+def invalidate_incident_snapshot(rows_only=False):
+    """Descarta la instantánea tras una escritura. Con `rows_only` (la escritura solo cambia filas de
+    incident_records) la próxima lectura lee únicamente los registros modificados"""
+    if rows_only:
+        _incident_snapshots.expire()
+    else:
+        _incident_snapshots.invalidate()
+
+def get_all_incident_records_df():
+    return get_incident_snapshot().df.copy(deep=False)
+
+def search_incident_records_df(term):
+    """Registros enriquecidos que contienen `term` en alguna columna visible, sin distinguir mayúsculas ni acentos"""
+    return get_incident_snapshot().search(term).copy(deep=False)
+
 def get_all_verifiers_df():
     conn = get_db_connection()
     df = pd.read_sql_query('SELECT * FROM verifiers', conn)
@@ -290,28 +595,81 @@ def get_all_warehouses_df():
     return df
 
 def get_incidents_by_zone():
-    df = get_all_incident_records_df()
-    return df.groupby('warehouse_zone').size().reset_index(name='count')
+    return get_incident_breakdowns()['by_zone']
 
 def get_incidents_by_verifier():
-    df = get_all_incident_records_df()
-    return df.groupby('causing_verifier').size().reset_index(name='count')
+    return get_incident_breakdowns()['by_verifier']
 
 def get_incidents_by_warehouse():
-    df = get_all_incident_records_df()
-    return df.groupby('warehouse').size().reset_index(name='count')
+    return get_incident_breakdowns()['by_warehouse']
 
 def get_incidents_by_type():
-    df = get_all_incident_records_df()
-    return df.groupby('incident_type').size().reset_index(name='count')
+    return get_incident_breakdowns()['by_type']
 
 def get_incidents_by_status():
-    df = get_all_incident_records_df()
-    return df.groupby('status').size().reset_index(name='count')
+    return get_incident_breakdowns()['by_status']
 
 def get_assignments_by_verifier():
-    df = get_all_incident_records_df()
-    return df[df['responsible'] == 'Verificador'].groupby('causing_verifier').size().reset_index(name='count')
+    return get_incident_breakdowns()['assignments_by_verifier']
+
+# Columna agrupada por cada desglose de la analítica de incidencias
+INCIDENT_BREAKDOWNS = {
+    'by_zone': 'warehouse_zone',
+    'by_verifier': 'causing_verifier',
+    'by_warehouse': 'warehouse',
+    'by_type': 'incident_type',
+    'by_status': 'status',
+    'assignments_by_verifier': 'causing_verifier'
+}
+
+def get_incident_breakdowns():
+    """Obtiene todos los desgloses de la analítica de incidencias con una sola consulta sobre el resumen diario"""
+    conn = get_db_connection()
+    query = '''
+    WITH enriched AS (
+        SELECT
+            w.zone AS warehouse_zone,
+            w.name AS warehouse,
+            v.name || " " || v.surnames AS causing_verifier,
+            i.description AS incident_type,
+            NULLIF(r.status, '') AS status,
+            r.responsible,
+            r.count
+        FROM incident_daily_rollup r
+        JOIN warehouses w ON r.warehouse_id = w.id
+        JOIN verifiers v ON r.causing_verifier_id = v.id
+        JOIN incidents i ON r.incident_id = i.id
+    )
+    SELECT 'by_zone' AS breakdown, warehouse_zone AS label, SUM(count) AS count FROM enriched GROUP BY warehouse_zone
+    UNION ALL
+    SELECT 'by_verifier', causing_verifier, SUM(count) FROM enriched GROUP BY causing_verifier
+    UNION ALL
+    SELECT 'by_warehouse', warehouse, SUM(count) FROM enriched GROUP BY warehouse
+    UNION ALL
+    SELECT 'by_type', incident_type, SUM(count) FROM enriched GROUP BY incident_type
+    UNION ALL
+    SELECT 'by_status', status, SUM(count) FROM enriched GROUP BY status
+    UNION ALL
+    SELECT 'assignments_by_verifier', causing_verifier, SUM(count) FROM enriched WHERE responsible = 'Verificador' GROUP BY causing_verifier
+    '''
+    rows = conn.execute(query).fetchall()
+    conn.close()
+    
+    payload = {key: [] for key in INCIDENT_BREAKDOWNS}
+    for row in rows:
+        payload[row['breakdown']].append((row['label'], row['count']))
+    return {key: pd.DataFrame(data, columns=[INCIDENT_BREAKDOWNS[key], 'count']) for key, data in payload.items()}
+
+def rebuild_incident_rollup():
+    """Reconstruye el resumen diario desde incident_records. Devuelve el número de filas del resumen"""
+    conn = get_db_connection()
+    try:
+        _run_in_transaction(conn, REBUILD_INCIDENT_ROLLUP)
+        rows = conn.execute('SELECT COUNT(*) FROM incident_daily_rollup').fetchone()[0]
+        logger.info(f"Incident rollup rebuilt: {rows} rows")
+        return rows
+    finally:
+        conn.close()
 
 def reset_database():
     conn = get_db_connection()
@@ -320,6 +678,8 @@ def reset_database():
         conn.execute(f'DELETE FROM {table}')
     conn.commit()
     conn.close()
+    _reference_cache.invalidate()
+    invalidate_incident_snapshot()
 
 def get_incident_record_details(incident_record_id):
     conn = get_db_connection()
@@ -329,105 +689,170 @@ def get_incident_record_details(incident_record_id):
         return dict(row)
     return {}
 
-def export_incidents_to_excel():
-    """Exporta historial completo de incidencias con acciones a Excel"""
-    conn = get_db_connection()
+def _iter_query_rows(conn, query, params, page_size):
+    """Recorre el resultado de una consulta por páginas de `page_size` filas"""
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(page_size)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
+
+def export_incidents_to_excel(date_from=None, date_to=None, status=None, page_size=1000):
+    """Exporta el historial de incidencias con sus acciones a un Excel en memoria.
+    
+    Las filas se leen por páginas y se escriben en streaming; devuelve un BytesIO.
+    Filtros opcionales: rango de fechas del registro (inclusive) y estado.
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append('ir.date >= ?')
+        params.append(str(date_from))
+    if date_to:
+        conditions.append("ir.date < date(?, '+1 day')")
+        params.append(str(date_to))
+    if status:
+        conditions.append('ir.status = ?')
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
     
     # Obtener datos de incidencias
-    incidents_query = '''
+    incidents_query = f'''
     SELECT 
-        ir.id as 'ID Registro',
-        ir.date as 'Fecha',
-        c.name || " " || c.surnames as 'Coordinador Registrador',
-        w.name as 'Bodega',
-        w.zone as 'Zona Bodega',
-        v.name || " " || v.surnames as 'Verificador Causante',
-        v.zone as 'Zona Verificador',
-        i.code || " - " || i.description as 'Incidencia',
-        ac.name || " " || ac.surnames as 'Coordinador Asignado',
-        ir.explanation as 'Explicación',
-        ir.status as 'Estado',
-        ir.responsible as 'Responsable'
+        ir.id,
+        ir.date,
+        c.name || " " || c.surnames,
+        w.name,
+        w.zone,
+        v.name || " " || v.surnames,
+        v.zone,
+        i.code || " - " || i.description,
+        ac.name || " " || ac.surnames,
+        ir.explanation,
+        ir.status,
+        ir.responsible
     FROM incident_records ir 
     JOIN coordinators c ON ir.registering_coordinator_id = c.id 
     JOIN warehouses w ON ir.warehouse_id = w.id 
     JOIN verifiers v ON ir.causing_verifier_id = v.id 
     JOIN incidents i ON ir.incident_id = i.id 
     JOIN coordinators ac ON ir.assigned_coordinator_id = ac.id
+    {where}
     ORDER BY ir.date DESC
     '''
     
-    # Obtener datos de acciones
-    actions_query = '''
+    # Obtener datos de acciones de los registros exportados
+    actions_query = f'''
     SELECT 
-        ia.incident_record_id as 'ID Registro',
-        ia.action_date as 'Fecha Acción',
-        ia.action_description as 'Descripción Acción',
-        ia.new_status as 'Nuevo Estado',
-        c.name || " " || c.surnames as 'Realizado Por'
+        ia.incident_record_id,
+        ia.action_date,
+        ia.action_description,
+        ia.new_status,
+        c.name || " " || c.surnames
     FROM incident_actions ia
     JOIN coordinators c ON ia.performed_by = c.id
+    JOIN incident_records ir ON ia.incident_record_id = ir.id
+    {where}
     ORDER BY ia.incident_record_id, ia.action_date
     '''
     
-    df_incidents = pd.read_sql_query(incidents_query, conn)
-    df_actions = pd.read_sql_query(actions_query, conn)
-    conn.close()
-    
-    # Crear archivo Excel
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'historial_incidencias_{timestamp}.xlsx'
-    
-    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-        df_incidents.to_excel(writer, sheet_name='Incidencias', index=False)
-        df_actions.to_excel(writer, sheet_name='Acciones', index=False)
-    
-    return filename
+    conn = get_db_connection()
+    try:
+        return write_history_workbook(
+            _iter_query_rows(conn, incidents_query, params, page_size),
+            _iter_query_rows(conn, actions_query, params, page_size)
+        )
+    finally:
+        conn.close()
 
-def create_backup():
-    """Crea una copia de seguridad de la base de datos"""
+def create_backup(full=True):
+    """Crea una copia de seguridad comprimida de la base de datos (en SQLite siempre es completa)"""
     try:
-        backup_path = backup_db()
+        backup_path = backup_db(compress=True)
         return backup_path
     except Exception as e:
         logger.error(f"Error creating backup: {e}")
         raise e
 
-def get_dashboard_stats():
-    """Obtiene estadísticas para el dashboard"""
-    conn = get_db_connection()
-    
-    # Estadísticas generales
-    stats = {}
+def restore_database_file(backup_path):
+    """Sustituye la base de datos por una copia .db o .db.gz y descarta las cachés de los datos anteriores"""
+    restore_db(backup_path)
+    # La instantánea en memoria y en disco es de la base de datos sustituida: un delta no la corrige
+    invalidate_incident_snapshot()
+    _incident_snapshots.snapshot_file.delete()
+    _reference_cache.invalidate()
+    return DB_PATH
+
+def restore_backup(files):
+    """Restaura copias de seguridad en NDJSON (.tar, directorio o .json antiguo) en la base de datos SQLite.
     
-    # Total de incidencias
-    stats['total_incidents'] = conn.execute('SELECT COUNT(*) FROM incident_records').fetchone()[0]
+    Mismo comportamiento que en Supabase: upsert por id, por lotes y con punto de control.
+    Devuelve las filas restauradas por tabla.
+    """
+    def upsert(table, rows):
+        conn = get_db_connection()
+        try:
+            # Solo columnas que existen en la tabla: los nombres vienen del fichero de la copia
+            known = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            columns = [column for column in dict.fromkeys(column for row in rows for column in row) if column in known]
+            updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'id')
+            conn.executemany(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                f'ON CONFLICT (id) DO UPDATE SET {updates}',
+                [[row.get(column) for column in columns] for row in rows]
+            )
+            conn.commit()
+        finally:
+            conn.close()
     
-    # Incidencias no resueltas (pendientes)
-    stats['pending_incidents'] = conn.execute('SELECT COUNT(*) FROM incident_records WHERE status != "Solucionado"').fetchone()[0]
+    def reset_sequences():
+        # sqlite_sequence ya avanza con los ids explícitos; solo queda la secuencia de códigos
+        conn = get_db_connection()
+        try:
+            conn.execute("UPDATE sequences SET value = (SELECT COUNT(*) FROM incidents) WHERE name = 'incident_code'")
+            conn.commit()
+        finally:
+            conn.close()
     
-    # Incidencias resueltas
-    stats['resolved_incidents'] = conn.execute('SELECT COUNT(*) FROM incident_records WHERE status = "Solucionado"').fetchone()[0]
+    try:
+        restored = restore_backups([open_backup(fileobj, name) for fileobj, name in files], upsert, reset_sequences)
+    finally:
+        _reference_cache.invalidate()
+        invalidate_incident_snapshot()
+    return restored
+
+def get_dashboard_stats():
+    """Obtiene estadísticas para el dashboard con una sola consulta sobre el resumen diario"""
+    conn = get_db_connection()
     
-    # Incidencias por estado
-    status_query = '''
-    SELECT status, COUNT(*) as count 
-    FROM incident_records 
-    GROUP BY status 
+    # Desglose por estado; los totales se calculan sobre los grupos con funciones de ventana
+    query = '''
+    SELECT 
+        NULLIF(status, '') as status,
+        SUM(count) as count,
+        SUM(SUM(count)) OVER () as total,
+        SUM(SUM(CASE WHEN day >= date('now', '-7 days') THEN count ELSE 0 END)) OVER () as recent
+    FROM incident_daily_rollup 
+    GROUP BY 1 
     ORDER BY count DESC
     '''
-    stats['by_status'] = pd.read_sql_query(status_query, conn)
+    rows = conn.execute(query).fetchall()
+    conn.close()
     
-    # Incidencias recientes (últimos 7 días)
-    recent_query = '''
-    SELECT COUNT(*) 
-    FROM incident_records 
-    WHERE date >= date('now', '-7 days')
-    '''
-    stats['recent_incidents'] = conn.execute(recent_query).fetchone()[0]
+    resolved = sum(row['count'] for row in rows if row['status'] == 'Solucionado')
+    # Mismo criterio que status <> 'Solucionado' en Supabase: los registros sin estado no cuentan
+    pending = sum(row['count'] for row in rows if row['status'] is not None and row['status'] != 'Solucionado')
+    total = rows[0]['total'] if rows else 0
     
-    conn.close()
-    return stats
+    return {
+        'total_incidents': total,
+        'pending_incidents': pending,
+        'resolved_incidents': resolved,
+        'by_status': pd.DataFrame([(row['status'], row['count']) for row in rows], columns=['status', 'count']),
+        'recent_incidents': rows[0]['recent'] if rows else 0
+    }
 
 def get_pending_incidents_summary():
     """Obtiene resumen de incidencias pendientes para el dashboard"""
@@ -482,6 +907,41 @@ def get_recent_actions():
     conn.close()
     return df
 
+def _fts_query(text):
+    """Consulta FTS5 a partir del texto del usuario: todas las palabras, cada una como prefijo"""
+    return ' AND '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+def search_incident_records(query, page=1, page_size=20):
+    """Búsqueda de texto completo en explicaciones, tipos de incidencia y acciones, ordenada por relevancia.
+    
+    Devuelve {'records': [...], 'total': n} con la página pedida; cada registro incluye un
+    fragmento (`snippet`) con los términos resaltados en Markdown.
+    """
+    match = _fts_query(query)
+    if not match:
+        return {'records': [], 'total': 0}
+    conn = get_db_connection()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM incident_records_fts WHERE incident_records_fts MATCH ?', (match,)).fetchone()[0]
+        rows = conn.execute('''
+            SELECT ir.id, ir.date, ir.status, w.name AS warehouse, i.code || ' - ' || i.description AS incident,
+                   -bm25(incident_records_fts, 3.0, 2.0, 1.0) AS rank,
+                   snippet(incident_records_fts, -1, '**', '**', ' … ', 16) AS snippet
+            FROM incident_records_fts
+            JOIN incident_records ir ON ir.id = incident_records_fts.rowid
+            LEFT JOIN warehouses w ON w.id = ir.warehouse_id
+            LEFT JOIN incidents i ON i.id = ir.incident_id
+            WHERE incident_records_fts MATCH ?
+            ORDER BY rank DESC, ir.id DESC
+            LIMIT ? OFFSET ?
+        ''', (match, page_size, (page - 1) * page_size)).fetchall()
+        return {'records': [dict(row) for row in rows], 'total': total}
+    except sqlite3.Error as e:
+        logger.error(f"Error searching incident records: {e}")
+        return {'records': [], 'total': 0}
+    finally:
+        conn.close()
+
 def search_incident_by_code(code):
     """Busca una incidencia por su código único"""
     try:
@@ -539,6 +999,8 @@ def update_coordinator(coordinator_id, name, surnames):
         conn = get_db_connection()
         conn.execute('UPDATE coordinators SET name = ?, surnames = ? WHERE id = ?', (name, surnames, coordinator_id))
         conn.commit()
+        invalidate_incident_snapshot()
+        _reference_cache.invalidate('coordinators')
         logger.info(f"Updated coordinator ID {coordinator_id}: {name} {surnames}")
         return True
     except sqlite3.Error as e:
@@ -554,6 +1016,8 @@ def update_verifier(verifier_id, name, surnames, phone, zone):
         conn.execute('UPDATE verifiers SET name = ?, surnames = ?, phone = ?, zone = ? WHERE id = ?', 
                      (name, surnames, phone, zone, verifier_id))
         conn.commit()
+        invalidate_incident_snapshot()
+        _reference_cache.invalidate('verifiers')
         logger.info(f"Updated verifier ID {verifier_id}: {name} {surnames}")
         return True
     except sqlite3.Error as e:
@@ -569,6 +1033,8 @@ def update_warehouse(warehouse_id, name, codigo_consejo, zone):
         conn.execute('UPDATE warehouses SET name = ?, codigo_consejo = ?, zone = ? WHERE id = ?', 
                      (name, codigo_consejo, zone, warehouse_id))
         conn.commit()
+        invalidate_incident_snapshot()
+        _reference_cache.invalidate('warehouses')
         logger.info(f"Updated warehouse ID {warehouse_id}: {name}")
         return True
     except sqlite3.Error as e:
@@ -584,6 +1050,8 @@ def update_incident(incident_id, code, description):
         conn.execute('UPDATE incidents SET code = ?, description = ? WHERE id = ?', 
                      (code, description, incident_id))
         conn.commit()
+        invalidate_incident_snapshot()
+        _reference_cache.invalidate('incidents')
         logger.info(f"Updated incident ID {incident_id}: {code}")
         return True
     except sqlite3.Error as e:
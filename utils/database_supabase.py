@@ -1,9 +1,18 @@
 import pandas as pd
 import os
+import re
 import logging
 import datetime
-from supabase_config import get_supabase_client, test_connection
+from supabase_config import get_supabase_client, get_supabase_source, test_connection
 from .backup_restore import backup_db
+from .snapshot import SnapshotStore
+from .snapshot_file import SnapshotFile
+from .cache import ReferenceCache
+from .excel_export import write_history_workbook
+from .csv_import import read_upload_csv, new_rows
+from .ndjson_backup import write_backup, archive_backup, open_backup, restore_backups, BACKUP_TABLES
+from .pagination import iter_rows, fetch_all, PAGE_WORKERS
+from .instrumentation import install_http_hooks
 try:
     from config import is_deployed_environment, DB_CONFIG
 except ImportError:
@@ -15,9 +24,18 @@ except ImportError:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Caché de proceso de las tablas de referencia; las escrituras la invalidan
+_reference_cache = ReferenceCache()
+
+# Columnas propias de incident_records; no se usa '*' para no descargar search_vector (índice de búsqueda)
+INCIDENT_RECORD_COLUMNS = ('id, date, registering_coordinator_id, warehouse_id, causing_verifier_id, incident_id, '
+                           'assigned_coordinator_id, explanation, status, responsible, updated_at')
+
 def get_supabase_connection():
     """Obtiene el cliente de Supabase"""
-    return get_supabase_client()
+    client = get_supabase_client()
+    install_http_hooks(client.postgrest.session)
+    return client
 
 def init_db():
     """Inicializa la base de datos Supabase"""
@@ -77,6 +95,7 @@ def insert_coordinator(name, surnames):
             'name': name,
             'surnames': surnames
         }).execute()
+        _reference_cache.invalidate('coordinators')
         logger.info(f"Inserted coordinator: {name} {surnames}")
         return True
     except Exception as e:
@@ -92,6 +111,7 @@ def insert_verifier(name, surnames, phone, zone):
             'phone': phone,
             'zone': zone
         }).execute()
+        _reference_cache.invalidate('verifiers')
         logger.info(f"Inserted verifier: {name} {surnames}")
         return True
     except Exception as e:
@@ -106,120 +126,127 @@ def insert_warehouse(name, codigo_consejo, zone):
             'codigo_consejo': codigo_consejo,
             'zone': zone
         }).execute()
+        _reference_cache.invalidate('warehouses')
         logger.info(f"Inserted warehouse: {name} with Código Consejo {codigo_consejo}")
         return True
     except Exception as e:
         logger.error(f"Error inserting warehouse: {e}")
         return False
 
+# Filas por petición en las inserciones masivas
+BULK_INSERT_CHUNK_SIZE = 500
+
+def _bulk_insert(client, table, rows):
+    """Inserta filas en bloques de varias filas por petición. Devuelve (insertadas, fallidas)"""
+    inserted = failed = 0
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+        try:
+            client.table(table).insert(chunk).execute()
+            inserted += len(chunk)
+        except Exception as e:
+            logger.error(f"Error bulk inserting {len(chunk)} rows into {table}: {e}")
+            failed += len(chunk)
+    return inserted, failed
+
 def load_csv_to_verifiers(csv_file, sep=','):
-    # Resetear el puntero del archivo al inicio
-    csv_file.seek(0)
-    df = pd.read_csv(csv_file, sep=sep, encoding='utf-8-sig')
-    # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('ï»¿', '')
+    """Importa verificadores desde CSV en bloque, omitiendo los que ya existen (nombre y apellidos).
+    
+    Devuelve un informe {'inserted', 'skipped', 'failed'}.
+    """
+    df = read_upload_csv(csv_file, sep)
     client = get_supabase_connection()
     
-    for _, row in df.iterrows():
-        name = row['name']
-        surnames = row['surnames']
-        
-        # Verificar si ya existe
-        existing = client.table('verifiers').select('id').eq('name', name).eq('surnames', surnames).execute()
-        
-        if not existing.data:
-            insert_verifier(name, surnames, row.get('phone', ''), row.get('zone', ''))
-        else:
-            print(f"Verifier {name} {surnames} already exists, skipping.")
+    # Claves existentes (todas las páginas)
+    existing = fetch_all(lambda count: client.table('verifiers').select('id, name, surnames', count=count))
+    rows, skipped, invalid = new_rows(df, ['name', 'surnames'], existing, ['name', 'surnames', 'phone', 'zone'], ['name', 'surnames'])
+    
+    inserted, failed = _bulk_insert(client, 'verifiers', rows)
+    if inserted:
+        _reference_cache.invalidate('verifiers')
+    
+    report = {'inserted': inserted, 'skipped': skipped, 'failed': failed + invalid}
+    logger.info(f"Verifiers CSV import: {report}")
+    return report
 
 def load_csv_to_warehouses(csv_file, sep=','):
-    # Resetear el puntero del archivo al inicio
-    csv_file.seek(0)
-    df = pd.read_csv(csv_file, sep=sep, encoding='utf-8-sig')
-    # Limpiar nombres de columnas (eliminar espacios, BOM y caracteres especiales)
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('ï»¿', '')
+    """Importa bodegas desde CSV en bloque, omitiendo las que ya existen (código consejo).
+    
+    Devuelve un informe {'inserted', 'skipped', 'failed'}.
+    """
+    df = read_upload_csv(csv_file, sep)
     client = get_supabase_connection()
     
-    for _, row in df.iterrows():
-        codigo_consejo = row['codigo_consejo']
-        
-        # Verificar si ya existe
-        existing = client.table('warehouses').select('id').eq('codigo_consejo', codigo_consejo).execute()
-        
-        if not existing.data:
-            insert_warehouse(row['name'], codigo_consejo, row.get('zone', ''))
-        else:
-            print(f"Warehouse with Código Consejo {codigo_consejo} already exists, skipping.")
+    # Claves existentes (todas las páginas)
+    existing = fetch_all(lambda count: client.table('warehouses').select('id, codigo_consejo', count=count))
+    rows, skipped, invalid = new_rows(df, ['codigo_consejo'], existing, ['name', 'codigo_consejo', 'zone'], ['name', 'codigo_consejo'])
+    
+    inserted, failed = _bulk_insert(client, 'warehouses', rows)
+    if inserted:
+        _reference_cache.invalidate('warehouses')
+    
+    report = {'inserted': inserted, 'skipped': skipped, 'failed': failed + invalid}
+    logger.info(f"Warehouses CSV import: {report}")
+    return report
 
 def insert_incident(description, custom_code=None):
-    """Inserta una nueva incidencia con código automático o personalizado"""
+    """Inserta una nueva incidencia con código automático o personalizado.
+    
+    El código se asigna en la base de datos (RPC insert_incident_with_code, respaldada por una
+    secuencia), en una sola llamada y sin duplicados aunque se guarden varias incidencias a la vez.
+    """
     try:
         client = get_supabase_connection()
-        
-        if custom_code:
-            # Verificar si el código personalizado ya existe
-            existing = client.table('incidents').select('id').eq('code', custom_code).execute()
-            if existing.data:
-                return {'success': False, 'error': f'El código "{custom_code}" ya existe. Por favor, use un código diferente.'}
-            code = custom_code
-        else:
-            # Generar código automático
-            count_result = client.table('incidents').select('count', count='exact').execute()
-            count = count_result.count if count_result.count else 0
-            code = f"{count + 1:03d}"
-            
-            # Verificar que el código automático no exista (por seguridad)
-            while True:
-                existing = client.table('incidents').select('id').eq('code', code).execute()
-                if not existing.data:
-                    break
-                count += 1
-                code = f"{count + 1:03d}"
-        
-        result = client.table('incidents').insert({
-            'code': code,
-            'description': description
+        result = client.rpc('insert_incident_with_code', {
+            'p_description': description,
+            'p_code': custom_code
         }).execute()
+        code = result.data
         
+        _reference_cache.invalidate('incidents')
         logger.info(f"Inserted incident with code {code}")
         return {'success': True, 'code': code}
         
     except Exception as e:
+        # 23505 = unique_violation: el código personalizado ya existe
+        if custom_code and getattr(e, 'code', None) == '23505':
+            return {'success': False, 'error': f'El código "{custom_code}" ya existe. Por favor, use un código diferente.'}
         logger.error(f"Error inserting incident: {e}")
         return {'success': False, 'error': f'Error al guardar la incidencia: {str(e)}'}
 
+@_reference_cache.cached('coordinators')
 def get_coordinators():
     try:
         client = get_supabase_connection()
-        result = client.table('coordinators').select('id, name, surnames').execute()
-        return result.data
+        return fetch_all(lambda count: client.table('coordinators').select('id, name, surnames', count=count))
     except Exception as e:
         logger.error(f"Error getting coordinators: {e}")
         return []
 
+@_reference_cache.cached('verifiers')
 def get_verifiers():
     try:
         client = get_supabase_connection()
-        result = client.table('verifiers').select('id, name, surnames, phone, zone').execute()
-        return result.data
+        return fetch_all(lambda count: client.table('verifiers').select('id, name, surnames, phone, zone', count=count))
     except Exception as e:
         logger.error(f"Error getting verifiers: {e}")
         return []
 
+@_reference_cache.cached('warehouses')
 def get_warehouses():
     try:
         client = get_supabase_connection()
-        result = client.table('warehouses').select('id, name, codigo_consejo, zone').execute()
-        return result.data
+        return fetch_all(lambda count: client.table('warehouses').select('id, name, codigo_consejo, zone', count=count))
     except Exception as e:
         logger.error(f"Error getting warehouses: {e}")
         return []
 
+@_reference_cache.cached('incidents')
 def get_incidents():
     try:
         client = get_supabase_connection()
-        result = client.table('incidents').select('id, code, description').execute()
-        return [(row['id'], f"{row['code']} - {row['description']}") for row in result.data]
+        rows = fetch_all(lambda count: client.table('incidents').select('id, code, description', count=count))
+        return [(row['id'], f"{row['code']} - {row['description']}") for row in rows]
     except Exception as e:
         logger.error(f"Error getting incidents: {e}")
         return []
@@ -238,6 +265,7 @@ def insert_incident_record(date, registering_coordinator_id, warehouse_id, causi
             'status': status,
             'responsible': responsible
         }).execute()
+        invalidate_incident_snapshot(rows_only=True)
         logger.info(f"Inserted incident record on date {date}")
         return True
     except Exception as e:
@@ -247,17 +275,18 @@ def insert_incident_record(date, registering_coordinator_id, warehouse_id, causi
 def get_incident_records():
     try:
         client = get_supabase_connection()
-        result = client.table('incident_records').select(
+        rows = fetch_all(lambda count: client.table('incident_records').select(
             'id, date, registering_coordinator_id, warehouse_id, causing_verifier_id, incident_id, assigned_coordinator_id, explanation, status, responsible, '
             'coordinators!registering_coordinator_id(name, surnames), '
             'warehouses(name), '
             'verifiers(name, surnames), '
             'incidents(code, description), '
-            'coordinators!assigned_coordinator_id(name, surnames)'
-        ).order('date', desc=True).execute()
+            'coordinators!assigned_coordinator_id(name, surnames)',
+            count=count
+        ), order=('-date', '-id'), workers=PAGE_WORKERS)
         
         records = []
-        for record in result.data:
+        for record in rows:
             registering_coordinator = f"{record['coordinators']['name']} {record['coordinators']['surnames']}"
             warehouse = record['warehouses']['name']
             causing_verifier = f"{record['verifiers']['name']} {record['verifiers']['surnames']}"
@@ -272,30 +301,108 @@ def get_incident_records():
         logger.error(f"Error getting incident records: {e}")
         return []
 
-def insert_incident_action(incident_record_id, action_date, action_description, new_status, performed_by):
+def _like_contains(text):
+    """Patrón ILIKE que contiene `text` literalmente: % y _ del usuario no son comodines (escape por defecto '\\')"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+
+def get_incident_records_page(cursor=None, page_size=25, record_id=None, warehouse=None, code=None, status=None):
+    """Página de registros para el selector, ordenada por (fecha, id) descendente.
+    
+    `cursor` es el (fecha, id) del último registro de la página anterior; la respuesta
+    incluye `next_cursor` (None si no hay más páginas). Los filtros se aplican en el servidor.
+    """
     try:
         client = get_supabase_connection()
+        # Los embebidos con !inner permiten filtrar por columnas de la tabla relacionada
+        query = client.table('incident_records').select(
+            'id, date, '
+            f"warehouses{'!inner' if warehouse else ''}(name), "
+            'verifiers(name, surnames), '
+            f"incidents{'!inner' if code else ''}(code, description), "
+            'coordinators!assigned_coordinator_id(name, surnames)'
+        )
+        
+        if cursor:
+            cursor_date, cursor_id = cursor
+            query = query.or_(f'date.lt."{cursor_date}",and(date.eq."{cursor_date}",id.lt.{cursor_id})')
+        if record_id:
+            query = query.eq('id', record_id)
+        if warehouse:
+            query = query.ilike('warehouses.name', _like_contains(warehouse))
+        if code:
+            query = query.ilike('incidents.code', _like_contains(code))
+        if status:
+            query = query.eq('status', status)
         
-        # Insertar la acción
-        result = client.table('incident_actions').insert({
-            'incident_record_id': incident_record_id,
-            'action_date': action_date,
-            'action_description': action_description,
-            'new_status': new_status,
-            'performed_by': performed_by
-        }).execute()
+        # Se pide un registro de más para saber si existe una página siguiente
+        result = query.order('date', desc=True).order('id', desc=True).limit(page_size + 1).execute()
         
-        # Actualizar el estado del registro si se proporciona un nuevo estado
-        if new_status:
-            client.table('incident_records').update({
-                'status': new_status
-            }).eq('id', incident_record_id).execute()
+        page = result.data[:page_size]
+        next_cursor = (page[-1]['date'], page[-1]['id']) if len(result.data) > page_size else None
         
-        logger.info(f"Inserted action for incident record {incident_record_id}")
-        return True
+        records = []
+        for record in page:
+            warehouse_row = record['warehouses']
+            verifier = record['verifiers']
+            incident = record['incidents']
+            coordinator = record['coordinators']
+            
+            incident_label = f"{incident['code']} - {incident['description']}" if incident else "N/A"
+            warehouse_name = warehouse_row['name'] if warehouse_row else "N/A"
+            causing_verifier = f"{verifier['name']} {verifier['surnames']}" if verifier else "N/A"
+            assigned_coordinator = f"{coordinator['name']} {coordinator['surnames']}" if coordinator else "N/A"
+            
+            display_text = f"ID: {record['id']} - Fecha: {record['date']} - Incidencia: {incident_label} - Bodega: {warehouse_name} - Verificador: {causing_verifier} - Coordinador: {assigned_coordinator}"
+            records.append((record['id'], display_text))
+        
+        return {'records': records, 'next_cursor': next_cursor}
     except Exception as e:
-        logger.error(f"Error inserting incident action: {e}")
-        return False
+        logger.error(f"Error getting incident records page: {e}")
+        return {'records': [], 'next_cursor': None}
+
+def apply_incident_actions(actions):
+    """Inserta una o varias acciones y aplica sus cambios de estado en una sola llamada (RPC apply_incident_actions).
+    
+    `actions` es una lista de diccionarios con incident_record_id, action_date, action_description,
+    new_status y performed_by. La llamada es una transacción: si falla, no se guarda ninguna acción.
+    Devuelve {'success': True, 'inserted': n, 'updated': m} o {'success': False, 'error': mensaje}.
+    """
+    if not actions:
+        return {'success': True, 'inserted': 0, 'updated': 0}
+    try:
+        client = get_supabase_connection()
+        payload = [{
+            'incident_record_id': action['incident_record_id'],
+            'action_date': str(action['action_date']),
+            'action_description': action['action_description'],
+            'new_status': action.get('new_status'),
+            'performed_by': action['performed_by']
+        } for action in actions]
+        result = client.rpc('apply_incident_actions', {'p_actions': payload}).execute()
+        data = result.data or {}
+        
+        if any(action.get('new_status') for action in actions):
+            invalidate_incident_snapshot(rows_only=True)
+        logger.info(f"Applied {data.get('inserted', 0)} incident actions ({data.get('updated', 0)} status changes)")
+        return {'success': True, 'inserted': int(data.get('inserted') or 0), 'updated': int(data.get('updated') or 0)}
+    except Exception as e:
+        logger.error(f"Error applying incident actions: {e}")
+        return {'success': False, 'error': str(e)}
+
+def insert_incident_action(incident_record_id, action_date, action_description, new_status, performed_by):
+    # La acción y el cambio de estado se guardan juntos en una sola transacción
+    result = apply_incident_actions([{
+        'incident_record_id': incident_record_id,
+        'action_date': action_date,
+        'action_description': action_description,
+        'new_status': new_status,
+        'performed_by': performed_by
+    }])
+    if result['success']:
+        logger.info(f"Inserted action for incident record {incident_record_id}")
+    else:
+        logger.error(f"Error inserting incident action: {result['error']}")
+    return result['success']
 
 def get_incident_actions(incident_record_id):
     try:
@@ -320,20 +427,33 @@ def get_incident_actions(incident_record_id):
         logger.error(f"Error getting incident actions: {e}")
         return []
 
-def get_all_incident_records_df():
+def _fetch_incident_records_df(updated_since=None):
+    """Descarga los registros de incidencias enriquecidos (usar la instantánea compartida).
+    
+    Con `updated_since` solo los modificados desde ese instante; en ese caso un error devuelve
+    None, para que la instantánea recurra a la descarga completa en lugar de quedarse sin cambios.
+    """
     try:
         client = get_supabase_connection()
         
-        # Consulta compleja con joins usando RPC o múltiples consultas
-        result = client.table('incident_records').select(
-            '*, coordinators!registering_coordinator_id(name, surnames), '
-            'warehouses(name, zone), verifiers(name, surnames, zone), '
-            'incidents(description), coordinators!assigned_coordinator_id(name, surnames)'
-        ).execute()
+        def build_query(count):
+            query = client.table('incident_records').select(
+                INCIDENT_RECORD_COLUMNS + ', '
+                'coordinators!registering_coordinator_id(name, surnames), '
+                'warehouses(name, zone), verifiers(name, surnames, zone), '
+                'incidents(description), coordinators!assigned_coordinator_id(name, surnames)',
+                count=count
+            )
+            if updated_since is not None:
+                query = query.gte('updated_at', _watermark_param(updated_since))
+            return query
+        
+        # Consulta con joins, descargada por páginas en paralelo
+        rows = iter_rows(build_query, workers=PAGE_WORKERS)
         
         # Procesar los datos para crear el DataFrame
         processed_data = []
-        for row in result.data:
+        for row in rows:
             reg_coord = row['coordinators']
             warehouse = row['warehouses']
             verifier = row['verifiers']
@@ -352,20 +472,97 @@ def get_all_incident_records_df():
                 'assigned_coordinator': f"{assigned_coord['name']} {assigned_coord['surnames']}" if assigned_coord else "N/A",
                 'explanation': row['explanation'],
                 'status': row['status'],
-                'responsible': row['responsible']
+                'responsible': row['responsible'],
+                'updated_at': row.get('updated_at')
             }
             processed_data.append(processed_row)
         
         return pd.DataFrame(processed_data)
     except Exception as e:
         logger.error(f"Error getting incident records dataframe: {e}")
-        return pd.DataFrame()
+        return None if updated_since is not None else pd.DataFrame()
+
+def _watermark_param(watermark):
+    """Marca de agua (datetime en UTC) como valor de filtro para updated_at"""
+    return watermark.strftime('%Y-%m-%d %H:%M:%S+00:00')
+
+def get_incident_records_since(watermark):
+    """Registros de incidencias enriquecidos modificados desde `watermark` (datetime en UTC).
+    
+    Devuelve None si la lectura falla. Los borrados no se detectan: reset_database invalida la instantánea completa.
+    """
+    return _fetch_incident_records_df(updated_since=watermark)
+
+def get_incident_actions_since(watermark):
+    """Acciones creadas o modificadas desde `watermark` (datetime en UTC), o None si la lectura falla"""
+    try:
+        client = get_supabase_connection()
+        rows = iter_rows(lambda count: client.table('incident_actions').select(
+            'id, incident_record_id, action_date, action_description, new_status, updated_at, '
+            'coordinators!incident_actions_performed_by_fkey(name, surnames)',
+            count=count
+        ).gte('updated_at', _watermark_param(watermark)))
+        
+        actions = []
+        for row in rows:
+            coordinator = row['coordinators']
+            actions.append({
+                'id': row['id'],
+                'incident_record_id': row['incident_record_id'],
+                'action_date': row['action_date'],
+                'action_description': row['action_description'],
+                'new_status': row['new_status'],
+                'performed_by': f"{coordinator['name']} {coordinator['surnames']}" if coordinator else "N/A",
+                'updated_at': row['updated_at']
+            })
+        
+        return pd.DataFrame(actions)
+    except Exception as e:
+        logger.error(f"Error getting incident actions since {watermark}: {e}")
+        return None
+
+def get_incident_snapshot_version():
+    """Versión de los datos de la instantánea (RPC get_incident_snapshot_version): número de registros,
+    último updated_at y versión de las tablas de referencia. None si la consulta falla"""
+    try:
+        client = get_supabase_connection()
+        return client.rpc('get_incident_snapshot_version').execute().data
+    except Exception as e:
+        logger.error(f"Error getting incident snapshot version: {e}")
+        return None
+
+# Instantánea de los registros enriquecidos: se descarga completa una vez (o se lee del disco al
+# arrancar) y después se renueva como máximo una vez por rerun con los registros modificados
+_incident_snapshots = SnapshotStore(
+    _fetch_incident_records_df,
+    delta_loader=get_incident_records_since,
+    version_loader=get_incident_snapshot_version,
+    snapshot_file=SnapshotFile('incident_records_supabase', get_supabase_source)
+)
+
+def get_incident_snapshot():
+    """Obtiene la instantánea compartida de los registros de incidencias enriquecidos"""
+    return _incident_snapshots.get()
+
+def invalidate_incident_snapshot(rows_only=False):
+    """Descarta la instantánea tras una escritura. Con `rows_only` (la escritura solo cambia filas de
+    incident_records) la próxima lectura descarga únicamente los registros modificados"""
+    if rows_only:
+        _incident_snapshots.expire()
+    else:
+        _incident_snapshots.invalidate()
+
+def get_all_incident_records_df():
+    return get_incident_snapshot().df.copy(deep=False)
+
+def search_incident_records_df(term):
+    """Registros enriquecidos que contienen `term` en alguna columna visible, sin distinguir mayúsculas ni acentos"""
+    return get_incident_snapshot().search(term).copy(deep=False)
 
 def get_all_verifiers_df():
     try:
         client = get_supabase_connection()
-        result = client.table('verifiers').select('*').execute()
-        return pd.DataFrame(result.data)
+        return pd.DataFrame(fetch_all(lambda count: client.table('verifiers').select('*', count=count)))
     except Exception as e:
         logger.error(f"Error getting verifiers dataframe: {e}")
         return pd.DataFrame()
@@ -373,47 +570,62 @@ def get_all_verifiers_df():
 def get_all_warehouses_df():
     try:
         client = get_supabase_connection()
-        result = client.table('warehouses').select('*').execute()
-        return pd.DataFrame(result.data)
+        return pd.DataFrame(fetch_all(lambda count: client.table('warehouses').select('*', count=count)))
     except Exception as e:
         logger.error(f"Error getting warehouses dataframe: {e}")
         return pd.DataFrame()
 
 def get_incidents_by_zone():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df.groupby('warehouse_zone').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['by_zone']
 
 def get_incidents_by_verifier():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df.groupby('causing_verifier').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['by_verifier']
 
 def get_incidents_by_warehouse():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df.groupby('warehouse').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['by_warehouse']
 
 def get_incidents_by_type():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df.groupby('incident_type').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['by_type']
 
 def get_incidents_by_status():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df.groupby('status').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['by_status']
 
 def get_assignments_by_verifier():
-    df = get_all_incident_records_df()
-    if not df.empty:
-        return df[df['responsible'] == 'Verificador'].groupby('causing_verifier').size().reset_index(name='count')
-    return pd.DataFrame()
+    return get_incident_breakdowns()['assignments_by_verifier']
+
+# Columna agrupada por cada desglose de la analítica de incidencias
+INCIDENT_BREAKDOWNS = {
+    'by_zone': 'warehouse_zone',
+    'by_verifier': 'causing_verifier',
+    'by_warehouse': 'warehouse',
+    'by_type': 'incident_type',
+    'by_status': 'status',
+    'assignments_by_verifier': 'causing_verifier'
+}
+
+def _breakdowns_to_dataframes(payload):
+    """Convierte la respuesta agregada en un DataFrame por desglose"""
+    breakdowns = {}
+    for key, column in INCIDENT_BREAKDOWNS.items():
+        breakdowns[key] = pd.DataFrame(payload.get(key) or [], columns=[column, 'count'])
+    return breakdowns
+
+def get_incident_breakdowns():
+    """Obtiene todos los desgloses de la analítica de incidencias en una sola llamada (RPC get_incident_breakdowns)"""
+    try:
+        client = get_supabase_connection()
+        result = client.rpc('get_incident_breakdowns').execute()
+        return _breakdowns_to_dataframes(result.data or {})
+    except Exception as e:
+        logger.error(f"Error getting incident breakdowns: {e}")
+        return _breakdowns_to_dataframes({})
+
+def rebuild_incident_rollup():
+    """Reconstruye el resumen diario desde incident_records (RPC rebuild_incident_daily_rollup). Devuelve el número de filas del resumen"""
+    client = get_supabase_connection()
+    result = client.rpc('rebuild_incident_daily_rollup').execute()
+    logger.info(f"Incident rollup rebuilt: {result.data} rows")
+    return result.data
 
 def reset_database():
     try:
@@ -428,6 +640,8 @@ def reset_database():
             except Exception as e:
                 logger.warning(f"Could not clear table {table}: {e}")
         
+        _reference_cache.invalidate()
+        invalidate_incident_snapshot()
         logger.info("Database reset completed")
         return True
     except Exception as e:
@@ -438,7 +652,8 @@ def get_incident_record_details(incident_record_id):
     try:
         client = get_supabase_connection()
         result = client.table('incident_records').select(
-            '*, coordinators!registering_coordinator_id(name, surnames), '
+            INCIDENT_RECORD_COLUMNS + ', '
+            'coordinators!registering_coordinator_id(name, surnames), '
             'warehouses(name, zone), verifiers(name, surnames, zone), '
             'incidents(description), coordinators!assigned_coordinator_id(name, surnames)'
         ).eq('id', incident_record_id).execute()
@@ -470,111 +685,156 @@ def get_incident_record_details(incident_record_id):
         logger.error(f"Error getting incident record details: {e}")
         return {}
 
-def export_incidents_to_excel():
-    """Exporta historial completo de incidencias con acciones a Excel"""
+def _person_name(person):
+    return f"{person['name']} {person['surnames']}" if person else "N/A"
+
+def export_incidents_to_excel(date_from=None, date_to=None, status=None, page_size=None):
+    """Exporta el historial de incidencias con sus acciones a un Excel en memoria.
+    
+    Las filas se descargan por páginas y se escriben en streaming; devuelve un BytesIO.
+    Filtros opcionales: rango de fechas del registro (inclusive) y estado.
+    """
     try:
-        # Obtener datos usando las funciones existentes
-        df_incidents = get_all_incident_records_df()
-        
-        # Para las acciones, necesitamos una consulta separada
         client = get_supabase_connection()
-        actions_result = client.table('incident_actions').select(
-            'incident_record_id, action_date, action_description, new_status, '
-            'coordinators!incident_actions_performed_by_fkey(name, surnames)'
-        ).execute()
-        
-        actions_data = []
-        for row in actions_result.data:
-            coordinator = row['coordinators']
-            actions_data.append({
-                'ID Registro': row['incident_record_id'],
-                'Fecha Acción': row['action_date'],
-                'Descripción Acción': row['action_description'],
-                'Nuevo Estado': row['new_status'],
-                'Realizado Por': f"{coordinator['name']} {coordinator['surnames']}" if coordinator else "N/A"
-            })
-        
-        df_actions = pd.DataFrame(actions_data)
         
-        # Crear archivo Excel
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'historial_incidencias_{timestamp}.xlsx'
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            df_incidents.to_excel(writer, sheet_name='Incidencias', index=False)
-            df_actions.to_excel(writer, sheet_name='Acciones', index=False)
-        
-        return filename
+        def apply_filters(query, prefix=''):
+            if date_from:
+                query = query.gte(f'{prefix}date', date_from.isoformat())
+            if date_to:
+                query = query.lt(f'{prefix}date', (date_to + datetime.timedelta(days=1)).isoformat())
+            if status:
+                query = query.eq(f'{prefix}status', status)
+            return query
+        
+        def incidents_query(count):
+            return apply_filters(client.table('incident_records').select(
+                'id, date, explanation, status, responsible, '
+                'registering:coordinators!registering_coordinator_id(name, surnames), '
+                'warehouses(name, zone), verifiers(name, surnames, zone), incidents(code, description), '
+                'assigned:coordinators!assigned_coordinator_id(name, surnames)',
+                count=count
+            ))
+        
+        def actions_query(count):
+            # Solo las acciones de los registros que cumplen los filtros
+            records_embed = 'incident_records!inner(date, status)' if (date_from or date_to or status) else 'incident_records(id)'
+            return apply_filters(client.table('incident_actions').select(
+                'id, incident_record_id, action_date, action_description, new_status, '
+                f'coordinators!incident_actions_performed_by_fkey(name, surnames), {records_embed}',
+                count=count
+            ), prefix='incident_records.')
+        
+        def incident_rows():
+            for row in iter_rows(incidents_query, ('-date', '-id'), page_size, PAGE_WORKERS):
+                warehouse = row['warehouses']
+                verifier = row['verifiers']
+                incident = row['incidents']
+                yield [
+                    row['id'],
+                    row['date'],
+                    _person_name(row['registering']),
+                    warehouse['name'] if warehouse else "N/A",
+                    warehouse['zone'] if warehouse else "N/A",
+                    _person_name(verifier),
+                    verifier['zone'] if verifier else "N/A",
+                    f"{incident['code']} - {incident['description']}" if incident else "N/A",
+                    _person_name(row['assigned']),
+                    row['explanation'],
+                    row['status'],
+                    row['responsible']
+                ]
+        
+        def action_rows():
+            for row in iter_rows(actions_query, ('incident_record_id', 'action_date', 'id'), page_size, PAGE_WORKERS):
+                yield [
+                    row['incident_record_id'],
+                    row['action_date'],
+                    row['action_description'],
+                    row['new_status'],
+                    _person_name(row['coordinators'])
+                ]
+        
+        return write_history_workbook(incident_rows(), action_rows())
     except Exception as e:
         logger.error(f"Error exporting to Excel: {e}")
         raise e
 
-def create_backup():
-    """Crea una copia de seguridad de la base de datos"""
+def _read_backup_table(client, table, since=None):
+    """Filas de `table` para la copia de seguridad, página a página (las de updated_at >= `since` si se indica)"""
+    columns = INCIDENT_RECORD_COLUMNS if table == 'incident_records' else '*'
+    def build_query(count):
+        query = client.table(table).select(columns, count=count)
+        if since is not None:
+            query = query.gte('updated_at', _watermark_param(since))
+        return query
+    return iter_rows(build_query, workers=PAGE_WORKERS)
+
+def _describe_backup_table(client, table):
+    """Número de filas y mayor updated_at de `table` (None si no tiene esa columna)"""
+    result = client.table(table).select('id', count='exact').limit(1).execute()
+    if not dict(BACKUP_TABLES)[table]:
+        return result.count, None
+    latest = client.table(table).select('updated_at').order('updated_at', desc=True).limit(1).execute()
+    return result.count, latest.data[0]['updated_at'] if latest.data else None
+
+def create_backup(full=False):
+    """Crea una copia de seguridad en NDJSON comprimido, por tablas y página a página.
+    
+    Es incremental respecto a la copia anterior salvo que se pida `full` (o toque una completa).
+    Devuelve la ruta del .tar con la copia.
+    """
     try:
-        # Para Supabase, podríamos exportar los datos a JSON o CSV
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'supabase_backup_{timestamp}.json'
-        
-        # Exportar todas las tablas
         client = get_supabase_connection()
-        backup_data = {}
-        
-        tables = ['coordinators', 'verifiers', 'warehouses', 'incidents', 'incident_records', 'incident_actions']
-        
-        for table in tables:
-            try:
-                result = client.table(table).select('*').execute()
-                backup_data[table] = result.data
-            except Exception as e:
-                logger.warning(f"Could not backup table {table}: {e}")
-                backup_data[table] = []
-        
-        # Guardar en archivo JSON
-        import json
-        with open(backup_filename, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, ensure_ascii=False, default=str)
-        
-        logger.info(f"Backup created: {backup_filename}")
-        return backup_filename
+        path = write_backup(
+            'supabase',
+            get_supabase_source(),
+            lambda table, since: _read_backup_table(client, table, since),
+            lambda table: _describe_backup_table(client, table),
+            full=full
+        )
+        return archive_backup(path)
     except Exception as e:
         logger.error(f"Error creating backup: {e}")
         raise e
 
+def restore_backup(files):
+    """Restaura en Supabase copias de seguridad: [(fichero o ruta, nombre)] en .tar, directorio o .json antiguo.
+    
+    Con copias incrementales hay que pasar toda su cadena desde la completa. Las filas se
+    escriben por lotes con upsert por id, así que restaurar dos veces no duplica datos; tras
+    una interrupción, repetir la llamada continúa desde el último lote confirmado.
+    Devuelve las filas restauradas por tabla.
+    """
+    client = get_supabase_connection()
+    
+    def upsert(table, rows):
+        client.table(table).upsert(rows, on_conflict='id').execute()
+    
+    try:
+        restored = restore_backups(
+            [open_backup(fileobj, name) for fileobj, name in files],
+            upsert,
+            lambda: client.rpc('reset_table_sequences').execute()
+        )
+    finally:
+        _reference_cache.invalidate()
+        invalidate_incident_snapshot()
+    return restored
+
 def get_dashboard_stats():
-    """Obtiene estadísticas para el dashboard"""
+    """Obtiene estadísticas para el dashboard en una sola llamada (RPC get_dashboard_stats)"""
     try:
         client = get_supabase_connection()
+        result = client.rpc('get_dashboard_stats').execute()
+        data = result.data or {}
         
-        # Estadísticas generales
-        stats = {}
-        
-        # Total de incidencias
-        total_result = client.table('incident_records').select('count', count='exact').execute()
-        stats['total_incidents'] = total_result.count if total_result.count else 0
-        
-        # Incidencias no resueltas (pendientes)
-        pending_result = client.table('incident_records').select('count', count='exact').neq('status', 'Solucionado').execute()
-        stats['pending_incidents'] = pending_result.count if pending_result.count else 0
-        
-        # Incidencias resueltas
-        resolved_result = client.table('incident_records').select('count', count='exact').eq('status', 'Solucionado').execute()
-        stats['resolved_incidents'] = resolved_result.count if resolved_result.count else 0
-        
-        # Incidencias por estado
-        df = get_all_incident_records_df()
-        if not df.empty:
-            stats['by_status'] = df.groupby('status').size().reset_index(name='count')
-        else:
-            stats['by_status'] = pd.DataFrame()
-        
-        # Incidencias recientes (últimos 7 días)
-        from datetime import datetime, timedelta
-        seven_days_ago = (datetime.now() - timedelta(days=7)).isoformat()
-        recent_result = client.table('incident_records').select('count', count='exact').gte('date', seven_days_ago).execute()
-        stats['recent_incidents'] = recent_result.count if recent_result.count else 0
-        
-        return stats
+        return {
+            'total_incidents': int(data.get('total_incidents') or 0),
+            'pending_incidents': int(data.get('pending_incidents') or 0),
+            'resolved_incidents': int(data.get('resolved_incidents') or 0),
+            'by_status': pd.DataFrame(data.get('by_status') or [], columns=['status', 'count']),
+            'recent_incidents': int(data.get('recent_incidents') or 0)
+        }
     except Exception as e:
         logger.error(f"Error getting dashboard stats: {e}")
         return {
@@ -648,6 +908,29 @@ def get_recent_actions():
         logger.error(f"Error getting recent actions: {e}")
         return pd.DataFrame()
 
+def search_incident_records(query, page=1, page_size=20):
+    """Búsqueda de texto completo en explicaciones, tipos de incidencia y acciones, ordenada por relevancia
+    (RPC search_incident_records, índice GIN con la configuración 'es_unaccent', 'spanish' sin acentos).
+    
+    Devuelve {'records': [...], 'total': n} con la página pedida; cada registro incluye un
+    fragmento (`snippet`) con los términos resaltados en Markdown.
+    """
+    if not query.strip():
+        return {'records': [], 'total': 0}
+    try:
+        client = get_supabase_connection()
+        result = client.rpc('search_incident_records', {
+            'p_query': query,
+            'p_limit': page_size,
+            'p_offset': (page - 1) * page_size
+        }).execute()
+        rows = result.data or []
+        records = [{key: row[key] for key in ('id', 'date', 'status', 'warehouse', 'incident', 'rank', 'snippet')} for row in rows]
+        return {'records': records, 'total': rows[0]['total'] if rows else 0}
+    except Exception as e:
+        logger.error(f"Error searching incident records: {e}")
+        return {'records': [], 'total': 0}
+
 def search_incident_by_code(code):
     """Busca una incidencia por su código único"""
     try:
@@ -666,16 +949,18 @@ def get_incident_records_by_incident_code(code):
     """Obtiene todos los registros de incidencia asociados a un código de incidencia"""
     try:
         client = get_supabase_connection()
-        result = client.table('incident_records').select(
-            '*, incidents!inner(code, description), '
+        rows = fetch_all(lambda count: client.table('incident_records').select(
+            INCIDENT_RECORD_COLUMNS + ', '
+            'incidents!inner(code, description), '
             'coordinators!registering_coordinator_id(name, surnames), '
             'warehouses(name, zone), verifiers(name, surnames), '
-            'coordinators!assigned_coordinator_id(name, surnames)'
-        ).eq('incidents.code', code).order('date', desc=True).execute()
+            'coordinators!assigned_coordinator_id(name, surnames)',
+            count=count
+        ).eq('incidents.code', code), order=('-date', '-id'))
         
-        if result.data:
+        if rows:
             processed_records = []
-            for row in result.data:
+            for row in rows:
                 incident = row['incidents']
                 reg_coord = row['coordinators']
                 warehouse = row['warehouses']
@@ -715,6 +1000,8 @@ def update_coordinator(coordinator_id, name, surnames):
         }).eq('id', coordinator_id).execute()
         
         if result.data:
+            invalidate_incident_snapshot()
+            _reference_cache.invalidate('coordinators')
             logger.info(f"Updated coordinator ID {coordinator_id}: {name} {surnames}")
             return True
         return False
@@ -734,6 +1021,8 @@ def update_verifier(verifier_id, name, surnames, phone, zone):
         }).eq('id', verifier_id).execute()
         
         if result.data:
+            invalidate_incident_snapshot()
+            _reference_cache.invalidate('verifiers')
             logger.info(f"Updated verifier ID {verifier_id}: {name} {surnames}")
             return True
         return False
@@ -752,6 +1041,8 @@ def update_warehouse(warehouse_id, name, codigo_consejo, zone):
         }).eq('id', warehouse_id).execute()
         
         if result.data:
+            invalidate_incident_snapshot()
+            _reference_cache.invalidate('warehouses')
             logger.info(f"Updated warehouse ID {warehouse_id}: {name}")
             return True
         return False
@@ -769,6 +1060,8 @@ def update_incident(incident_id, code, description):
         }).eq('id', incident_id).execute()
         
         if result.data:
+            invalidate_incident_snapshot()
+            _reference_cache.invalidate('incidents')
             logger.info(f"Updated incident ID {incident_id}: {code}")
             return True
         return False
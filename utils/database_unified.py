@@ -1,7 +1,9 @@
 """Módulo unificado de base de datos que usa SQLite o Supabase según la configuración"""
 
+import sys
 import logging
 from config import DB_CONFIG
+from .instrumentation import instrument_namespace, capture_errors
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -44,4 +46,9 @@ def get_pending_incidents_by_coordinator(coordinator_id=None):
 def get_filtered_pending_incidents(coordinator_id=None, status=None, days=None):
     """Obtiene incidencias pendientes con filtros múltiples"""
     from .database_supabase import get_filtered_pending_incidents as get_filtered_supabase
-    return get_filtered_supabase(coordinator_id, status, days)
\ No newline at end of file
+    return get_filtered_supabase(coordinator_id, status, days)
+
+# Instrumentar todas las funciones públicas de datos para el panel de diagnóstico
+from . import database_supabase as _backend
+instrument_namespace(globals(), _backend, sys.modules[__name__])
+capture_errors(_backend.__name__)
@@ -0,0 +1,37 @@
+"""Escritura en streaming del historial de incidencias a un Excel en memoria"""
+
+import io
+
+INCIDENT_COLUMNS = [
+    'ID Registro', 'Fecha', 'Coordinador Registrador', 'Bodega', 'Zona Bodega',
+    'Verificador Causante', 'Zona Verificador', 'Incidencia', 'Coordinador Asignado',
+    'Explicación', 'Estado', 'Responsable'
+]
+
+ACTION_COLUMNS = ['ID Registro', 'Fecha Acción', 'Descripción Acción', 'Nuevo Estado', 'Realizado Por']
+
+def write_history_workbook(incident_rows, action_rows):
+    """Escribe las hojas 'Incidencias' y 'Acciones' a partir de iteradores de filas.
+
+    Usa el modo write_only de openpyxl, que vuelca cada fila según llega, de modo que la memoria
+    depende del tamaño de página de los iteradores y no del tamaño del historial.
+    Devuelve un BytesIO posicionado al inicio.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+
+    incidents_sheet = workbook.create_sheet('Incidencias')
+    incidents_sheet.append(INCIDENT_COLUMNS)
+    for row in incident_rows:
+        incidents_sheet.append(row)
+
+    actions_sheet = workbook.create_sheet('Acciones')
+    actions_sheet.append(ACTION_COLUMNS)
+    for row in action_rows:
+        actions_sheet.append(row)
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,661 @@
+"""Cliente de Supabase simulado sobre SQLite, para pruebas y mediciones sin red
+
+Se activa con la variable de entorno SUPABASE_FAKE_DB (ruta de un archivo SQLite o ':memory:').
+SUPABASE_FAKE_LATENCY_MS añade una latencia fija a cada petición, de modo que las optimizaciones
+que reducen viajes de ida y vuelta se pueden medir de forma determinista.
+
+Implementa el subconjunto de postgrest-py que usa utils/database_supabase.py: select con
+recursos embebidos por clave ajena, filtros, orden, límites, count='exact', escrituras y las
+funciones RPC definidas en supabase_schema.sql.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from postgrest import APIResponse
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db', 'schema.sql')
+
+# Máximo de parámetros por consulta IN al cargar recursos embebidos
+IN_CHUNK_SIZE = 500
+
+_COMPARISONS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+# Funciones RPC disponibles: nombre -> función(conn, **params)
+RPC_FUNCTIONS = {}
+
+def _rpc(name):
+    def decorator(func):
+        RPC_FUNCTIONS[name] = func
+        return func
+    return decorator
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _split_top_level(text):
+    """Separa por comas que no estén dentro de paréntesis ni de comillas"""
+    parts, current, depth, quoted = [], '', 0, False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+def _parse_select(text):
+    """Convierte la lista de columnas de un select en columnas y recursos embebidos"""
+    items = []
+    for part in _split_top_level(text):
+        embed = re.match(r'^(?:(\w+):)?(\w+)((?:!\w+)*)\((.*)\)$', part, re.S)
+        if embed:
+            alias, target, modifiers, inner = embed.groups()
+            modifiers = [m for m in modifiers.split('!') if m]
+            hint = next((m for m in modifiers if m not in ('inner', 'left')), None)
+            items.append(('embed', alias or target, target, hint, 'inner' in modifiers, _parse_select(inner)))
+            continue
+        column = re.match(r'^(?:(\w+):)?([\w*]+)(?:::\w+)?$', part)
+        if not column:
+            raise APIError({'code': 'PGRST100', 'message': f'Unsupported select item: {part}'})
+        alias, name = column.groups()
+        items.append(('column', alias or name, name))
+    return items
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
+    return value
+
+def _parse_logic(operator, text):
+    """Árbol de condiciones de un filtro or=(...) / and(...) de PostgREST"""
+    children = []
+    for part in _split_top_level(text):
+        group = re.match(r'^(not\.)?(and|or)\((.*)\)$', part, re.S)
+        if group:
+            node = _parse_logic(group.group(2), group.group(3))
+            children.append(('not', node) if group.group(1) else node)
+            continue
+        column, rest = part.split('.', 1)
+        negate = rest.startswith('not.')
+        if negate:
+            rest = rest[4:]
+        op, value = rest.split('.', 1)
+        if op == 'in':
+            value = [_unquote(v) for v in _split_top_level(value.strip('()'))]
+        else:
+            value = _unquote(value)
+        children.append(('filter', column, op, value, negate))
+    return (operator, children)
+
+def _condition(column, op, value, negate=False):
+    """SQL y parámetros de un filtro simple sobre una columna"""
+    column = _quote(column)
+    if op in _COMPARISONS:
+        sql, params = f'{column} {_COMPARISONS[op]} ?', [value]
+    elif op == 'like':
+        # ESCAPE '\': el carácter de escape por defecto de PostgreSQL
+        sql, params = f"{column} LIKE ? ESCAPE '\\'", [str(value).replace('*', '%')]
+    elif op == 'ilike':
+        sql, params = f"lower({column}) LIKE lower(?) ESCAPE '\\'", [str(value).replace('*', '%')]
+    elif op == 'in':
+        values = list(value)
+        if not values:
+            sql, params = '0', []
+        else:
+            sql, params = f'{column} IN ({", ".join("?" * len(values))})', values
+    elif op == 'is':
+        literal = {None: 'NULL', 'null': 'NULL', True: 'TRUE', 'true': 'TRUE', False: 'FALSE', 'false': 'FALSE'}[value]
+        sql, params = f'{column} IS {literal}', []
+    else:
+        raise APIError({'code': 'PGRST100', 'message': f'Unsupported operator: {op}'})
+    if negate:
+        sql = f'NOT ({sql})'
+    return sql, params
+
+def _logic_sql(node):
+    kind = node[0]
+    if kind == 'filter':
+        _, column, op, value, negate = node
+        return _condition(column, op, value, negate)
+    if kind == 'not':
+        sql, params = _logic_sql(node[1])
+        return f'NOT ({sql})', params
+    parts, params = [], []
+    for child in node[1]:
+        sql, child_params = _logic_sql(child)
+        parts.append(f'({sql})')
+        params.extend(child_params)
+    return f' {kind.upper()} '.join(parts) or '1', params
+
+def _where(conditions):
+    if not conditions:
+        return '', []
+    sql = ' AND '.join(f'({condition})' for condition, _ in conditions)
+    params = [param for _, condition_params in conditions for param in condition_params]
+    return f' WHERE {sql}', params
+
+def _api_error(error):
+    """Traduce un error de SQLite al código de error de PostgreSQL equivalente"""
+    message = str(error)
+    if isinstance(error, sqlite3.IntegrityError):
+        if 'UNIQUE' in message:
+            code = '23505'
+        elif 'NOT NULL' in message:
+            code = '23502'
+        elif 'FOREIGN KEY' in message:
+            code = '23503'
+        else:
+            code = '23000'
+    else:
+        code = 'PGRST100'
+    return APIError({'code': code, 'message': message, 'hint': None, 'details': None})
+
+class _FakeResponse:
+    """Respuesta mínima para los hooks de respuesta de httpx (instrumentación)"""
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def read(self):
+        return self.content
+
+class _FakeSession:
+    def __init__(self):
+        self.event_hooks = {'request': [], 'response': []}
+
+class _FakePostgrest:
+    def __init__(self):
+        self.session = _FakeSession()
+
+class _FakeQuery:
+    """Constructor de consultas con la misma interfaz encadenable que postgrest-py"""
+
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._method = 'select'
+        self._columns = '*'
+        self._count = None
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._filters = []
+        self._logic = []
+        self._orders = []
+        self._limit = None
+        self._offset = None
+
+    # Métodos
+
+    def select(self, *columns, count=None, head=None):
+        self._method = 'select'
+        self._columns = ','.join(columns) or '*'
+        self._count = count
+        return self
+
+    def insert(self, json, count=None, returning=None, upsert=False, default_to_null=True):
+        self._method = 'insert'
+        self._payload = json
+        return self
+
+    def upsert(self, json, count=None, returning=None, ignore_duplicates=False, on_conflict='', default_to_null=True):
+        self._method = 'upsert'
+        self._payload = json
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json, count=None, returning=None):
+        self._method = 'update'
+        self._payload = json
+        return self
+
+    def delete(self, count=None, returning=None):
+        self._method = 'delete'
+        return self
+
+    # Filtros
+
+    def _filter(self, column, op, value):
+        self._filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def like(self, column, pattern):
+        return self._filter(column, 'like', pattern)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, 'ilike', pattern)
+
+    def in_(self, column, values):
+        return self._filter(column, 'in', list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, 'is', value)
+
+    def or_(self, filters, reference_table=None):
+        if reference_table:
+            raise APIError({'code': 'PGRST100', 'message': 'or_ on embedded resources is not supported'})
+        self._logic.append(_parse_logic('or', filters))
+        return self
+
+    # Orden y paginación
+
+    def order(self, column, *, desc=False, nullsfirst=None, foreign_table=None):
+        self._orders.append((column, desc, nullsfirst))
+        return self
+
+    def limit(self, size, *, foreign_table=None):
+        self._limit = size
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def execute(self):
+        return self._client._request(self._run)
+
+    # Ejecución
+
+    def _run(self, conn):
+        if self._method == 'select':
+            return self._run_select(conn)
+        return self._run_write(conn)
+
+    def _split_filters(self, items):
+        """Separa los filtros de la tabla base de los de cada recurso embebido"""
+        embeds = {item[1]: item for item in items if item[0] == 'embed'}
+        base, by_embed = [], {}
+        for column, op, value in self._filters:
+            if '.' in column:
+                name, embedded_column = column.split('.', 1)
+                if name not in embeds:
+                    raise APIError({'code': 'PGRST108', 'message': f"'{name}' is not an embedded resource in this request"})
+                by_embed.setdefault(name, []).append(_condition(embedded_column, op, value))
+            else:
+                base.append(_condition(column, op, value))
+        return base, by_embed, embeds
+
+    def _run_select(self, conn):
+        items = _parse_select(self._columns)
+        base, by_embed, embeds = self._split_filters(items)
+
+        # select('count') se responde como el agregado de PostgREST
+        if items == [('column', 'count', 'count')]:
+            where, params = _where(base)
+            total = conn.execute(f'SELECT COUNT(*) FROM {_quote(self._table)}{where}', params).fetchone()[0]
+            return [{'count': total}], total if self._count else None
+
+        conditions = list(base)
+        conditions.extend(_logic_sql(node) for node in self._logic)
+
+        # Los recursos !inner filtran las filas de la tabla base
+        for name, item in embeds.items():
+            _, _, target, hint, inner, _ = item
+            if not inner:
+                continue
+            base_column, target_column, _ = self._client._relationship(self._table, target, hint)
+            where, params = _where(by_embed.get(name, []))
+            conditions.append((f'{_quote(base_column)} IN (SELECT {_quote(target_column)} FROM {_quote(target)}{where})', params))
+
+        where, params = _where(conditions)
+        table = _quote(self._table)
+
+        count = None
+        if self._count:
+            count = conn.execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+
+        sql = f'SELECT * FROM {table}{where}'
+        if self._orders:
+            sql += ' ORDER BY ' + ', '.join(
+                f'{_quote(column)} {"DESC" if desc else "ASC"}'
+                + ('' if nullsfirst is None else (' NULLS FIRST' if nullsfirst else ' NULLS LAST'))
+                for column, desc, nullsfirst in self._orders)
+        if self._limit is not None or self._offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params = params + [self._limit if self._limit is not None else -1, self._offset or 0]
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+        return self._client._project(conn, self._table, items, rows, by_embed), count
+
+    def _rows_payload(self):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        columns = []
+        for row in rows:
+            columns.extend(column for column in row if column not in columns)
+        return rows, columns
+
+    def _run_write(self, conn):
+        table = _quote(self._table)
+        with conn:
+            if self._method in ('insert', 'upsert'):
+                rows, columns = self._rows_payload()
+                if not rows:
+                    return [], None
+                sql = f'INSERT INTO {table} ({", ".join(map(_quote, columns))}) VALUES ({", ".join("?" * len(columns))})'
+                if self._method == 'upsert':
+                    conflict = [c.strip() for c in (self._on_conflict or 'id').split(',')]
+                    sql += f' ON CONFLICT ({", ".join(map(_quote, conflict))}) DO '
+                    updates = [c for c in columns if c not in conflict]
+                    if self._ignore_duplicates or not updates:
+                        sql += 'NOTHING'
+                    else:
+                        sql += 'UPDATE SET ' + ', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in updates)
+                result = []
+                for row in rows:
+                    result.extend(dict(r) for r in conn.execute(sql + ' RETURNING *', [row.get(c) for c in columns]).fetchall())
+                return result, None
+
+            base, by_embed, _ = self._split_filters([])
+            conditions = base + [_logic_sql(node) for node in self._logic]
+            where, params = _where(conditions)
+            if self._method == 'update':
+                assignments = ', '.join(f'{_quote(column)} = ?' for column in self._payload)
+                sql = f'UPDATE {table} SET {assignments}{where} RETURNING *'
+                params = list(self._payload.values()) + params
+            else:
+                sql = f'DELETE FROM {table}{where} RETURNING *'
+            return [dict(row) for row in conn.execute(sql, params).fetchall()], None
+
+class _FakeRpc:
+    def __init__(self, client, name, params):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self):
+        function = RPC_FUNCTIONS.get(self._name)
+        if function is None:
+            raise APIError({'code': 'PGRST202', 'message': f'Could not find the function public.{self._name}'})
+        return self._client._request(lambda conn: (function(conn, **self._params), None))
+
+class FakeSupabaseClient:
+    """Sustituto en proceso del cliente de Supabase, respaldado por una base de datos SQLite"""
+
+    def __init__(self, database=':memory:', latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.request_count = 0
+        self.postgrest = _FakePostgrest()
+        self._lock = threading.RLock()
+        self._foreign_keys = {}
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'incident_records'").fetchone()
+        if not exists:
+            with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                self._conn.executescript(f.read())
+            logger.info("Fake Supabase database created from db/schema.sql")
+
+    def table(self, table_name):
+        return _FakeQuery(self, table_name)
+
+    from_ = table
+
+    def rpc(self, fn, params=None):
+        return _FakeRpc(self, fn, params or {})
+
+    def _request(self, run):
+        """Ejecuta una petición simulada: latencia, ejecución serializada y hooks de respuesta"""
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with self._lock:
+                self.request_count += 1
+                data, count = run(self._conn)
+        except sqlite3.Error as e:
+            self._notify(json.dumps({'message': str(e)}).encode(), 400)
+            raise _api_error(e)
+        except APIError as e:
+            self._notify(json.dumps({'message': e.message}).encode(), 400)
+            raise
+        self._notify(json.dumps(data, default=str).encode(), 200)
+        return APIResponse.model_construct(data=data, count=count)
+
+    def _notify(self, content, status_code):
+        response = _FakeResponse(content, status_code)
+        for hook in list(self.postgrest.session.event_hooks.get('response', [])):
+            hook(response)
+
+    def _foreign_key_list(self, table):
+        if table not in self._foreign_keys:
+            rows = self._conn.execute(f'PRAGMA foreign_key_list({_quote(table)})').fetchall()
+            self._foreign_keys[table] = [(row['table'], row['from'], row['to'] or 'id') for row in rows]
+        return self._foreign_keys[table]
+
+    def _relationship(self, base, target, hint):
+        """Columnas que relacionan `base` con `target`: (columna_base, columna_destino, es_lista)"""
+        candidates = [(column, target_column, False)
+                      for referenced, column, target_column in self._foreign_key_list(base) if referenced == target]
+        candidates += [(referenced_column, column, True)
+                       for referenced, column, referenced_column in self._foreign_key_list(target) if referenced == base]
+        if hint:
+            candidates = [c for c in candidates
+                          if hint in (c[0], c[1], f'{base}_{c[0]}_fkey', f'{target}_{c[1]}_fkey')]
+        if len(candidates) != 1:
+            raise APIError({
+                'code': 'PGRST201' if candidates else 'PGRST200',
+                'message': f"Could not find a unique relationship between '{base}' and '{target}'"
+            })
+        return candidates[0]
+
+    def _project(self, conn, table, items, rows, filters_by_embed=None):
+        """Construye las filas de respuesta con sus columnas y recursos embebidos"""
+        filters_by_embed = filters_by_embed or {}
+        embedded = {}
+        for item in items:
+            if item[0] != 'embed':
+                continue
+            _, name, target, hint, _, sub_items = item
+            base_column, target_column, many = self._relationship(table, target, hint)
+            keys = list({row[base_column] for row in rows if row.get(base_column) is not None})
+            target_rows = []
+            for start in range(0, len(keys), IN_CHUNK_SIZE):
+                chunk = keys[start:start + IN_CHUNK_SIZE]
+                where, params = _where(filters_by_embed.get(name, []) + [_condition(target_column, 'in', chunk)])
+                target_rows.extend(dict(row) for row in conn.execute(f'SELECT * FROM {_quote(target)}{where}', params).fetchall())
+            projected = self._project(conn, target, sub_items, target_rows)
+            lookup = {}
+            for raw, value in zip(target_rows, projected):
+                if many:
+                    lookup.setdefault(raw[target_column], []).append(value)
+                else:
+                    lookup[raw[target_column]] = value
+            embedded[name] = (base_column, many, lookup)
+
+        result = []
+        for row in rows:
+            output = {}
+            for item in items:
+                if item[0] == 'column':
+                    if item[2] == '*':
+                        output.update(row)
+                    else:
+                        output[item[1]] = row[item[2]]
+                else:
+                    base_column, many, lookup = embedded[item[1]]
+                    output[item[1]] = lookup.get(row[base_column], [] if many else None)
+            result.append(output)
+        return result
+
+# Funciones RPC, equivalentes a las de supabase_schema.sql
+
+@_rpc('insert_incident_with_code')
+def _insert_incident_with_code(conn, p_description, p_code=None):
+    with conn:
+        if p_code is not None:
+            conn.execute('INSERT INTO incidents (code, description) VALUES (?, ?)', (p_code, p_description))
+            return p_code
+        while True:
+            conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'incident_code'")
+            value = conn.execute("SELECT value FROM sequences WHERE name = 'incident_code'").fetchone()[0]
+            code = f'{value:03d}'
+            try:
+                conn.execute('INSERT INTO incidents (code, description) VALUES (?, ?)', (code, p_description))
+                return code
+            except sqlite3.IntegrityError:
+                # Código ya ocupado: probar con el siguiente valor
+                continue
+
+@_rpc('get_incident_breakdowns')
+def _get_incident_breakdowns(conn):
+    enriched = '''
+    WITH enriched AS (
+        SELECT
+            COALESCE(w.zone, 'N/A') AS warehouse_zone,
+            COALESCE(w.name, 'N/A') AS warehouse,
+            COALESCE(v.name || ' ' || v.surnames, 'N/A') AS causing_verifier,
+            COALESCE(i.description, 'N/A') AS incident_type,
+            NULLIF(r.status, '') AS status,
+            r.responsible,
+            r.count
+        FROM incident_daily_rollup r
+        LEFT JOIN warehouses w ON w.id = r.warehouse_id
+        LEFT JOIN verifiers v ON v.id = r.causing_verifier_id
+        LEFT JOIN incidents i ON i.id = r.incident_id
+    )
+    '''
+    breakdowns = {
+        'by_zone': ('warehouse_zone', ''),
+        'by_verifier': ('causing_verifier', ''),
+        'by_warehouse': ('warehouse', ''),
+        'by_type': ('incident_type', ''),
+        'by_status': ('status', ''),
+        'assignments_by_verifier': ('causing_verifier', "WHERE responsible = 'Verificador'")
+    }
+    payload = {}
+    for key, (column, where) in breakdowns.items():
+        rows = conn.execute(f'{enriched} SELECT {column}, SUM(count) AS count FROM enriched {where} GROUP BY {column}').fetchall()
+        payload[key] = [dict(row) for row in rows]
+    return payload
+
+@_rpc('get_dashboard_stats')
+def _get_dashboard_stats(conn):
+    rows = conn.execute('''
+        SELECT NULLIF(status, '') AS status, SUM(count) AS count,
+               SUM(CASE WHEN day >= date('now', '-7 days') THEN count ELSE 0 END) AS recent
+        FROM incident_daily_rollup
+        GROUP BY 1
+        ORDER BY count DESC
+    ''').fetchall()
+    return {
+        'total_incidents': sum(row['count'] for row in rows),
+        # status <> 'Solucionado' en SQL: los registros sin estado no cuentan como pendientes
+        'pending_incidents': sum(row['count'] for row in rows
+                                 if row['status'] is not None and row['status'] != 'Solucionado'),
+        'resolved_incidents': sum(row['count'] for row in rows if row['status'] == 'Solucionado'),
+        'recent_incidents': sum(row['recent'] for row in rows),
+        'by_status': [{'status': row['status'], 'count': row['count']} for row in rows]
+    }
+
+@_rpc('get_incident_snapshot_version')
+def _get_incident_snapshot_version(conn):
+    row = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM incident_records) AS records,
+               (SELECT MAX(updated_at) FROM incident_records) AS updated_at,
+               (SELECT value FROM sequences WHERE name = 'reference_version') AS reference
+    ''').fetchone()
+    return dict(row)
+
+@_rpc('search_incident_records')
+def _search_incident_records(conn, p_query, p_limit=20, p_offset=0):
+    # FTS5 en lugar de tsvector: cada palabra como prefijo, todas obligatorias
+    match = ' AND '.join(f'"{word}"*' for word in re.findall(r'\w+', p_query))
+    if not match:
+        return []
+    rows = conn.execute('''
+        SELECT ir.id, ir.date, ir.status, w.name AS warehouse, i.code || ' - ' || i.description AS incident,
+               -bm25(incident_records_fts, 3.0, 2.0, 1.0) AS rank,
+               snippet(incident_records_fts, -1, '**', '**', ' … ', 16) AS snippet,
+               (SELECT COUNT(*) FROM incident_records_fts WHERE incident_records_fts MATCH :match) AS total
+        FROM incident_records_fts
+        JOIN incident_records ir ON ir.id = incident_records_fts.rowid
+        LEFT JOIN warehouses w ON w.id = ir.warehouse_id
+        LEFT JOIN incidents i ON i.id = ir.incident_id
+        WHERE incident_records_fts MATCH :match
+        ORDER BY rank DESC, ir.id DESC
+        LIMIT :limit OFFSET :offset
+    ''', {'match': match, 'limit': p_limit, 'offset': p_offset}).fetchall()
+    return [dict(row) for row in rows]
+
+@_rpc('rebuild_incident_daily_rollup')
+def _rebuild_incident_daily_rollup(conn):
+    with conn:
+        conn.execute('DELETE FROM incident_daily_rollup')
+        conn.execute('''
+            INSERT INTO incident_daily_rollup (day, warehouse_id, causing_verifier_id, incident_id, status, responsible, count)
+            SELECT date(date), COALESCE(warehouse_id, 0), COALESCE(causing_verifier_id, 0), COALESCE(incident_id, 0),
+                   COALESCE(status, ''), COALESCE(responsible, ''), COUNT(*)
+            FROM incident_records
+            GROUP BY 1, 2, 3, 4, 5, 6
+        ''')
+        return conn.execute('SELECT COUNT(*) FROM incident_daily_rollup').fetchone()[0]
+
+@_rpc('apply_incident_actions')
+def _apply_incident_actions(conn, p_actions):
+    columns = ('incident_record_id', 'action_date', 'action_description', 'new_status', 'performed_by')
+    actions = [{column: action.get(column) for column in columns} for action in p_actions]
+    for action in actions:
+        action['new_status'] = action['new_status'] or None
+    # Último estado de cada registro, en el orden de las acciones
+    last_status = {action['incident_record_id']: action['new_status'] for action in actions if action['new_status']}
+    with conn:
+        # La clave foránea de Postgres rechaza toda la llamada si falta algún registro
+        record_ids = {action['incident_record_id'] for action in actions}
+        existing = {row[0] for row in conn.execute(
+            f"SELECT id FROM incident_records WHERE id IN ({','.join('?' * len(record_ids))})", list(record_ids))} if record_ids else set()
+        if record_ids - existing:
+            raise sqlite3.IntegrityError(f'FOREIGN KEY constraint failed: incident_record_id '
+                                         f'{sorted(record_ids - existing)[0]} is not present in "incident_records"')
+        conn.executemany('''
+            INSERT INTO incident_actions (incident_record_id, action_date, action_description, new_status, performed_by)
+            VALUES (:incident_record_id, :action_date, :action_description, :new_status, :performed_by)
+        ''', actions)
+        updated = conn.executemany('UPDATE incident_records SET status = ? WHERE id = ? AND status IS NOT ?',
+                                   [(status, record_id, status) for record_id, status in last_status.items()]).rowcount
+        return {'inserted': len(actions), 'updated': updated}
+
+@_rpc('reset_table_sequences')
+def _reset_table_sequences(conn):
+    # SQLite ya avanza sqlite_sequence con los ids explícitos; solo queda la secuencia de códigos
+    with conn:
+        conn.execute("UPDATE sequences SET value = (SELECT COUNT(*) FROM incidents) WHERE name = 'incident_code'")
+        return {table: conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+                for table in ['coordinators', 'verifiers', 'warehouses', 'incidents', 'incident_records', 'incident_actions']}
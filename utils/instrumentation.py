@@ -0,0 +1,175 @@
+"""Instrumentación de las llamadas a la capa de datos, agregada por rerun de Streamlit y por página"""
+
+import os
+import time
+import inspect
+import logging
+import datetime
+import functools
+import threading
+import contextvars
+from collections import deque
+from .rerun import current_rerun_id, current_session_id
+
+logger = logging.getLogger(__name__)
+
+# Número de reruns que se conservan para el panel de diagnóstico
+DIAGNOSTICS_MAX_RERUNS = int(os.getenv('DIAGNOSTICS_MAX_RERUNS', '50'))
+
+# Llamada instrumentada en curso; las peticiones HTTP y los errores se atribuyen a ella
+_current_call = contextvars.ContextVar('current_call', default=None)
+
+_lock = threading.Lock()
+_reruns = deque(maxlen=DIAGNOSTICS_MAX_RERUNS)
+_reruns_by_key = {}
+
+class CallStats:
+    """Métricas de una llamada a una función pública de datos"""
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.requests = 0
+        self.bytes = 0
+        self.rows = None
+        self.error = None
+
+class RerunStats:
+    """Llamadas hechas durante un rerun de una sesión"""
+
+    def __init__(self, session_id, rerun_id):
+        self.session_id = session_id
+        self.rerun_id = rerun_id
+        self.page = None
+        self.started_at = datetime.datetime.now()
+        self.calls = []
+
+    def total(self, attribute):
+        return sum(getattr(call, attribute) or 0 for call in self.calls)
+
+    def slowest(self, limit=10):
+        return sorted(self.calls, key=lambda call: call.duration, reverse=True)[:limit]
+
+def _rerun_stats():
+    """Registro del rerun actual, creado la primera vez que se usa (None fuera de Streamlit)"""
+    rerun_id = current_rerun_id()
+    if rerun_id is None:
+        return None
+    key = (current_session_id(), rerun_id)
+    with _lock:
+        stats = _reruns_by_key.get(key)
+        if stats is None:
+            if len(_reruns) == _reruns.maxlen:
+                evicted = _reruns[0]
+                _reruns_by_key.pop((evicted.session_id, evicted.rerun_id), None)
+            stats = RerunStats(*key)
+            _reruns.append(stats)
+            _reruns_by_key[key] = stats
+        return stats
+
+def set_page(page):
+    """Asocia el rerun actual a la página que se está mostrando"""
+    stats = _rerun_stats()
+    if stats is not None:
+        stats.page = page
+
+def _count_rows(result):
+    if isinstance(result, dict):
+        result = result.get('records')
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+def instrument(func):
+    """Decorador que registra tiempo, peticiones HTTP, filas y bytes de una función de datos.
+
+    Las llamadas anidadas se atribuyen a la más externa.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_call.get() is not None:
+            return func(*args, **kwargs)
+
+        call = CallStats(func.__name__)
+        token = _current_call.set(call)
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            call.rows = _count_rows(result)
+            return result
+        except Exception as e:
+            call.error = str(e)
+            raise
+        finally:
+            call.duration = time.perf_counter() - started
+            _current_call.reset(token)
+            stats = _rerun_stats()
+            if stats is not None:
+                with _lock:
+                    stats.calls.append(call)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_namespace(namespace, *modules):
+    """Envuelve en `namespace` las funciones públicas definidas en los módulos indicados"""
+    module_names = {module.__name__ for module in modules}
+    for name, value in list(namespace.items()):
+        if (name.startswith('_') or not inspect.isfunction(value)
+                or value.__module__ not in module_names or getattr(value, '__instrumented__', False)):
+            continue
+        namespace[name] = instrument(value)
+
+def _on_response(response):
+    call = _current_call.get()
+    if call is None:
+        return
+    # El cuerpo aún no se ha leído cuando se ejecuta el hook
+    response.read()
+    with _lock:
+        call.requests += 1
+        call.bytes += len(response.content)
+
+def install_http_hooks(session):
+    """Cuenta las peticiones y los bytes de respuesta de un cliente httpx (una sola vez por cliente)"""
+    hooks = session.event_hooks
+    if _on_response not in hooks['response']:
+        hooks['response'] = hooks['response'] + [_on_response]
+        session.event_hooks = hooks
+
+class _CallErrorHandler(logging.Handler):
+    """Anota en la llamada en curso los errores que la capa de datos registra y no propaga"""
+
+    def emit(self, record):
+        call = _current_call.get()
+        if call is not None and call.error is None:
+            call.error = record.getMessage()
+
+def capture_errors(logger_name):
+    """Registra los errores del logger indicado en las métricas de la llamada en curso"""
+    target = logging.getLogger(logger_name)
+    if not any(isinstance(handler, _CallErrorHandler) for handler in target.handlers):
+        target.addHandler(_CallErrorHandler(level=logging.ERROR))
+
+def recent_reruns():
+    """Reruns registrados, del más reciente al más antiguo"""
+    with _lock:
+        return list(reversed(_reruns))
+
+def page_summary():
+    """Agregado por página de los reruns registrados"""
+    pages = {}
+    for stats in recent_reruns():
+        page = pages.setdefault(stats.page or 'Sin página', {'reruns': 0, 'calls': 0, 'requests': 0, 'duration': 0.0, 'bytes': 0})
+        page['reruns'] += 1
+        page['calls'] += len(stats.calls)
+        page['requests'] += stats.total('requests')
+        page['duration'] += stats.total('duration')
+        page['bytes'] += stats.total('bytes')
+    return pages
+
+def clear():
+    """Vacía el registro de reruns"""
+    with _lock:
+        _reruns.clear()
+        _reruns_by_key.clear()
@@ -0,0 +1,413 @@
+"""Copias de seguridad por tablas en NDJSON comprimido con gzip, completas o incrementales
+
+Cada copia es un directorio con un fichero `<tabla>.ndjson.gz` por tabla (una fila JSON por
+línea) y un `manifest.json` con el número de filas, la suma SHA-256 del contenido sin comprimir
+y la marca de agua (mayor updated_at al empezar la copia) de cada tabla. Las filas se escriben
+a medida que llegan, página a página, sin cargar la tabla en memoria.
+
+Una copia incremental solo guarda las filas de las tablas con updated_at modificadas desde la
+marca de agua de la copia anterior; las tablas de referencia, pequeñas, se copian siempre
+enteras. Los borrados no se registran: el manifiesto guarda cuántas filas tenía cada tabla.
+
+La restauración lee las copias en streaming y escribe por lotes (upsert por id), tabla a tabla
+en orden de dependencias, con un punto de control para continuar tras una interrupción.
+"""
+
+import os
+import io
+import json
+import gzip
+import hashlib
+import shutil
+import time
+import logging
+import tarfile
+import datetime
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .snapshot import DELTA_OVERLAP
+
+logger = logging.getLogger(__name__)
+
+# Directorio de las copias de seguridad
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+
+# Número de copias incrementales tras las que se hace de nuevo una completa
+BACKUP_FULL_EVERY = int(os.getenv('BACKUP_FULL_EVERY', '7'))
+
+# Cambiar si cambia la estructura de las copias
+BACKUP_FORMAT = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+# Tablas en orden de dependencias (las referenciadas primero) y si admiten copia incremental
+BACKUP_TABLES = [
+    ('coordinators', False),
+    ('verifiers', False),
+    ('warehouses', False),
+    ('incidents', False),
+    ('incident_records', True),
+    ('incident_actions', True)
+]
+
+# Tablas que se restauran a la vez: cada grupo solo depende de los anteriores
+RESTORE_LEVELS = [
+    ['coordinators', 'verifiers', 'warehouses', 'incidents'],
+    ['incident_records'],
+    ['incident_actions']
+]
+
+# Filas por lote al restaurar y lotes de una misma tabla escritos a la vez
+RESTORE_BATCH_SIZE = int(os.getenv('RESTORE_BATCH_SIZE', '500'))
+RESTORE_WORKERS = int(os.getenv('RESTORE_WORKERS', '4'))
+
+# Tamaño máximo (bytes de JSON) de un lote: las filas con textos largos van en lotes con menos filas
+RESTORE_BATCH_BYTES = int(os.getenv('RESTORE_BATCH_BYTES', str(1024 * 1024)))
+
+RESTORE_CHECKPOINT_NAME = 'restore_checkpoint.json'
+
+# Columnas calculadas por la base de datos, que no se copian
+DERIVED_COLUMNS = ('search_vector',)
+
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00').replace(' ', 'T'))
+
+def _to_utc(value):
+    parsed = _parse_timestamp(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+def list_backups(prefix, backup_dir=None):
+    """Copias de `prefix` con manifiesto válido, de la más antigua a la más reciente: [(ruta, manifiesto)]"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in sorted(os.listdir(backup_dir)):
+        manifest_path = os.path.join(backup_dir, name, MANIFEST_NAME)
+        if not name.startswith(prefix) or not os.path.exists(manifest_path):
+            continue
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring backup {name}: unreadable manifest ({e})")
+            continue
+        if manifest.get('format') == BACKUP_FORMAT:
+            backups.append((os.path.join(backup_dir, name), manifest))
+    return backups
+
+def _write_table(path, rows):
+    """Escribe `rows` en `path` (NDJSON con gzip). Devuelve (filas, sha256)"""
+    digest = hashlib.sha256()
+    count = 0
+    with gzip.open(path, 'wb', compresslevel=6) as f:
+        for row in rows:
+            for column in DERIVED_COLUMNS:
+                row.pop(column, None)
+            line = (json.dumps(row, ensure_ascii=False, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+            f.write(line)
+            digest.update(line)
+            count += 1
+    return count, digest.hexdigest()
+
+def _write_tables(path, base_manifest, read_table, describe_table):
+    """Escribe el fichero de cada tabla; incremental respecto a `base_manifest` si se indica"""
+    tables = {}
+    for table, supports_incremental in BACKUP_TABLES:
+        previous_table = base_manifest['tables'].get(table, {}) if base_manifest else {}
+        since = None
+        if supports_incremental and base_manifest and previous_table.get('high_water'):
+            since = _to_utc(previous_table['high_water']) - datetime.timedelta(seconds=DELTA_OVERLAP)
+
+        # La marca de agua se lee antes que las filas: lo modificado durante la copia entra en la siguiente
+        total_rows, high_water = describe_table(table)
+        file_name = f'{table}.ndjson.gz'
+        rows, checksum = _write_table(os.path.join(path, file_name), read_table(table, since))
+        tables[table] = {
+            'file': file_name,
+            'rows': rows,
+            'sha256': checksum,
+            'incremental': since is not None,
+            'since': since.isoformat() if since is not None else None,
+            'high_water': str(high_water) if high_water is not None else previous_table.get('high_water'),
+            'total_rows': total_rows
+        }
+        logger.info(f"Backed up {table}: {rows} rows{' since ' + since.isoformat() if since else ''}")
+
+    return tables
+
+def write_backup(prefix, source, read_table, describe_table, full=False, backup_dir=None):
+    """Crea una copia de seguridad en un directorio nuevo de `backup_dir` y devuelve su ruta.
+
+    `read_table(tabla, desde)` debe entregar las filas de la tabla (todas si `desde` es None,
+    o las de updated_at >= `desde`) y `describe_table(tabla)` devolver su número de filas y su
+    mayor updated_at (None si la tabla no tiene esa columna).
+    Es incremental si hay una copia anterior de `prefix` y no se pide `full`.
+    """
+    backup_dir = backup_dir or BACKUP_DIR
+    previous = [(path, manifest) for path, manifest in list_backups(prefix, backup_dir) if manifest.get('source') == source]
+    base = previous[-1] if previous else None
+    chain = list(base[1].get('chain', [])) if base else []
+    incremental = base is not None and not full and len(chain) <= BACKUP_FULL_EVERY
+
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    name = f"{prefix}_{created_at.strftime('%Y%m%d_%H%M%S')}{'_inc' if incremental else ''}"
+    path = os.path.join(backup_dir, name)
+    os.makedirs(path)
+
+    try:
+        tables = _write_tables(path, base[1] if incremental else None, read_table, describe_table)
+    except Exception:
+        # Una copia a medias no debe servir de base para la siguiente
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    manifest = {
+        'format': BACKUP_FORMAT,
+        'source': source,
+        'name': name,
+        'type': 'incremental' if incremental else 'full',
+        'base': os.path.basename(base[0]) if incremental else None,
+        # Copias necesarias para restaurar, de la completa a esta
+        'chain': (chain if incremental else []) + [name],
+        'created_at': created_at.isoformat(),
+        'tables': tables
+    }
+    # El manifiesto se escribe el último: sin él la copia no cuenta como base de la siguiente
+    temp_path = os.path.join(path, f'{MANIFEST_NAME}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, os.path.join(path, MANIFEST_NAME))
+    logger.info(f"{manifest['type'].capitalize()} backup written to {path}")
+    return path
+
+def verify_backup(path):
+    """Comprueba las filas y las sumas SHA-256 de una copia. Devuelve la lista de errores"""
+    with open(os.path.join(path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    errors = []
+    for table, info in manifest['tables'].items():
+        digest = hashlib.sha256()
+        count = 0
+        try:
+            with gzip.open(os.path.join(path, info['file']), 'rb') as f:
+                for line in f:
+                    digest.update(line)
+                    count += 1
+        except OSError as e:
+            errors.append(f"{table}: {e}")
+            continue
+        if count != info['rows'] or digest.hexdigest() != info['sha256']:
+            errors.append(f"{table}: {count} filas o suma de control distintas del manifiesto")
+    return errors
+
+def archive_backup(path):
+    """Empaqueta el directorio de una copia en un .tar (sin comprimir: los ficheros ya lo están)"""
+    archive_path = f'{path}.tar'
+    with tarfile.open(archive_path, 'w') as tar:
+        tar.add(path, arcname=os.path.basename(path))
+    return archive_path
+
+class BackupSource:
+    """Copia de seguridad abierta para restaurar: un .tar o directorio de write_backup, o un .json antiguo"""
+
+    def __init__(self, name, manifest, open_table):
+        self.name = name
+        self.manifest = manifest
+        self._open_table = open_table
+
+    @property
+    def chain(self):
+        return self.manifest.get('chain') or [self.name]
+
+    def iter_rows(self, table):
+        """Filas de `table` una a una (ninguna si la copia no incluye la tabla)"""
+        for row in self._open_table(table):
+            for column in DERIVED_COLUMNS:
+                row.pop(column, None)
+            yield row
+
+def _iter_ndjson(fileobj):
+    with gzip.open(fileobj, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def open_backup(fileobj, filename):
+    """Abre una copia subida o guardada: .tar o directorio (NDJSON) o .json (formato anterior).
+
+    El formato anterior es un único documento JSON y se carga entero en memoria.
+    """
+    if isinstance(fileobj, str) and os.path.isdir(fileobj):
+        with open(os.path.join(fileobj, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        def open_table(table):
+            info = manifest['tables'].get(table)
+            return _iter_ndjson(os.path.join(fileobj, info['file'])) if info else iter(())
+        return BackupSource(manifest['name'], manifest, open_table)
+
+    if filename.endswith('.json'):
+        if isinstance(fileobj, str):
+            with open(fileobj, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        else:
+            data = json.load(fileobj)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        return BackupSource(name, {'name': name, 'type': 'full', 'tables': {}}, lambda table: iter(data.get(table) or []))
+
+    # Cada tabla se lee con su propio TarFile: las tablas de un mismo grupo se restauran en hilos distintos
+    if isinstance(fileobj, str):
+        open_tar = lambda: tarfile.open(fileobj, 'r:')
+    else:
+        data = fileobj.getvalue() if hasattr(fileobj, 'getvalue') else fileobj.read()
+        open_tar = lambda: tarfile.open(fileobj=io.BytesIO(data), mode='r:')
+
+    def members(tar):
+        return {member.name.split('/', 1)[-1]: member for member in tar.getmembers() if member.isfile()}
+
+    with open_tar() as tar:
+        manifest_member = members(tar).get(MANIFEST_NAME)
+        if manifest_member is None:
+            raise ValueError(f"{filename} no es una copia de seguridad válida (falta {MANIFEST_NAME})")
+        manifest = json.load(tar.extractfile(manifest_member))
+
+    def open_table(table):
+        info = manifest['tables'].get(table)
+        if not info:
+            return
+        with open_tar() as tar:
+            yield from _iter_ndjson(tar.extractfile(members(tar)[info['file']]))
+    return BackupSource(manifest['name'], manifest, open_table)
+
+def order_backups(sources):
+    """Copias en el orden en que se restauran (de la completa a la más reciente de su cadena).
+
+    Se restaura la cadena de la copia más reciente; falla si falta alguna de sus copias.
+    """
+    by_name = {source.name: source for source in sources}
+    latest = max(sources, key=lambda source: (len(source.chain), source.manifest.get('created_at') or ''))
+    missing = [name for name in latest.chain if name not in by_name]
+    if missing:
+        raise ValueError(f"Faltan copias de la cadena de {latest.name}: {', '.join(missing)}")
+    return [by_name[name] for name in latest.chain]
+
+class RestoreCheckpoint:
+    """Filas ya restauradas por copia y tabla, guardadas en disco tras cada lote confirmado"""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+        self.done = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get('key') == key:
+                    self.done = saved.get('done', {})
+                    logger.info(f"Resuming restore from checkpoint {path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring restore checkpoint {path}: {e}")
+
+    def rows_done(self, backup, table):
+        with self._lock:
+            return self.done.get(backup, {}).get(table, 0)
+
+    def advance(self, backup, table, rows):
+        with self._lock:
+            self.done.setdefault(backup, {})[table] = rows
+            if self.path:
+                temp_path = f'{self.path}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'key': self.key, 'done': self.done}, f)
+                os.replace(temp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+def _batches(rows, size, max_bytes=None):
+    """Lotes de como mucho `size` filas y, si se indica, unos `max_bytes` bytes de JSON"""
+    batch = []
+    batch_bytes = 0
+    for row in rows:
+        batch.append(row)
+        if max_bytes:
+            batch_bytes += len(json.dumps(row, default=str))
+        if len(batch) >= size or (max_bytes and batch_bytes >= max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+def _restore_table(source, table, upsert, checkpoint, batch_size, workers, batch_bytes=None):
+    """Escribe las filas de `table` por lotes, con hasta `workers` lotes a la vez.
+
+    El punto de control avanza con los lotes en orden, así que al continuar no se salta ninguno.
+    """
+    skip = checkpoint.rows_done(source.name, table)
+    rows = source.iter_rows(table)
+    for _ in range(skip):
+        if next(rows, None) is None:
+            break
+    done = skip
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in _batches(rows, batch_size, batch_bytes):
+            pending.append((executor.submit(contextvars.copy_context().run, upsert, table, batch), len(batch)))
+            if len(pending) >= workers:
+                future, size = pending.popleft()
+                future.result()
+                done += size
+                checkpoint.advance(source.name, table, done)
+        while pending:
+            future, size = pending.popleft()
+            future.result()
+            done += size
+            checkpoint.advance(source.name, table, done)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Restored {table} from {source.name}: {done - skip} rows in {elapsed:.1f} s "
+                f"({(done - skip) / elapsed if elapsed else 0:.0f} rows/s)" + (f", resumed after {skip}" if skip else ""))
+    return done - skip
+
+def restore_backups(sources, upsert, reset_sequences, checkpoint_dir=None, batch_size=None, workers=None,
+                    batch_bytes=None, checkpoint_name=None):
+    """Restaura las copias de `sources` con `upsert(tabla, filas)` y devuelve las filas escritas por tabla.
+
+    Las tablas de cada grupo de RESTORE_LEVELS se escriben a la vez. Tras una interrupción,
+    volver a llamar con las mismas copias continúa desde el último lote confirmado.
+    Al terminar se llama a `reset_sequences()` para alinear los identificadores automáticos.
+    """
+    chain = order_backups(sources)
+    checkpoint_dir = checkpoint_dir or BACKUP_DIR
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint = RestoreCheckpoint(os.path.join(checkpoint_dir, checkpoint_name or RESTORE_CHECKPOINT_NAME),
+                                   [source.name for source in chain])
+    batch_size = batch_size or RESTORE_BATCH_SIZE
+    workers = workers or RESTORE_WORKERS
+    batch_bytes = RESTORE_BATCH_BYTES if batch_bytes is None else batch_bytes
+
+    restored = {table: 0 for table, _ in BACKUP_TABLES}
+    started = time.perf_counter()
+    for source in chain:
+        for level in RESTORE_LEVELS:
+            with ThreadPoolExecutor(max_workers=len(level)) as executor:
+                futures = {table: executor.submit(contextvars.copy_context().run, _restore_table, source, table, upsert,
+                                                  checkpoint, batch_size, workers, batch_bytes)
+                           for table in level}
+                for table, future in futures.items():
+                    restored[table] += future.result()
+
+    reset_sequences()
+    checkpoint.clear()
+    elapsed = time.perf_counter() - started
+    total = sum(restored.values())
+    logger.info(f"Restore finished: {restored}, {total} rows in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} rows/s)")
+    return restored
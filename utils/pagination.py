@@ -0,0 +1,93 @@
+"""Lectura completa de tablas de Supabase por páginas con .range()
+
+PostgREST limita el número de filas de cada respuesta (1000 por defecto), así que una
+consulta sin paginar se trunca en silencio cuando la tabla crece.
+"""
+
+import os
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Filas pedidas por página. Si el servidor tiene un límite menor, se usa el suyo
+PAGE_SIZE = int(os.getenv('SUPABASE_PAGE_SIZE', '1000'))
+
+# Páginas descargadas en paralelo por las lecturas que lo permiten
+PAGE_WORKERS = int(os.getenv('SUPABASE_PAGE_WORKERS', '4'))
+
+def _ordered(query, order):
+    for column in order:
+        query = query.order(column.lstrip('-'), desc=column.startswith('-'))
+    return query
+
+def iter_pages(build_query, order=('id',), page_size=None, workers=1):
+    """Recorre una consulta completa página a página.
+
+    `build_query(count)` debe devolver una consulta nueva, con sus filtros, creada con
+    `.select(..., count=count)`. `order` son las columnas de ordenación ('-columna' para
+    descendente) y debe identificar cada fila de forma única para que el orden sea estable.
+    Con `workers` > 1 las páginas se descargan en paralelo, pero se entregan en orden.
+    """
+    page_size = page_size or PAGE_SIZE
+
+    def fetch(start, count=None):
+        return _ordered(build_query(count), order).range(start, start + step - 1).execute()
+
+    step = page_size
+    first = fetch(0, count='exact')
+    if not first.data:
+        return
+    yield first.data
+
+    total = first.count
+    if total is not None and len(first.data) >= total:
+        # Consulta pequeña: una sola petición
+        return
+
+    # El servidor puede devolver menos filas de las pedidas: su límite marca el tamaño de página
+    step = len(first.data)
+    start = step
+    last_size = step
+
+    if total is not None and workers > 1 and total > start:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Como mucho `workers` páginas en vuelo, para no acumular en memoria más de lo necesario
+            pending = deque()
+            starts = iter(range(start, total, step))
+            for page_start in starts:
+                pending.append(executor.submit(contextvars.copy_context().run, fetch, page_start))
+                if len(pending) >= workers:
+                    break
+            while pending:
+                data = pending.popleft().result().data
+                next_start = next(starts, None)
+                if next_start is not None:
+                    pending.append(executor.submit(contextvars.copy_context().run, fetch, next_start))
+                if data:
+                    yield data
+                last_size = len(data)
+                start += step
+
+    # Secuencial: hasta el total contado o, si no se conoce, hasta una página incompleta
+    while last_size == step and (total is None or start < total):
+        data = fetch(start).data
+        if data:
+            yield data
+        last_size = len(data)
+        start += step
+
+def iter_rows(build_query, order=('id',), page_size=None, workers=1):
+    """Igual que iter_pages, pero entrega las filas una a una"""
+    for page in iter_pages(build_query, order, page_size, workers):
+        yield from page
+
+def fetch_all(build_query, order=('id',), page_size=None, workers=1):
+    """Devuelve todas las filas de la consulta en una lista"""
+    rows = []
+    for page in iter_pages(build_query, order, page_size, workers):
+        rows.extend(page)
+    logger.debug(f"Paged read: {len(rows)} rows")
+    return rows
@@ -0,0 +1,62 @@
+"""Carga en paralelo de consultas independientes, con un tiempo máximo por llamada"""
+
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from .rerun import copy_rerun_context
+
+logger = logging.getLogger(__name__)
+
+# Hilos compartidos por todas las sesiones para las cargas en paralelo
+LOADER_WORKERS = int(os.getenv('LOADER_WORKERS', '8'))
+
+# Segundos que se espera a cada llamada antes de darla por perdida
+LOADER_TIMEOUT = float(os.getenv('LOADER_TIMEOUT', '10'))
+
+# Grupo acotado y compartido: una llamada que supera su tiempo sigue ocupando un hilo hasta
+# terminar, pero no se crean hilos nuevos por cada rerun
+_executor = ThreadPoolExecutor(max_workers=LOADER_WORKERS, thread_name_prefix='loader')
+
+class LoadResults:
+    """Resultados de load_concurrently: los valores obtenidos y el motivo de cada llamada fallida"""
+
+    def __init__(self):
+        self.values = {}
+        self.failed = {}
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+def load_concurrently(calls, timeout=None, timeouts=None):
+    """Ejecuta a la vez las llamadas de `calls` ({nombre: función sin argumentos}).
+
+    Cada llamada dispone de `timeout` segundos (o los de `timeouts[nombre]`) desde que se lanza.
+    Las que no terminan a tiempo o lanzan una excepción quedan en `failed` con el motivo
+    ('timeout' o el mensaje de error); el resto, en `values`. Las llamadas se atribuyen al
+    rerun actual.
+    """
+    timeout = LOADER_TIMEOUT if timeout is None else timeout
+    timeouts = timeouts or {}
+    started = time.monotonic()
+    futures = {name: _executor.submit(copy_rerun_context().run, func) for name, func in calls.items()}
+
+    results = LoadResults()
+    for name, future in futures.items():
+        remaining = started + timeouts.get(name, timeout) - time.monotonic()
+        try:
+            results.values[name] = future.result(timeout=max(0, remaining))
+        except FutureTimeoutError:
+            logger.warning(f"{name} did not finish within {timeouts.get(name, timeout)} s")
+            results.failed[name] = 'timeout'
+        except Exception as e:
+            logger.error(f"Error loading {name}: {e}")
+            results.failed[name] = str(e)
+    logger.info(f"Loaded {len(results.values)}/{len(calls)} calls concurrently in {(time.monotonic() - started) * 1000:.0f} ms")
+    return results
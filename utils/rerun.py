@@ -0,0 +1,55 @@
+"""Identificación de la ejecución (rerun) actual del script de Streamlit"""
+
+import itertools
+import threading
+import contextvars
+
+# Contador global del proceso: cada rerun de cualquier sesión recibe un identificador único
+_rerun_counter = itertools.count(1)
+_counter_lock = threading.Lock()
+
+# Sesión y rerun heredados por los hilos auxiliares, que no tienen contexto de Streamlit propio
+_inherited_rerun = contextvars.ContextVar('inherited_rerun', default=None)
+
+def _get_script_run_ctx():
+    """Devuelve el contexto de ejecución de Streamlit del hilo actual, o None fuera de Streamlit"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    return get_script_run_ctx(suppress_warning=True)
+
+def current_session_id():
+    """Identificador de la sesión de Streamlit activa en este hilo (None fuera de Streamlit)"""
+    ctx = _get_script_run_ctx()
+    if ctx is None:
+        inherited = _inherited_rerun.get()
+        return inherited[0] if inherited is not None else None
+    return ctx.session_id
+
+def begin_rerun():
+    """Marca el inicio de un nuevo rerun. Debe llamarse al principio de app.py"""
+    with _counter_lock:
+        rerun_id = next(_rerun_counter)
+    if _get_script_run_ctx() is not None:
+        import streamlit as st
+        st.session_state['_rerun_id'] = rerun_id
+    return rerun_id
+
+def current_rerun_id():
+    """Identificador del rerun en curso de la sesión actual (None fuera de Streamlit)"""
+    if _get_script_run_ctx() is None:
+        inherited = _inherited_rerun.get()
+        return inherited[1] if inherited is not None else None
+    import streamlit as st
+    return st.session_state.get('_rerun_id')
+
+def copy_rerun_context():
+    """Copia del contexto actual que conserva la sesión y el rerun en curso.
+
+    Las funciones ejecutadas en otro hilo con `context.run(func)` se atribuyen al mismo rerun
+    (instrumentación e instantánea de registros). Cada hilo necesita su propia copia.
+    """
+    context = contextvars.copy_context()
+    context.run(_inherited_rerun.set, (current_session_id(), current_rerun_id()))
+    return context
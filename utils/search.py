@@ -0,0 +1,57 @@
+"""Búsqueda global sin distinguir mayúsculas ni acentos, con operaciones vectorizadas de pandas"""
+
+import unicodedata
+import pandas as pd
+
+# Separa los valores de cada fila en el texto de búsqueda, para que un término no coincida a caballo de dos columnas
+_SEPARATOR = '\x1f'
+
+def normalize(text):
+    """Texto en minúsculas y sin acentos ('Cariñena' -> 'carinena')"""
+    return unicodedata.normalize('NFKD', str(text).lower()).encode('ascii', 'ignore').decode('ascii')
+
+def normalize_series(series):
+    """Versión vectorizada de normalize para una columna"""
+    return (series.astype(str).str.lower().str.normalize('NFKD')
+            .str.encode('ascii', 'ignore').str.decode('ascii'))
+
+def searchable_columns(df):
+    """Columnas que se muestran al usuario: sin claves ajenas (*_id) ni la marca de modificación"""
+    return [column for column in df.columns if not column.endswith('_id') and column != 'updated_at']
+
+def build_search_text(df, key='id'):
+    """Texto normalizado de cada fila con los valores de todas sus columnas visibles, indexado por `key`"""
+    if df.empty:
+        return pd.Series([], dtype=str)
+    columns = searchable_columns(df)
+    text = df[columns[0]].fillna('').astype(str)
+    for column in columns[1:]:
+        text = text + _SEPARATOR + df[column].fillna('').astype(str)
+    text = normalize_series(text)
+    if key in df.columns:
+        text.index = df[key].values
+    return text
+
+def merge_search_text(search_text, changed_text):
+    """Sustituye o añade el texto de las filas cambiadas (ambas series indexadas por clave)"""
+    if changed_text.empty:
+        return search_text
+    kept = search_text[~search_text.index.isin(changed_text.index)]
+    return pd.concat([kept, changed_text])
+
+def matching_keys(search_text, term):
+    """Claves de las filas cuyo texto contiene `term`"""
+    return search_text.index[search_text.str.contains(normalize(term), regex=False)]
+
+def filter_dataframe(df, term, search_text=None, key='id'):
+    """Filas de `df` que contienen `term` en alguna columna visible.
+
+    Con `search_text` (de build_search_text) se reutiliza el texto ya normalizado.
+    """
+    if not term or df.empty:
+        return df
+    if search_text is None:
+        search_text = build_search_text(df, key)
+    if key not in df.columns:
+        return df[search_text.str.contains(normalize(term), regex=False).values]
+    return df[df[key].isin(matching_keys(search_text, term))]
@@ -0,0 +1,276 @@
+"""Instantánea compartida de los registros de incidencias enriquecidos"""
+
+import os
+import time
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+import pandas as pd
+from .rerun import current_rerun_id, current_session_id
+from .search import build_search_text, merge_search_text, filter_dataframe
+
+logger = logging.getLogger(__name__)
+
+# Segundos durante los que una instantánea se reutiliza entre reruns (y entre sesiones).
+# Con 0 solo se reutiliza dentro del mismo rerun.
+SNAPSHOT_MAX_AGE = float(os.getenv('INCIDENT_SNAPSHOT_MAX_AGE', '0'))
+
+# Número máximo de sesiones de las que se conserva la instantánea
+MAX_SESSIONS = 32
+
+# Segundos que se solapan las lecturas incrementales con la anterior: cubren las transacciones
+# que se confirman después de la lectura con un updated_at anterior a la marca de agua
+DELTA_OVERLAP = float(os.getenv('INCIDENT_SNAPSHOT_DELTA_OVERLAP', '5'))
+
+def watermark_of(df, column='updated_at'):
+    """Marca de agua de un DataFrame: el mayor `column` (UTC), o None si no hay datos"""
+    if df is None or df.empty or column not in df.columns:
+        return None
+    latest = pd.to_datetime(df[column], utc=True, format='ISO8601').max()
+    return None if pd.isna(latest) else latest.to_pydatetime()
+
+def _version_time(version):
+    """updated_at de una versión del servidor (UTC), o None"""
+    if not version or not version.get('updated_at'):
+        return None
+    return pd.to_datetime(version['updated_at'], utc=True, format='ISO8601').to_pydatetime()
+
+def _went_backwards(base, version):
+    """Indica si el último updated_at del servidor es anterior al de `base`: los datos volvieron
+    atrás (restauración de una copia), y los cambios desde la marca de agua no lo reflejan"""
+    current = _version_time(version)
+    if current is None:
+        return False
+    return any(previous is not None and current < previous for previous in (base.watermark, _version_time(base.version)))
+
+def merge_changes(df, changes, key='id'):
+    """Aplica sobre `df` las filas cambiadas: sustituye las que ya existían y añade las nuevas.
+
+    Devuelve un DataFrame nuevo ordenado por `key`; `df` no se modifica.
+    """
+    if changes is None or changes.empty:
+        return df
+    if df.empty:
+        return changes.sort_values(key, ignore_index=True)
+    kept = df[~df[key].isin(changes[key])]
+    merged = pd.concat([kept, changes[df.columns.intersection(changes.columns)]], ignore_index=True)
+    return merged.sort_values(key, kind='stable', ignore_index=True)
+
+class IncidentSnapshot:
+    """Registros de incidencias enriquecidos, obtenidos una vez y compartidos por todas las vistas derivadas.
+
+    El DataFrame es de solo lectura: las vistas derivadas lo filtran y agrupan sin modificarlo.
+    """
+
+    def __init__(self, df, rerun_id=None, watermark=None, version=None):
+        self.df = df
+        self.rerun_id = rerun_id
+        self.fetched_at = time.monotonic()
+        self.watermark = watermark if watermark is not None else watermark_of(df)
+        # Versión del servidor (version_loader) leída antes de obtener los datos
+        self.version = version
+        self._search_text = None
+        self._search_lock = threading.Lock()
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+    def age(self):
+        """Segundos transcurridos desde que se obtuvieron los datos"""
+        return time.monotonic() - self.fetched_at
+
+    def is_valid_for(self, rerun_id, max_age):
+        """Indica si la instantánea puede reutilizarse en el rerun indicado"""
+        if rerun_id is not None and rerun_id == self.rerun_id:
+            return True
+        return max_age > 0 and self.age() < max_age
+
+    @property
+    def search_text(self):
+        """Texto normalizado de cada registro (indexado por id) para la búsqueda global; se construye una vez"""
+        with self._search_lock:
+            if self._search_text is None:
+                self._search_text = build_search_text(self.df)
+            return self._search_text
+
+    def carry_search_text(self, base, changes=None):
+        """Reutiliza el texto de búsqueda ya construido de `base`, recalculando solo las filas cambiadas"""
+        if base._search_text is None:
+            return
+        if changes is None or changes.empty:
+            self._search_text = base._search_text
+        else:
+            self._search_text = merge_search_text(base._search_text, build_search_text(changes))
+
+    def search(self, term):
+        """Registros que contienen `term` en alguna columna visible, sin distinguir mayúsculas ni acentos"""
+        return filter_dataframe(self.df, term, self.search_text)
+
+    def where(self, **equals):
+        """Filas cuyas columnas coinciden con los valores indicados"""
+        df = self.df
+        if df.empty:
+            return df
+        for column, value in equals.items():
+            df = df[df[column] == value]
+        return df
+
+    def count_by(self, column, **equals):
+        """Número de registros por valor de `column`, opcionalmente sobre un subconjunto filtrado"""
+        df = self.where(**equals)
+        if df.empty:
+            return pd.DataFrame(columns=[column, 'count'])
+        return df.groupby(column).size().reset_index(name='count')
+
+class SnapshotStore:
+    """Guarda la instantánea de cada sesión y decide cuándo hay que volver a obtenerla.
+
+    Se obtiene como máximo una vez por rerun de Streamlit, o una vez por ventana de
+    frescura (SNAPSHOT_MAX_AGE) compartida entre todas las sesiones del proceso.
+
+    Con `delta_loader(watermark)`, que devuelve solo las filas cambiadas desde la marca de
+    agua (o None si no puede), las renovaciones parten de la última instantánea y descargan
+    únicamente los cambios; la descarga completa queda para la primera vez y tras invalidate().
+
+    Con `version_loader()`, que devuelve un dict {'records', 'updated_at', 'reference'} (o None),
+    cada renovación empieza por esa consulta: si la versión no ha cambiado se reutiliza la base
+    sin descargar nada, y si cambió 'reference' (tablas de referencia) o el número de registros
+    no cuadra tras aplicar los cambios (borrados), se descarga todo. También si el último updated_at
+    del servidor es anterior al de la base: los datos volvieron atrás.
+
+    Con `snapshot_file` (SnapshotFile) la instantánea se guarda en disco y un proceso recién
+    arrancado parte de ella en lugar de descargarla entera.
+    """
+
+    def __init__(self, loader, max_age=None, delta_loader=None, version_loader=None, snapshot_file=None):
+        self.loader = loader
+        self.delta_loader = delta_loader
+        self.version_loader = version_loader
+        self.snapshot_file = snapshot_file
+        self.max_age = SNAPSHOT_MAX_AGE if max_age is None else max_age
+        self._snapshots = OrderedDict()
+        self._latest = None
+        self._base = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._session_locks = {}
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _cached(self, session_id, rerun_id):
+        with self._lock:
+            snapshot = self._snapshots.get(session_id)
+            if snapshot is not None and snapshot.is_valid_for(rerun_id, self.max_age):
+                return snapshot
+            latest = self._latest
+            if latest is not None and self.max_age > 0 and latest.age() < self.max_age:
+                return latest
+            return None
+
+    def _store(self, session_id, snapshot, generation):
+        with self._lock:
+            # Si hubo una escritura durante la descarga, los datos ya no son fiables
+            if generation != self._generation:
+                return False
+            self._snapshots[session_id] = snapshot
+            self._snapshots.move_to_end(session_id)
+            while len(self._snapshots) > MAX_SESSIONS:
+                evicted, _ = self._snapshots.popitem(last=False)
+                self._session_locks.pop(evicted, None)
+            self._latest = snapshot
+            self._base = snapshot
+            return True
+
+    def get(self):
+        """Devuelve la instantánea vigente, obteniéndola si no hay ninguna válida"""
+        session_id = current_session_id()
+        rerun_id = current_rerun_id()
+        snapshot = self._cached(session_id, rerun_id)
+        if snapshot is not None:
+            return snapshot
+
+        # Evitar que dos hilos de la misma sesión descarguen los datos a la vez
+        with self._session_lock(session_id):
+            snapshot = self._cached(session_id, rerun_id)
+            if snapshot is not None:
+                return snapshot
+            with self._lock:
+                generation = self._generation
+                base = self._base
+            snapshot, kind = self._refresh(base, rerun_id)
+            stored = self._store(session_id, snapshot, generation)
+            if stored and self.snapshot_file is not None and kind != 'unchanged':
+                self.snapshot_file.save_async(snapshot, full=kind == 'full')
+            return snapshot
+
+    def _load_version(self):
+        if self.version_loader is None:
+            return None
+        return self.version_loader()
+
+    def _refresh(self, base, rerun_id):
+        """Instantánea nueva a partir de `base` (o del disco), de los cambios o de una descarga completa.
+
+        Devuelve la instantánea y cómo se obtuvo: 'unchanged', 'delta' o 'full'.
+        """
+        version = self._load_version()
+        if base is None and self.snapshot_file is not None:
+            base = self.snapshot_file.load(version)
+
+        if base is not None and version is not None and base.version is not None:
+            if base.version == version:
+                snapshot = IncidentSnapshot(base.df, rerun_id, base.watermark, version)
+                snapshot.carry_search_text(base)
+                return snapshot, 'unchanged'
+            if base.version.get('reference') != version.get('reference'):
+                logger.info("Reference tables changed: reloading the incident snapshot")
+                base = None
+        if base is not None and version is not None and _went_backwards(base, version):
+            logger.info("Server data is older than the incident snapshot (restored backup?): reloading")
+            base = None
+
+        snapshot = self._load_delta(base, rerun_id, version)
+        if snapshot is not None and version is not None and len(snapshot.df) != version['records']:
+            # Registros borrados (o escritos durante la lectura): no se pueden deducir de los cambios
+            logger.info(f"Incident snapshot has {len(snapshot.df)} records, server has {version['records']}: reloading")
+            snapshot = None
+        if snapshot is not None:
+            return snapshot, 'delta'
+        snapshot = IncidentSnapshot(self.loader(), rerun_id, version=version)
+        logger.info(f"Incident snapshot refreshed: {len(snapshot.df)} records")
+        return snapshot, 'full'
+
+    def _load_delta(self, base, rerun_id, version=None):
+        """Instantánea nueva a partir de `base` y de las filas cambiadas desde su marca de agua"""
+        if self.delta_loader is None or base is None or base.watermark is None:
+            return None
+        since = base.watermark - datetime.timedelta(seconds=DELTA_OVERLAP)
+        changes = self.delta_loader(since)
+        if changes is None:
+            return None
+        watermark = max(filter(None, [base.watermark, watermark_of(changes)]))
+        snapshot = IncidentSnapshot(merge_changes(base.df, changes), rerun_id, watermark, version)
+        snapshot.carry_search_text(base, changes)
+        logger.info(f"Incident snapshot updated: {len(changes)} changed records")
+        return snapshot
+
+    def expire(self):
+        """Fuerza una renovación en la próxima lectura, conservando la última instantánea como base
+        de la lectura incremental (tras escribir en las filas de la propia tabla)"""
+        with self._lock:
+            self._snapshots.clear()
+            self._latest = None
+            self._generation += 1
+
+    def invalidate(self):
+        """Descarta todas las instantáneas, incluida la base incremental (tras escrituras que cambian
+        los datos enriquecidos sin tocar las filas, como renombrar una bodega)"""
+        with self._lock:
+            self._snapshots.clear()
+            self._latest = None
+            self._base = None
+            self._generation += 1
@@ -0,0 +1,129 @@
+"""Copia en disco (Parquet) de la instantánea de registros enriquecidos, para arranques en caliente"""
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from .snapshot import IncidentSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Directorio de las instantáneas en disco. Vacío desactiva la persistencia
+SNAPSHOT_DIR = os.getenv('INCIDENT_SNAPSHOT_DIR', os.path.join('db', 'snapshots'))
+
+# Segundos mínimos entre dos escrituras tras renovaciones incrementales (las completas siempre se guardan)
+SNAPSHOT_SAVE_INTERVAL = float(os.getenv('INCIDENT_SNAPSHOT_SAVE_INTERVAL', '60'))
+
+# Cambiar al modificar las columnas de los DataFrames enriquecidos: invalida los ficheros anteriores
+SNAPSHOT_FILE_FORMAT = 1
+
+_METADATA_KEY = b'crm_snapshot'
+
+class SnapshotFile:
+    """Fichero Parquet con una instantánea y sus metadatos (origen, marca de agua y versión del servidor).
+
+    `source()` identifica la base de datos de origen; un fichero de otro origen se ignora.
+    Requiere pyarrow: sin él la persistencia queda desactivada.
+    """
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self._save_lock = threading.Lock()
+        self._saved_at = None
+
+    @property
+    def path(self):
+        return os.path.join(SNAPSHOT_DIR, f'{self.name}.parquet')
+
+    @property
+    def enabled(self):
+        return bool(SNAPSHOT_DIR)
+
+    def _read_metadata(self, pq):
+        metadata = pq.read_schema(self.path).metadata or {}
+        return json.loads(metadata[_METADATA_KEY])
+
+    def load(self, version=None):
+        """Instantánea guardada, o None si no hay, es de otro origen o formato, o sus tablas de
+        referencia no coinciden con `version`"""
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.warning("pyarrow is not installed: incident snapshot persistence disabled")
+            return None
+
+        started = time.perf_counter()
+        try:
+            meta = self._read_metadata(pq)
+            if meta.get('format') != SNAPSHOT_FILE_FORMAT or meta.get('source') != self.source():
+                logger.info(f"Ignoring incident snapshot file {self.path}: different format or source")
+                return None
+            saved_version = meta.get('version')
+            if version is not None and saved_version is not None and saved_version.get('reference') != version.get('reference'):
+                logger.info(f"Ignoring incident snapshot file {self.path}: reference tables changed")
+                return None
+            df = pq.read_table(self.path).to_pandas()
+        except Exception as e:
+            logger.warning(f"Could not read incident snapshot file {self.path}: {e}")
+            return None
+
+        watermark = datetime.datetime.fromisoformat(meta['watermark']) if meta.get('watermark') else None
+        logger.info(f"Incident snapshot loaded from {self.path}: {len(df)} records in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return IncidentSnapshot(df, watermark=watermark, version=saved_version)
+
+    def save(self, snapshot):
+        """Escribe la instantánea de forma atómica (fichero temporal y os.replace)"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        meta = {
+            'format': SNAPSHOT_FILE_FORMAT,
+            'source': self.source(),
+            'watermark': snapshot.watermark.isoformat() if snapshot.watermark else None,
+            'version': snapshot.version,
+            'saved_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }
+        table = pa.Table.from_pandas(snapshot.df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), _METADATA_KEY: json.dumps(meta, default=str).encode('utf-8')})
+
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, self.path)
+        logger.info(f"Incident snapshot saved to {self.path}: {len(snapshot.df)} records")
+
+    def delete(self):
+        """Borra la instantánea guardada (p. ej. tras sustituir la base de datos de origen)"""
+        if self.enabled and os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info(f"Incident snapshot file {self.path} deleted")
+
+    def _save_quietly(self, snapshot):
+        try:
+            self.save(snapshot)
+        except ImportError:
+            logger.warning("pyarrow is not installed: incident snapshot persistence disabled")
+        except Exception as e:
+            logger.warning(f"Could not save incident snapshot file {self.path}: {e}")
+        finally:
+            self._save_lock.release()
+
+    def save_async(self, snapshot, full=False):
+        """Guarda la instantánea en un hilo aparte, sin bloquear el rerun.
+
+        Tras una renovación incremental solo se escribe si pasó SNAPSHOT_SAVE_INTERVAL desde la
+        última escritura; si ya hay una escritura en curso, esta se omite.
+        """
+        if not self.enabled:
+            return
+        if not full and self._saved_at is not None and time.monotonic() - self._saved_at < SNAPSHOT_SAVE_INTERVAL:
+            return
+        if not self._save_lock.acquire(blocking=False):
+            return
+        self._saved_at = time.monotonic()
+        threading.Thread(target=self._save_quietly, args=(snapshot,), name=f'save-{self.name}', daemon=True).start()
@@ -0,0 +1,247 @@
+"""Conexiones SQLite reutilizadas por hilo, en modo WAL y con medición de la espera del bloqueo de escritura
+
+Cada hilo conserva una conexión abierta por fichero de base de datos. `close()` no la cierra:
+deshace la transacción que haya quedado abierta y la deja lista para la siguiente llamada, así
+que el código existente (`conn = get_db_connection()` ... `conn.close()`) no cambia.
+
+Las escrituras toman el bloqueo al empezar la transacción (BEGIN IMMEDIATE), no al primer
+INSERT/UPDATE/DELETE: así la espera respeta busy_timeout en modo WAL y se puede medir.
+
+Para sustituir el fichero de la base de datos (restauración), `replacing(path)` espera a que los
+demás hilos terminen la llamada en curso y no deja abrir conexiones hasta acabar.
+"""
+
+import os
+import re
+import time
+import contextlib
+import sqlite3
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Milisegundos que una escritura espera a que otra libere el bloqueo antes de fallar con "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+
+# Consultas preparadas que conserva cada conexión
+SQLITE_CACHED_STATEMENTS = int(os.getenv('SQLITE_CACHED_STATEMENTS', '256'))
+
+# Esperas del bloqueo de escritura (segundos) a partir de las cuales se registra un aviso
+SQLITE_LOCK_WAIT_WARNING = float(os.getenv('SQLITE_LOCK_WAIT_WARNING', '0.5'))
+
+# Pragmas de cada conexión nueva. En WAL, synchronous=NORMAL no pierde integridad ante un fallo
+# del proceso (solo las últimas transacciones ante un corte de corriente)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', '32768')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT
+}
+
+_BEGIN_WRITE = re.compile(r'\s*BEGIN\s+(IMMEDIATE|EXCLUSIVE)\b', re.IGNORECASE)
+_WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+class LockWaitStats:
+    """Esperas del bloqueo de escritura acumuladas en el proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.timeouts = 0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.count += 1
+            self.total += wait
+            self.max = max(self.max, wait)
+            self.timeouts += int(timed_out)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max,
+                'timeouts': self.timeouts
+            }
+
+lock_wait_stats = LockWaitStats()
+
+class PooledCursor(sqlite3.Cursor):
+    """Cursor que abre las transacciones de escritura con BEGIN IMMEDIATE y mide la espera"""
+
+    def _begin_write(self, sql=None):
+        started = time.perf_counter()
+        try:
+            super().execute(sql or 'BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            wait = time.perf_counter() - started
+            lock_wait_stats.record(wait, timed_out=True)
+            logger.warning(f"SQLite write lock not acquired after {wait * 1000:.0f} ms: {e}")
+            raise
+        wait = time.perf_counter() - started
+        lock_wait_stats.record(wait)
+        if wait >= SQLITE_LOCK_WAIT_WARNING:
+            logger.warning(f"SQLite write lock acquired after {wait * 1000:.0f} ms")
+
+    def _prepare(self, sql):
+        """Toma el bloqueo si `sql` empieza una escritura. Devuelve True si `sql` ya se ejecutó"""
+        if _BEGIN_WRITE.match(sql):
+            self._begin_write(sql)
+            return True
+        if not self.connection.in_transaction and _WRITE_STATEMENT.match(sql):
+            self._begin_write()
+        return False
+
+    def execute(self, sql, parameters=()):
+        if self._prepare(sql):
+            return self
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._prepare(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión compartida por las llamadas de un hilo. `close()` la devuelve al hilo sin cerrarla"""
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    # Connection.execute crea su cursor internamente sin pasar por cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.in_transaction:
+            # Transacción sin confirmar (error o salida anticipada): mismo efecto que cerrar la conexión
+            self.rollback()
+        if self.busy:
+            lock = _path_lock(self.path)
+            with lock:
+                self.busy = False
+                lock.notify_all()
+
+    def close_connection(self):
+        """Cierra de verdad la conexión"""
+        super().close()
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_registry = weakref.WeakSet()
+_generations = {}
+_path_locks = {}
+# Hilo que está sustituyendo cada fichero
+_replacing = {}
+
+def _path_lock(path):
+    """Condición (sobre un bloqueo reentrante) de `path`: la toman connect() y replacing()"""
+    with _registry_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.Condition(threading.RLock())
+        return lock
+
+def _open(path):
+    conn = sqlite3.connect(path, factory=PooledConnection, cached_statements=SQLITE_CACHED_STATEMENTS,
+                           check_same_thread=False)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        try:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Could not set PRAGMA {pragma} on {path}: {e}")
+    conn.row_factory = sqlite3.Row
+    conn.path = path
+    # En uso entre connect() y close(), por el hilo `owner`
+    conn.busy = False
+    conn.owner = None
+    with _registry_lock:
+        _registry.add(conn)
+    return conn
+
+def connect(path):
+    """Conexión del hilo actual a `path`, abierta la primera vez y reutilizada después"""
+    path = os.path.abspath(path)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    lock = _path_lock(path)
+    me = threading.get_ident()
+    with lock:
+        entry = connections.get(path)
+        # Mientras otro hilo sustituye el fichero solo continúan las llamadas anidadas en una en curso
+        lock.wait_for(lambda: _replacing.get(path, me) == me or (entry is not None and entry[0].busy))
+        generation = _generations.get(path, 0)
+        if entry is None or entry[1] != generation:
+            if entry is not None:
+                entry[0].close_connection()
+            entry = connections[path] = (_open(path), generation)
+        conn = entry[0]
+        conn.busy = True
+        conn.owner = me
+    if conn.in_transaction:
+        # Una llamada anterior salió por una excepción sin llamar a close()
+        logger.warning(f"Rolling back a transaction left open on {path}")
+        conn.rollback()
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def checkpoint(path):
+    """Vuelca el WAL en el fichero principal, para copiarlo sin perder transacciones confirmadas"""
+    conn = connect(path)
+    try:
+        return conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    finally:
+        conn.close()
+
+@contextlib.contextmanager
+def replacing(path):
+    """Bloque en el que se puede sustituir el fichero `path` (y borrar su WAL) sin conexiones abiertas.
+
+    Desde que empieza, connect() no abre llamadas nuevas en otros hilos; espera a que terminen las
+    que están en curso (como mucho SQLITE_BUSY_TIMEOUT; si no, lanza OperationalError sin tocar
+    nada), cierra todas las conexiones a `path` y mantiene connect() bloqueado hasta salir del bloque. Después cada hilo abre una conexión nueva en su siguiente llamada.
+    """
+    path = os.path.abspath(path)
+    lock = _path_lock(path)
+    me = threading.get_ident()
+
+    def connections(in_use=False):
+        with _registry_lock:
+            return [conn for conn in _registry
+                    if conn.path == path and (not in_use or (conn.busy and conn.owner != me))]
+
+    with lock:
+        _replacing[path] = me
+        try:
+            if not lock.wait_for(lambda: not connections(in_use=True), timeout=SQLITE_BUSY_TIMEOUT / 1000):
+                raise sqlite3.OperationalError(f"database is in use by other threads: {path}")
+            closed = connections()
+            for conn in closed:
+                try:
+                    conn.close_connection()
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not close SQLite connection to {path}: {e}")
+            logger.info(f"Closed {len(closed)} SQLite connections to {path}")
+            try:
+                yield
+            finally:
+                # Después de sustituir el fichero: las conexiones cerradas no se vuelven a usar
+                _generations[path] = _generations.get(path, 0) + 1
+        finally:
+            del _replacing[path]
+            lock.notify_all()